@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import traceback
+
+import numpy as np
+import weaviate
+from dotenv import dotenv_values
+
+from collect_orphans import delete_objects
+from import_manifest import ImportManifest
+from log_handler import LogHandler
+from mail_sender import MailSender
+from similar_authors import SimilarAuthors, similar_authors_file, top_k_neighbours, DEFAULT_NEIGHBOURS
+from uuid_provider import UUIDProvider
+from vector_index import load_index_config
+from weaviate_cursor import scan, DEFAULT_PAGE_SIZE
+from weaviate_import import configure, with_index, ImportMetrics, sampled, SENTENCE_CLASS_NAMES
+
+DEFAULT_MIN_SENTENCES = 3
+
+# profile class computed from each sentence class, in the vector space of its model
+PROFILE_CLASS_NAMES = {
+    "SbertSentence": "SbertAuthorProfile",
+    "AdaSentence": "AdaAuthorProfile",
+}
+
+weaviate_params = dict(dotenv_values(".env.weaviate"))
+
+
+def profile_class(class_name):
+    return {
+        "class": class_name,
+        "description": "Expertise profile of an author, centroid of the vectors of the sentences of its publications",
+        "properties": [
+            {
+                "dataType": [
+                    "string"
+                ],
+                "description": "Author identifier, as in the Author class",
+                "name": "identifier",
+            },
+            {
+                "dataType": [
+                    "string"
+                ],
+                "description": "Author name",
+                "name": "name",
+            },
+            {
+                "dataType": [
+                    "boolean"
+                ],
+                "description": "If the author belongs to our institution",
+                "name": "own_inst",
+            },
+            {
+                "dataType": [
+                    "string"
+                ],
+                "description": "Uuid of the profiled object of the Author class",
+                "name": "author_uuid",
+            },
+            {
+                "dataType": [
+                    "int"
+                ],
+                "description": "Number of sentences the profile was computed from",
+                "name": "sentence_count",
+            }
+        ]
+    }
+
+
+def get_client():
+    return weaviate.Client(weaviate_params['host'], timeout_config=(1000, 1000))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Computes the expertise profile vectors of the authors from the vectors of their sentences.')
+    parser.add_argument('--weaviate_rows', dest='weaviate_rows',
+                        help='Number of requested rows per request (Weaviate)', default=DEFAULT_PAGE_SIZE,
+                        required=False, type=int)
+    parser.add_argument('--min_sentences', dest='min_sentences',
+                        help='Minimal number of sentences for an author to be profiled',
+                        default=DEFAULT_MIN_SENTENCES, required=False, type=int)
+    parser.add_argument('--index_config', dest='index_config',
+                        help='JSON file of vector index parameters by class, applied when creating the profile '
+                             'classes', required=False, default=None)
+    parser.add_argument('--neighbours', dest='neighbours',
+                        help='Number of similar authors computed for each author of the institution',
+                        default=DEFAULT_NEIGHBOURS, required=False, type=int)
+    parser.add_argument('--manifest_file', dest='manifest_file',
+                        help='Import manifest used to skip unchanged profiles', required=False,
+                        default=ImportManifest.DEFAULT_MANIFEST_FILE)
+    return parser.parse_args()
+
+
+def profile_uuid(class_name, author_uuid):
+    return str(UUIDProvider(f"{class_name}-{author_uuid}").value())
+
+
+def publication_authors(client, page_size):
+    """Maps the publications to the uuids of their authors
+
+    Returns
+    -------
+    authors: dict of lists of author uuids by publication uuid
+    """
+    return {item['_additional']['id']: [author['_additional']['id'] for author in item.get('hasAuthors', None) or []]
+            for item in scan(client, "Publication", ["hasAuthors { ... on Author { _additional { id } } }"],
+                             page_size)}
+
+
+def author_centroids(client, sentence_class, authors, pub_authors, page_size):
+    """Accumulates the normalized sentence vectors of each author, in a single pass over the sentences
+
+    Parameters
+    ----------
+    authors : list, required
+            uuids of the authors, giving their row in the accumulator
+    pub_authors : dict, required
+            author uuids by publication uuid
+
+    Returns
+    -------
+    centroids, counts: array of normalized centroids (one row per author), array of sentence counts
+    """
+    rows = {author_uuid: row for row, author_uuid in enumerate(authors)}
+    sums = None
+    counts = np.zeros(len(authors), dtype=np.int64)
+    for index, item in enumerate(scan(client, sentence_class,
+                                      ["hasPublication { ... on Publication { _additional { id } } }"], page_size,
+                                      ["vector"])):
+        pub_uuid = next((pub['_additional']['id'] for pub in item.get('hasPublication', None) or []), None)
+        author_rows = [rows[author_uuid] for author_uuid in pub_authors.get(pub_uuid, []) if author_uuid in rows]
+        if len(author_rows) == 0:
+            continue
+        vector = np.asarray(item['_additional']['vector'], dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        if sums is None:
+            sums = np.zeros((len(authors), len(vector)), dtype=np.float32)
+        sums[author_rows] += vector
+        counts[author_rows] += 1
+        if sampled(index):
+            logger.info(f"{index} {sentence_class} objects read")
+    if sums is None:
+        return np.zeros((len(authors), 0), dtype=np.float32), counts
+    sums /= np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return sums, counts
+
+
+def ensure_class(client, class_name, index_config):
+    existing = {class_definition['class'] for class_definition in client.schema.get().get('classes', [])}
+    if class_name not in existing:
+        logger.info(f"Creating class {class_name}")
+        client.schema.create_class(with_index(profile_class(class_name), index_config))
+
+
+def import_profiles(client, class_name, authors, centroids, counts, min_sentences, manifest, metrics):
+    """Sends the new or changed profiles and removes those of the authors no longer profiled
+
+    Returns
+    -------
+    sent, deleted: int number of profiles sent, int number of profiles removed
+    """
+    profiles = {}
+    for row, (author_uuid, props) in enumerate(authors.items()):
+        if counts[row] < min_sentences:
+            continue
+        profiles[profile_uuid(class_name, author_uuid)] = (props | {'author_uuid': author_uuid,
+                                                                     'sentence_count': int(counts[row])},
+                                                           centroids[row])
+    entries = [(class_name, uuid) + ImportManifest.hashes(props | {'vector': vector})
+               for uuid, (props, vector) in profiles.items()]
+    changed = manifest.changed(entries)
+    for _, uuid, content_hash, vector_hash in changed:
+        props, vector = profiles[uuid]
+        client.batch.add_data_object({key: value for key, value in props.items() if value is not None}, class_name,
+                                     uuid, list(map(float, vector)))
+    client.batch.flush()
+    # the rejected profiles are sent again at the next run
+    manifest.put_many([entry for entry in changed if entry[1] not in metrics.failed_ids])
+    stale = [item['_additional']['id'] for item in scan(client, class_name, [], DEFAULT_PAGE_SIZE)
+             if item['_additional']['id'] not in profiles]
+    deleted = delete_objects(client, class_name, stale, manifest)
+    return len(changed), deleted
+
+
+def save_similar_authors(file_path, authors, centroids, counts, min_sentences, k):
+    """Computes and saves the nearest authors of the institution of each author of the institution
+
+    Returns
+    -------
+    count: int number of authors of the institution with a profile
+    """
+    rows = [row for row, props in enumerate(authors.values()) if props['own_inst'] is True and
+            counts[row] >= min_sentences]
+    neighbours, scores = top_k_neighbours(centroids[rows], k)
+    properties = list(authors.values())
+    SimilarAuthors.save(file_path, [properties[row]['identifier'] for row in rows],
+                        [properties[row]['name'] or '' for row in rows], neighbours, scores)
+    return len(rows)
+
+
+def main(args):
+    global logger
+    logger = LogHandler("author_profiles", 'log', 'author_profiles.log', logging.INFO).create_rotating_log()
+    client = get_client()
+    metrics = ImportMetrics(client)
+    configure(client, callback=metrics.callback)
+    manifest = ImportManifest(args.manifest_file)
+    index_config = load_index_config(args.index_config)
+    authors = {item['_additional']['id']: {key: item.get(key, None) for key in ['identifier', 'name', 'own_inst']}
+               for item in scan(client, "Author", ['identifier', 'name', 'own_inst'], args.weaviate_rows)}
+    pub_authors = publication_authors(client, args.weaviate_rows)
+    logger.info(f"{len(authors)} authors, {len(pub_authors)} publications")
+    summary = []
+    for sentence_class, class_name in PROFILE_CLASS_NAMES.items():
+        centroids, counts = author_centroids(client, sentence_class, list(authors.keys()), pub_authors,
+                                             args.weaviate_rows)
+        if centroids.shape[1] == 0:
+            logger.info(f"No {sentence_class} vectors, {class_name} skipped")
+            continue
+        ensure_class(client, class_name, index_config)
+        sent, deleted = import_profiles(client, class_name, authors, centroids, counts, args.min_sentences,
+                                        manifest, metrics)
+        model = next(model for model, name in SENTENCE_CLASS_NAMES.items() if name == sentence_class)
+        similar_count = save_similar_authors(similar_authors_file(model), authors, centroids, counts,
+                                             args.min_sentences, args.neighbours)
+        summary.append(f"{class_name} : {int(np.sum(counts >= args.min_sentences))} profiles, {sent} sent, "
+                       f"{deleted} removed, similar authors of {similar_count} authors of the institution")
+        logger.info(summary[-1])
+    message = "Author profiles computed\n" + "\n".join(summary) + f"\n{metrics.report()}"
+    logger.info(message)
+    MailSender().send_email(type=MailSender.ERROR if len(metrics.errors) > 0 else MailSender.INFO, text=message)
+
+
+if __name__ == '__main__':
+    try:
+        main(parse_arguments())
+    except Exception as e:
+        logger.exception(f"Author profiles failure : {e}")
+        MailSender().send_email(type=MailSender.ERROR, text=f"Author profiles failure : {e}\n{traceback.format_exc()}")
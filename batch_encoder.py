@@ -0,0 +1,59 @@
+from typing import Iterable
+
+import numpy as np
+
+
+class BatchEncoder:
+    """Encodes sentences gathered across many documents with a SentenceTransformer model
+
+    Distinct texts are sorted by length and cut into batches of similar lengths, so that
+    padding is minimal and every forward pass is as large as the batch size allows.
+    When an embedding cache is provided, only the texts missing from the cache are encoded.
+    """
+    DEFAULT_BATCH_SIZE = 256
+
+    def __init__(self, model, batch_size: int = DEFAULT_BATCH_SIZE, cache=None, model_name: str = None) -> None:
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = cache
+        self.model_name = model_name
+        self.last_batches = 0
+
+    def buckets(self, texts: list) -> list:
+        """Splits texts into length-sorted batches
+
+        Parameters
+        ----------
+        texts : list, required
+                distinct texts to encode
+
+        Returns
+        -------
+        buckets: list of lists of texts of similar lengths
+        """
+        ordered = sorted(texts, key=len)
+        return [ordered[start:start + self.batch_size] for start in range(0, len(ordered), self.batch_size)]
+
+    def encode(self, texts: Iterable[str]) -> dict:
+        """Encodes texts in length-bucketed batches
+
+        Parameters
+        ----------
+        texts : Iterable[str], required
+                texts to encode, duplicates are encoded once
+
+        Returns
+        -------
+        vectors: dict of np.ndarray vectors by text
+        """
+        texts = list(dict.fromkeys(texts))
+        vectors = self.cache.get_many(self.model_name, texts) if self.cache is not None else {}
+        buckets = self.buckets([text for text in texts if text not in vectors])
+        self.last_batches = len(buckets)
+        for bucket in buckets:
+            embeddings = np.asarray(self.model.encode(bucket, batch_size=len(bucket), show_progress_bar=False,
+                                                      convert_to_numpy=True))
+            vectors.update(zip(bucket, embeddings))
+            if self.cache is not None:
+                self.cache.put_many(self.model_name, dict(zip(bucket, embeddings)))
+        return vectors
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import random
+import time
+
+import numpy as np
+import pandas as pd
+import weaviate
+from dotenv import dotenv_values
+
+from log_handler import LogHandler
+from weaviate_cursor import scan
+
+DEFAULT_CLASS_NAME = "SbertSentence"
+DEFAULT_NUMBER_OF_QUERIES = 100
+DEFAULT_K = 100
+DEFAULT_EF_VALUES = "64,128,256,512"
+DEFAULT_PAGE_SIZE = 5000
+
+weaviate_params = dict(dotenv_values(".env.weaviate"))
+
+
+def get_client(host):
+    return weaviate.Client(host, timeout_config=(1000, 1000))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Measures recall@k against exact search, latency and memory of the vector index of a class. '
+                    'The ef parameter of the class is changed during the benchmark : run it against a copy of the '
+                    'database, never against the production instance.')
+    parser.add_argument('--host', dest='host',
+                        help='URL of the Weaviate copy to benchmark, distinct from the host of .env.weaviate',
+                        required=True)
+    parser.add_argument('--class_name', dest='class_name',
+                        help='Class to benchmark', required=False, default=DEFAULT_CLASS_NAME)
+    parser.add_argument('--queries', dest='queries',
+                        help='Number of objects of the class used as queries', required=False,
+                        default=DEFAULT_NUMBER_OF_QUERIES, type=int)
+    parser.add_argument('--k', dest='k',
+                        help='Number of neighbours', required=False, default=DEFAULT_K, type=int)
+    parser.add_argument('--ef', dest='ef',
+                        help='Comma separated ef values to try', required=False, default=DEFAULT_EF_VALUES)
+    parser.add_argument('--weaviate_rows', dest='weaviate_rows',
+                        help='Number of requested rows per request (Weaviate)', required=False,
+                        default=DEFAULT_PAGE_SIZE, type=int)
+    parser.add_argument('--output', dest='output',
+                        help='CSV report file', required=False, default=None)
+    args = parser.parse_args()
+    if args.host.rstrip('/') == str(weaviate_params.get('host', '')).rstrip('/'):
+        parser.error("--host is the production instance of .env.weaviate, the benchmark must run against a copy")
+    return args
+
+
+def similarities(queries, vectors, distance):
+    """Similarity scores, the higher the closer, consistent with the distance metric of the index"""
+    if distance == 'l2-squared':
+        return -(np.sum(queries ** 2, axis=1)[:, None] - 2 * queries @ vectors.T
+                 + np.sum(vectors ** 2, axis=1)[None, :])
+    if distance == 'cosine':
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    return queries @ vectors.T
+
+
+def exact_neighbours(client, class_name, queries, k, distance, page_size):
+    """Exact k nearest neighbours of the queries, computed over all the vectors of the class page by page
+
+    Returns
+    -------
+    neighbours, count: list of sets of uuids for each query, number of objects scanned
+    """
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=object)
+    count = 0
+    page_ids, page_vectors = [], []
+
+    def merge_page():
+        nonlocal best_scores, best_ids
+        scores = np.concatenate([best_scores, similarities(queries, np.stack(page_vectors), distance)], axis=1)
+        ids = np.concatenate([best_ids, np.tile(np.array(page_ids, dtype=object), (len(queries), 1))], axis=1)
+        top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+
+    for item in scan(client, class_name, [], page_size, additional=["vector"]):
+        page_ids.append(item['_additional']['id'])
+        page_vectors.append(np.asarray(item['_additional']['vector'], dtype=np.float32))
+        count += 1
+        if len(page_ids) >= page_size:
+            merge_page()
+            page_ids, page_vectors = [], []
+    if len(page_ids) > 0:
+        merge_page()
+    return [set(ids) for ids in best_ids], count
+
+
+def approximate_neighbours(client, class_name, query, k):
+    start = time.perf_counter()
+    response = client.query.get(class_name, []).with_additional(["id"]).with_near_vector(
+        {"vector": query.tolist()}).with_limit(k).do()
+    latency = time.perf_counter() - start
+    return {item['_additional']['id'] for item in response['data']['Get'][class_name] or []}, latency
+
+
+def estimated_memory(count, dimensions, index_config):
+    """Rule of thumb memory footprint of an HNSW index : vectors, or PQ codes, plus the layer 0 connections"""
+    pq = index_config.get('pq', {}) or {}
+    if pq.get('enabled', False):
+        vector_bytes = count * (pq.get('segments', 0) or dimensions)
+    else:
+        vector_bytes = count * dimensions * 4
+    return vector_bytes + count * index_config.get('maxConnections', 64) * 2 * 8
+
+
+def main(args):
+    global logger
+    logger = LogHandler("benchmark_vector_index", 'log', 'benchmark_vector_index.log',
+                        logging.INFO).create_rotating_log()
+    client = get_client(args.host)
+    class_name = args.class_name
+    index_config = client.schema.get(class_name)['vectorIndexConfig']
+    distance = index_config.get('distance', 'cosine')
+    logger.info(f"Benchmarking {class_name} : {index_config}")
+    uuids = [item['_additional']['id'] for item in scan(client, class_name, [], args.weaviate_rows)]
+    sample = random.sample(uuids, min(args.queries, len(uuids)))
+    queries = np.stack([np.asarray(
+        client.data_object.get_by_id(uuid, class_name=class_name, with_vector=True)['vector'], dtype=np.float32)
+        for uuid in sample])
+    exact, count = exact_neighbours(client, class_name, queries, args.k, distance, args.weaviate_rows)
+    memory = estimated_memory(count, queries.shape[1], index_config)
+    logger.info(f"{count} objects of dimension {queries.shape[1]}, estimated index memory "
+                f"{round(memory / 2 ** 20)} MiB")
+    report = []
+    original_ef = index_config.get('ef', -1)
+    try:
+        for ef in [int(ef) for ef in args.ef.split(',')]:
+            client.schema.update_config(class_name, {"vectorIndexConfig": {"ef": ef}})
+            recalls, latencies = [], []
+            for query, expected in zip(queries, exact):
+                found, latency = approximate_neighbours(client, class_name, query, args.k)
+                recalls.append(len(found & expected) / max(1, len(expected)))
+                latencies.append(latency)
+            report.append({'class': class_name, 'ef': ef, 'k': args.k, 'objects': count,
+                           f'recall@{args.k}': round(float(np.mean(recalls)), 4),
+                           'latency_p50_ms': round(1000 * float(np.percentile(latencies, 50)), 1),
+                           'latency_p95_ms': round(1000 * float(np.percentile(latencies, 95)), 1),
+                           'estimated_memory_mib': round(memory / 2 ** 20)})
+            logger.info(report[-1])
+    finally:
+        client.schema.update_config(class_name, {"vectorIndexConfig": {"ef": original_ef}})
+    report = pd.DataFrame(report)
+    print(report.to_string(index=False))
+    if args.output is not None:
+        report.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+import argparse
+import ast
+import logging
+import os
+import traceback
+
+import pandas as pd
+
+from coauthor_graph import CoauthorGraph, build_csr
+from hal_utils import choose_author_identifier
+from log_handler import LogHandler
+from mail_sender import MailSender
+
+DEFAULT_INPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_dump"
+DEFAULT_INPUT_FILE_NAME = "dump.csv"
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Compiles the co-authorship graph of the HAL dump for the collaborator scoring boost.')
+    parser.add_argument('--csv_dir', dest='csv_dir',
+                        help='CSV input file directory', required=False, default=DEFAULT_INPUT_DIR_NAME)
+    parser.add_argument('--csv_file', dest='csv_file',
+                        help='CSV input file name', required=False, default=DEFAULT_INPUT_FILE_NAME)
+    parser.add_argument('--graph_dir', dest='graph_dir',
+                        help='Output directory of the graph arrays', required=False,
+                        default=CoauthorGraph.DEFAULT_GRAPH_DIR)
+    return parser.parse_args()
+
+
+def main(args):
+    global logger
+    logger = LogHandler("build_coauthor_graph", 'log', 'build_coauthor_graph.log', logging.INFO).create_rotating_log()
+    csv = pd.read_csv(f"{args.csv_dir}/{args.csv_file}", usecols=['docid', 'authors'])
+    publications = []
+    for authors in csv['authors']:
+        try:
+            publications.append([str(choose_author_identifier(auth)) for auth in ast.literal_eval(authors)])
+        except (SyntaxError, ValueError) as e:
+            logger.debug(e)
+    identifiers, indptr, indices, weights = build_csr(publications)
+    CoauthorGraph.save(args.graph_dir, identifiers, indptr, indices, weights)
+    message = f"Co-authorship graph of {len(publications)} publications : {len(identifiers)} authors, " \
+              f"{len(indices) // 2} collaborations"
+    logger.info(message)
+    MailSender().send_email(type=MailSender.INFO, text=message)
+
+
+if __name__ == '__main__':
+    try:
+        main(parse_arguments())
+    except Exception as e:
+        logger.exception(f"Co-authorship graph failure : {e}")
+        MailSender().send_email(type=MailSender.ERROR,
+                                text=f"Co-authorship graph failure : {e}\n{traceback.format_exc()}")
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import argparse
-import itertools
 import logging
 import traceback
 
@@ -8,14 +7,20 @@ import weaviate
 from dotenv import dotenv_values
 
 from hal_api_client import HalApiClient
+from import_manifest import ImportManifest
 from log_handler import LogHandler
 from mail_sender import MailSender
+from weaviate_cursor import scan
 
 DEFAULT_HAL_ROWS = 10000
 DEFAULT_WEAVIATE_ROWS = 10000
 
 NUMBER_OF_DOCS_TO_REMOVE_ALERT_LEVEL = 100
 
+DELETE_CHUNK_SIZE = 100
+
+SENTENCE_CLASSES = ["SbertSentence", "AdaSentence"]
+
 weaviate_params = dict(dotenv_values(".env.weaviate"))
 
 
@@ -33,10 +38,66 @@ def parse_arguments():
                         required=False, type=int)
     parser.add_argument('--dry', action='store_true', help='Simulate without effective removal')
     parser.add_argument('--force', action='store_true', help='Force removal, overcome limit of number of documents')
+    parser.add_argument('--manifest_file', dest='manifest_file',
+                        help='Import manifest from which the removed objects are forgotten', required=False,
+                        default=ImportManifest.DEFAULT_MANIFEST_FILE)
 
     return parser.parse_args()
 
 
+def docid_filter(docids, value_type):
+    return {"operator": "Or",
+            "operands": [{"path": ["docid"], "operator": "Equal", value_type: value} for value in docids]}
+
+
+def fetch_citations(client, docids):
+    citations = []
+    for start in range(0, len(docids), DELETE_CHUNK_SIZE):
+        chunk = docids[start:start + DELETE_CHUNK_SIZE]
+        response = client.query.get("Publication", ["docid", "citation_full"]).with_where(
+            docid_filter(chunk, "valueInt")).with_limit(len(chunk)).do()
+        citations.extend(pub['citation_full'] for pub in response['data']['Get']['Publication'] or [])
+    return citations
+
+
+def delete_publications(client, docids, dry_run=False, manifest=None):
+    """Deletes publications by docid, together with the sentences that reference them
+
+    Parameters
+    ----------
+    client : weaviate.Client, required
+            Weaviate client
+    docids : list, required
+            docids of the publications to delete
+    dry_run : bool, optional
+            only count the matching objects
+    manifest : ImportManifest, optional
+            import manifest, the deleted objects are removed from it so that they are imported again if they
+            reappear
+
+    Returns
+    -------
+    counters: dict of numbers of deleted (or matching) objects by class
+    """
+    counters = {}
+    for start in range(0, len(docids), DELETE_CHUNK_SIZE):
+        chunk = docids[start:start + DELETE_CHUNK_SIZE]
+        # sentences first : a crash cannot leave sentences without their publication
+        for class_name, where in [(sentence_class, docid_filter(list(map(str, chunk)), "valueString")) for
+                                  sentence_class in SENTENCE_CLASSES] + [
+                                     ("Publication", docid_filter(chunk, "valueInt"))]:
+            result = client.batch.delete_objects(class_name=class_name, where=where, output='verbose',
+                                                 dry_run=dry_run)
+            results = result['results']
+            if manifest is not None and not dry_run:
+                manifest.remove_many(class_name, [obj['id'] for obj in results.get('objects', None) or [] if
+                                                  obj.get('status', None) == 'SUCCESS'])
+            if results.get('failed', 0) > 0:
+                raise RuntimeError(f"Failed to delete {results['failed']} {class_name} objects")
+            counters[class_name] = counters.get(class_name, 0) + results.get('matches', 0)
+    return counters
+
+
 def main(args):
     global logger
     force = args.force
@@ -47,51 +108,31 @@ def main(args):
     logger.info(f"Rows per request to HAL : {hal_rows}")
     logger.info(f"Rows per request to Weaviate : {weaviate_rows}")
     hal_api_client = HalApiClient(rows=hal_rows, logger=logger)
-    it = None
+    hal_docids = []
     while True:
-        docs = hal_api_client.fetch_all_publication_ids()
-        new_it = map(lambda doc: doc['docid'], docs)
-        if it is None:
-            it = new_it
-        else:
-            it = itertools.chain(it, new_it)
-        if len(docs) == 0:
+        page_size = len(hal_docids)
+        hal_docids.extend(int(doc['docid']) for doc in hal_api_client.fetch_all_publication_ids())
+        if len(hal_docids) == page_size:
             logger.info("Download complete !")
             break
-    hal_docids = list(map(int, it))
 
     client = get_client()
-    weaviate_docids = {}
-    offset = 0
-    while True:
-        ids = client.query.get("Publication", ["docid"]).with_additional(["id"]).with_limit(weaviate_rows).with_offset(
-            offset).do()
-        logger.debug(f"Fetch {weaviate_rows} publications with offset {offset}")
-        offset += weaviate_rows
-        if ids['data']['Get']['Publication'] is None:
-            logger.info("All publications fetched from Weaviate !")
-            break
-        weaviate_docids = weaviate_docids | {elem['docid']: elem['_additional']['id'] for elem in
-                                             ids['data']['Get']['Publication']}
-    to_remove = list(set(dict.keys(weaviate_docids)) - set(map(int, hal_docids)))
+    weaviate_docids = {int(elem['docid']) for elem in scan(client, "Publication", ["docid"], weaviate_rows)
+                       if elem['docid'] is not None}
+    logger.info(f"All publications fetched from Weaviate : {len(weaviate_docids)}")
+    to_remove = sorted(weaviate_docids - set(map(int, hal_docids)))
     if len(to_remove) > NUMBER_OF_DOCS_TO_REMOVE_ALERT_LEVEL and not force:
         raise RuntimeError(
             f"abnormal number of documents to remove: {len(to_remove)}, stopping process, check and launch manually")
-    removal_list = []
-    uuids_to_remove = [weaviate_docids[key] for key in to_remove]
-    for uuid in uuids_to_remove:
-        citation = client.data_object.get_by_id(uuid=uuid,
-                                                class_name='Publication')['properties']['citation_full']
-        removal_list.append(
-            citation)
+    removal_list = fetch_citations(client, to_remove)
+    for citation in removal_list:
         logger.info(f"Remove : {citation}")
-        if not dry_run:
-            client.data_object.delete(
-                uuid=uuid,
-                class_name='Publication'
-            )
+    counters = delete_publications(client, to_remove, dry_run, ImportManifest(args.manifest_file))
+    logger.info(f"Deleted objects by class : {counters}")
 
-    message = f"Removed {len(to_remove)} from database {'(Simulation)' if dry_run else ''}."
+    message = f"Removed {len(to_remove)} from database, with " \
+              f"{sum(counters.get(sentence_class, 0) for sentence_class in SENTENCE_CLASSES)} sentences " \
+              f"{'(Simulation)' if dry_run else ''}."
     logger.info(message)
     MailSender().send_email(type=MailSender.INFO, html="<p><b>" + message + "</b><br/>Details</p>" + ("<br/>".join(
         removal_list)))
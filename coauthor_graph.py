@@ -0,0 +1,161 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+# hyperauthored publications (consortiums) would add quadratically many pairs of loosely related authors
+MAX_AUTHORS_PER_PUBLICATION = 50
+
+ARRAYS = ['identifiers', 'indptr', 'indices', 'weights']
+
+
+def build_csr(publications: list) -> tuple:
+    """Compiles the co-authorship graph of publications into a CSR adjacency
+
+    Parameters
+    ----------
+    publications : list, required
+            lists of author identifiers, one per publication
+
+    Returns
+    -------
+    identifiers, indptr, indices, weights: author identifiers, row offsets, co-author rows sorted by row,
+    joint publication counts
+    """
+    identifiers = sorted({identifier for authors in publications for identifier in authors})
+    rows_by_identifier = {identifier: row for row, identifier in enumerate(identifiers)}
+    sources, targets = [], []
+    for authors in publications:
+        rows = np.unique(np.array([rows_by_identifier[identifier] for identifier in authors], dtype=np.int64))
+        if len(rows) < 2 or len(rows) > MAX_AUTHORS_PER_PUBLICATION:
+            continue
+        pair_sources = np.repeat(rows, len(rows))
+        pair_targets = np.tile(rows, len(rows))
+        distinct = pair_sources != pair_targets
+        sources.append(pair_sources[distinct])
+        targets.append(pair_targets[distinct])
+    count = len(identifiers)
+    if len(sources) == 0:
+        return (np.array(identifiers, dtype=str), np.zeros(count + 1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                np.zeros(0, dtype=np.float32))
+    # one key per ordered pair of authors : sorted keys give the rows in order, and the columns within each row
+    keys, weights = np.unique(np.concatenate(sources) * count + np.concatenate(targets), return_counts=True)
+    rows = keys // count
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=count))]).astype(np.int64)
+    return (np.array(identifiers, dtype=str), indptr, (keys % count).astype(np.int32),
+            weights.astype(np.float32))
+
+
+class CoauthorGraph:
+    """Co-authorship CSR adjacency, saved as .npy files in a directory and memory-mapped by the readers"""
+    DEFAULT_GRAPH_DIR = f"{os.path.expanduser('~')}/hal_cache/coauthors"
+
+    def __init__(self, identifiers, indptr, indices, weights) -> None:
+        self.identifiers = identifiers
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.rows = {str(identifier): row for row, identifier in enumerate(identifiers)}
+
+    @staticmethod
+    def save(dir_path: str, identifiers, indptr, indices, weights) -> None:
+        """Replaces the arrays of the graph directory, the row offsets last as they signal the new graph to the
+        readers, which keep their mapping of the replaced files. Other files of the directory are left untouched."""
+        Path(dir_path).mkdir(parents=True, exist_ok=True)
+        arrays = dict(zip(ARRAYS, [identifiers, indptr, indices, weights]))
+        for name in sorted(ARRAYS, key=lambda name: name == 'indptr'):
+            np.save(f"{dir_path}/{name}.tmp.npy", arrays[name])
+            os.replace(f"{dir_path}/{name}.tmp.npy", f"{dir_path}/{name}.npy")
+
+    @classmethod
+    def load(cls, dir_path: str = DEFAULT_GRAPH_DIR) -> 'CoauthorGraph':
+        identifiers, indptr, indices, weights = [
+            np.load(f"{dir_path}/{name}.npy", mmap_mode=None if name == 'identifiers' else 'r') for name in ARRAYS]
+        if len(indptr) != len(identifiers) + 1 or indptr[-1] != len(indices) or len(indices) != len(weights):
+            raise ValueError(f"Inconsistent co-authorship graph arrays in {dir_path}, being replaced")
+        return cls(identifiers, indptr, indices, weights)
+
+    def collaborators(self, identifier: str, limit: int = None) -> list:
+        """Co-authors of an author, most frequent first
+
+        Returns
+        -------
+        collaborators: list of dicts with identifier and number of joint publications
+        """
+        row = self.rows.get(identifier, None)
+        if row is None:
+            return []
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        order = np.argsort(-self.weights[start:stop], kind='stable')[:limit]
+        return [{'identifier': str(self.identifiers[self.indices[start + position]]),
+                 'publications': int(self.weights[start + position])} for position in order]
+
+    def propagate(self, identifiers: list, scores: np.ndarray, min_weight: float = 1) -> np.ndarray:
+        """Weighted mean of the scores of the collaborators of each author, among the given authors
+
+        Each author receives the mean score of its co-authors with at least min_weight joint publications that are
+        among the given authors, weighted by their numbers of joint publications. Unknown authors, and authors
+        without such collaborators, receive nothing.
+
+        Parameters
+        ----------
+        identifiers : list, required
+                author identifiers
+        scores : np.ndarray, required
+                score of each author
+
+        Returns
+        -------
+        propagated: np.ndarray propagated score of each author
+        """
+        rows = np.array([self.rows.get(identifier, -1) for identifier in identifiers], dtype=np.int64)
+        known = np.flatnonzero(rows >= 0)
+        propagated = np.zeros(len(identifiers), dtype=np.float64)
+        if len(known) == 0:
+            return propagated
+        dense_scores = np.zeros(len(self.identifiers), dtype=np.float64)
+        dense_scores[rows[known]] = scores[known]
+        present = np.zeros(len(self.identifiers), dtype=bool)
+        present[rows[known]] = True
+        starts = self.indptr[rows[known]]
+        lengths = self.indptr[rows[known] + 1] - starts
+        # positions of the adjacency entries of all the known authors, gathered without a python loop
+        owners = np.repeat(np.arange(len(known)), lengths)
+        positions = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(
+            lengths.sum())
+        weights = np.asarray(self.weights[positions], dtype=np.float64)
+        neighbours = np.asarray(self.indices[positions])
+        strong = (weights >= min_weight) & present[neighbours]
+        totals = np.bincount(owners[strong], weights=weights[strong], minlength=len(known))
+        sums = np.bincount(owners[strong], weights=weights[strong] * dense_scores[neighbours[strong]],
+                           minlength=len(known))
+        propagated[known] = np.divide(sums, totals, out=np.zeros_like(sums), where=totals > 0)
+        return propagated
+
+
+class CachedCoauthorGraph:
+    """Co-authorship graph held by the query workers, reloaded when the graph has been rebuilt"""
+
+    def __init__(self, dir_path: str = CoauthorGraph.DEFAULT_GRAPH_DIR) -> None:
+        self.dir_path = dir_path
+        self.graph = None
+        self.loaded_mtime = None
+
+    def get(self) -> CoauthorGraph:
+        """Current graph, None if build_coauthor_graph.py has not run yet"""
+        try:
+            mtime = os.stat(f"{self.dir_path}/indptr.npy").st_mtime
+        except FileNotFoundError:
+            logging.getLogger("coauthor_graph").warning(
+                f"No co-authorship graph in {self.dir_path}, run build_coauthor_graph.py")
+            return None
+        if self.graph is None or mtime != self.loaded_mtime:
+            try:
+                self.graph = CoauthorGraph.load(self.dir_path)
+                self.loaded_mtime = mtime
+            except ValueError:
+                # arrays caught while being replaced : keep the previous graph, the next call will reload
+                if self.graph is None:
+                    raise
+        return self.graph
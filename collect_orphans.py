@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import traceback
+
+import weaviate
+from dotenv import dotenv_values
+
+from import_manifest import ImportManifest
+from log_handler import LogHandler
+from mail_sender import MailSender
+from weaviate_cursor import scan, DEFAULT_PAGE_SIZE
+
+DELETE_CHUNK_SIZE = 100
+
+SENTENCE_CLASSES = ["SbertSentence", "AdaSentence"]
+
+NUMBER_OF_OBJECTS_TO_REMOVE_ALERT_LEVELS = {
+    "Organisation": 100,
+    "Author": 1000,
+    "SbertSentence": 10000,
+    "AdaSentence": 10000,
+}
+
+weaviate_params = dict(dotenv_values(".env.weaviate"))
+
+
+def get_client():
+    return weaviate.Client(weaviate_params['host'], timeout_config=(1000, 1000))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Removes the authors, organisations and sentences no longer reachable from any publication.')
+    parser.add_argument('--weaviate_rows', dest='weaviate_rows',
+                        help='Number of requested rows per request (Weaviate)', default=DEFAULT_PAGE_SIZE,
+                        required=False, type=int)
+    parser.add_argument('--dry', action='store_true', help='Simulate without effective removal')
+    parser.add_argument('--force', action='store_true', help='Force removal, overcome limits of number of objects')
+    parser.add_argument('--manifest_file', dest='manifest_file',
+                        help='Import manifest from which the removed objects are forgotten', required=False,
+                        default=ImportManifest.DEFAULT_MANIFEST_FILE)
+    return parser.parse_args()
+
+
+def reference_ids(item, prop):
+    return {target['_additional']['id'] for target in item.get(prop, None) or []}
+
+
+def find_orphans(client, page_size):
+    """Scans the references from the publications down and lists the unreachable objects
+
+    Authors are reachable from publications, organisations from publications and reachable authors, sentences
+    from their publication as long as their sentid is below the sentence count of its last vectorization.
+
+    Returns
+    -------
+    orphans: dict of lists of uuids by class
+    """
+    publications = {}
+    reachable_authors = set()
+    reachable_orgs = set()
+    for item in scan(client, "Publication",
+                     ["sentence_count", "hasAuthors { ... on Author { _additional { id } } }",
+                      "hasOrganisations { ... on Organisation { _additional { id } } }"], page_size):
+        publications[item['_additional']['id']] = item.get('sentence_count', None)
+        reachable_authors |= reference_ids(item, 'hasAuthors')
+        reachable_orgs |= reference_ids(item, 'hasOrganisations')
+    logger.info(f"{len(publications)} publications, {len(reachable_authors)} reachable authors")
+    orphans = {"Author": []}
+    for item in scan(client, "Author", ["hasOrganisations { ... on Organisation { _additional { id } } }"],
+                     page_size):
+        if item['_additional']['id'] in reachable_authors:
+            reachable_orgs |= reference_ids(item, 'hasOrganisations')
+        else:
+            orphans["Author"].append(item['_additional']['id'])
+    logger.info(f"{len(reachable_orgs)} reachable organisations")
+    orphans["Organisation"] = [item['_additional']['id'] for item in scan(client, "Organisation", [], page_size)
+                               if item['_additional']['id'] not in reachable_orgs]
+    for sentence_class in SENTENCE_CLASSES:
+        orphans[sentence_class] = []
+        for item in scan(client, sentence_class,
+                         ["sentid", "hasPublication { ... on Publication { _additional { id } } }"], page_size):
+            pub_ids = reference_ids(item, 'hasPublication')
+            pub_id = next(iter(pub_ids), None)
+            sentence_count = publications.get(pub_id, None)
+            if pub_id not in publications or (sentence_count is not None and item['sentid'] >= sentence_count):
+                orphans[sentence_class].append(item['_additional']['id'])
+    return orphans
+
+
+def delete_objects(client, class_name, uuids, manifest=None):
+    """Deletes objects by uuid in batches
+
+    Returns
+    -------
+    deleted: int number of deleted objects
+    """
+    deleted = 0
+    for start in range(0, len(uuids), DELETE_CHUNK_SIZE):
+        chunk = uuids[start:start + DELETE_CHUNK_SIZE]
+        where = {"operator": "Or",
+                 "operands": [{"path": ["id"], "operator": "Equal", "valueString": uuid} for uuid in chunk]}
+        results = client.batch.delete_objects(class_name=class_name, where=where, output='minimal')['results']
+        if results.get('failed', 0) > 0:
+            raise RuntimeError(f"Failed to delete {results['failed']} {class_name} objects")
+        deleted += results.get('successful', 0)
+        if manifest is not None:
+            manifest.remove_many(class_name, chunk)
+    return deleted
+
+
+def main(args):
+    global logger
+    logger = LogHandler('collect_orphans', 'log', 'collect_orphans.log', logging.INFO).create_rotating_log()
+    dry_run = args.dry
+    client = get_client()
+    orphans = find_orphans(client, args.weaviate_rows)
+    abnormal = []
+    for class_name, uuids in orphans.items():
+        logger.info(f"{len(uuids)} orphan {class_name} objects")
+        if len(uuids) > NUMBER_OF_OBJECTS_TO_REMOVE_ALERT_LEVELS[class_name] and not args.force:
+            abnormal.append(f"{len(uuids)} {class_name} (alert level "
+                            f"{NUMBER_OF_OBJECTS_TO_REMOVE_ALERT_LEVELS[class_name]})")
+    # the alert levels only guard effective removals, a simulation reports what exceeds them
+    if len(abnormal) > 0 and not dry_run:
+        raise RuntimeError(f"abnormal number of objects to remove: {', '.join(abnormal)}, "
+                           f"stopping process, check and launch manually")
+    if not dry_run:
+        manifest = ImportManifest(args.manifest_file)
+        # sentences first, organisations last : an interrupted run leaves no dangling reference
+        for class_name in SENTENCE_CLASSES + ["Author", "Organisation"]:
+            deleted = delete_objects(client, class_name, orphans[class_name], manifest)
+            logger.info(f"{deleted} {class_name} objects deleted")
+    message = f"Removed orphan objects from database {'(Simulation)' if dry_run else ''}: " + ", ".join(
+        f"{len(uuids)} {class_name}" for class_name, uuids in orphans.items())
+    if len(abnormal) > 0:
+        message += f"\nAbove the alert levels : {', '.join(abnormal)}"
+    logger.info(message)
+    MailSender().send_email(type=MailSender.INFO, text=message)
+
+
+if __name__ == '__main__':
+    try:
+        main(parse_arguments())
+    except Exception as e:
+        logger.exception(f"Orphan collection failure : {e}")
+        MailSender().send_email(type=MailSender.ERROR,
+                                text=f"Orphan collection failure : {e}\n{traceback.format_exc()}")
@@ -28,10 +28,19 @@ COLUMNS = ['docid',
            'citation_ref',
            'citation_full',
            'hash',
+           'vector_hash',
            'created',
-           'updated'
+           'updated',
+           'text_updated'
            ]
 
+# fields that feed the embeddings computed by vectorize_sentences
+VECTORIZED_COLUMNS = ['fr_title',
+                      'en_title',
+                      'fr_abstract',
+                      'en_abstract'
+                      ]
+
 DEFAULT_OUTPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_dump"
 DEFAULT_OUTPUT_FILE_NAME = "dump.csv"
 DEFAULT_ROWS = 10000
@@ -55,7 +64,43 @@ def load_or_create_publications_df(file_path: str) -> pd.DataFrame:
     else:
         # publications = pd.read_csv(file_path, header=0, index_col='docid')
         publications = pd.read_csv(file_path, header=0)
-    return publications.astype(dtype={"docid": "int32", "created": bool, "updated": bool})
+        if 'vector_hash' not in publications.columns:
+            publications['vector_hash'] = None
+        if 'text_updated' not in publications.columns:
+            # pending updates from files without text tracking are assumed to affect the texts
+            publications['text_updated'] = publications['updated']
+        publications = publications[COLUMNS]
+    return publications.astype(dtype={"docid": "int32", "created": bool, "updated": bool, "text_updated": bool})
+
+
+def compute_hash(values: list) -> str:
+    """Computes the SHA256 hash of a list of field values
+
+    Parameters
+    ----------
+    values : list, required
+            field values
+
+    Returns
+    -------
+    hash: str hexadecimal digest
+    """
+    return hashlib.sha256('-'.join(map(str, values)).encode("utf-8")).hexdigest()
+
+
+def compute_vector_hash(values: list) -> str:
+    """Computes the hash of the only fields that are included in the vectorization
+
+    Parameters
+    ----------
+    values : list, required
+            formatted values as returned by extract_fields
+
+    Returns
+    -------
+    hash: str hexadecimal digest
+    """
+    return compute_hash([values[COLUMNS.index(column)] for column in VECTORIZED_COLUMNS])
 
 
 def extract_fields(doc: dict) -> list:
@@ -149,11 +194,13 @@ def main(args):
     logger.info(f"Output path : {file_path}")
     publications = load_or_create_publications_df(file_path)
     hal_api_client = HalApiClient(days=days, rows=rows, logger=logger, filtered=filter_documents)
-    created, updated, unchanged = 0, 0, 0
+    created, updated, unchanged, metadata_updated = 0, 0, 0, 0
     while True:
         docs = hal_api_client.fetch_last_publications()
         new_lines = []
+        page_size = 0
         for doc in docs:
+            page_size += 1
             docid = int(doc.get('docid'))
             assert docid is not None
             selection = publications.loc[publications['docid'] == docid]
@@ -163,31 +210,38 @@ def main(args):
                 existing_line = dict(selection.iloc[0])
                 existing_hash = existing_line['hash']
             new_values = extract_fields(doc)
-            new_values_hash = hashlib.sha256('-'.join(map(str, new_values)).encode("utf-8")).hexdigest()
-            new_values.append(str(new_values_hash))
+            new_values_hash = compute_hash(new_values)
+            new_vector_hash = compute_vector_hash(new_values)
+            new_values.extend([str(new_values_hash), str(new_vector_hash)])
             if existing_hash is not None:
                 if new_values_hash != existing_hash:
-                    new_values.extend([False, True])
+                    # flags of a not yet vectorized previous change are kept
+                    text_updated = bool(existing_line['text_updated']) or new_vector_hash != existing_line[
+                        'vector_hash']
+                    new_values.extend([bool(existing_line['created']), True, text_updated])
                     publications[publications['docid'] == docid] = new_values
-                    logger.debug(f"{docid} updated")
+                    logger.debug(f"{docid} updated{'' if text_updated else ' (metadata only)'}")
                     updated += 1
+                    if not text_updated:
+                        metadata_updated += 1
                 else:
                     unchanged += 1
                     logger.debug(f"{docid} unchanged")
             else:
-                new_values.extend([True, False])
+                new_values.extend([True, False, True])
                 new_lines.append(new_values)
                 created += 1
                 logger.debug(f"{docid} created")
-        if len(docs) == 0:
+        if page_size == 0:
             logger.info("Download complete !")
             break
         else:
             publications = pd.concat([publications, pd.DataFrame(new_lines, columns=COLUMNS).astype(
-                dtype={"created": bool, "updated": bool})])
+                dtype={"created": bool, "updated": bool, "text_updated": bool})])
     publications.to_csv(file_path, index=False)
     message1 = f"Publications file created or updated at {file_path}"
-    message2 = f"Unchanged : {unchanged}, Created : {created}, Updated: {updated}"
+    message2 = f"Unchanged : {unchanged}, Created : {created}, Updated: {updated} " \
+               f"(including {metadata_updated} without change in vectorized texts)"
     logger.info(message1)
     logger.info(message2)
     MailSender().send_email(type=MailSender.INFO, text=message0 + "\n" + message1 + "\n" + message2)
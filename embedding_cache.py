@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Persistent sentence embedding cache keyed by model name and SHA256 of the text
+
+    Vectors are stored as float32 blobs in a SQLite database so that unchanged or repeated sentences
+    are never encoded twice, across documents and across runs.
+    """
+    DEFAULT_CACHE_FILE = f"{os.path.expanduser('~')}/hal_cache/embeddings.sqlite"
+
+    QUERY_CHUNK_SIZE = 500
+
+    def __init__(self, file_path: str = DEFAULT_CACHE_FILE) -> None:
+        self.file_path = file_path
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                                "(model TEXT NOT NULL, sha TEXT NOT NULL, vector BLOB NOT NULL, "
+                                "PRIMARY KEY (model, sha)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS segments "
+                                "(model TEXT NOT NULL, sha TEXT NOT NULL, sentences TEXT NOT NULL, "
+                                "PRIMARY KEY (model, sha)) WITHOUT ROWID")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: Iterable[str]) -> dict:
+        """Looks up the cached vectors of texts
+
+        Parameters
+        ----------
+        model : str, required
+                model name
+        texts : Iterable[str], required
+                texts to look up
+
+        Returns
+        -------
+        vectors: dict of np.ndarray vectors by text, for the texts found in cache
+        """
+        texts_by_hash = {self.text_hash(text): text for text in texts}
+        hashes = list(texts_by_hash.keys())
+        vectors = {}
+        for start in range(0, len(hashes), self.QUERY_CHUNK_SIZE):
+            chunk = hashes[start:start + self.QUERY_CHUNK_SIZE]
+            rows = self.connection.execute(
+                f"SELECT sha, vector FROM embeddings WHERE model = ? AND sha IN ({','.join('?' * len(chunk))})",
+                [model] + chunk)
+            for sha, vector in rows:
+                vectors[texts_by_hash[sha]] = np.frombuffer(vector, dtype=np.float32)
+        self.hits += len(vectors)
+        self.misses += len(hashes) - len(vectors)
+        return vectors
+
+    def put_many(self, model: str, vectors: dict) -> None:
+        """Stores vectors
+
+        Parameters
+        ----------
+        model : str, required
+                model name
+        vectors : dict, required
+                vectors by text
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, sha, vector) VALUES (?, ?, ?)",
+            [(model, self.text_hash(text), np.asarray(vector, dtype=np.float32).tobytes()) for text, vector in
+             vectors.items()])
+        self.connection.commit()
+
+    def get_segments_many(self, model: str, texts: Iterable[str]) -> dict:
+        """Looks up the cached sentence segmentations of texts
+
+        Parameters
+        ----------
+        model : str, required
+                segmentation model name
+        texts : Iterable[str], required
+                texts to look up
+
+        Returns
+        -------
+        sentences: dict of lists of sentences by text, for the texts found in cache
+        """
+        texts_by_hash = {self.text_hash(text): text for text in texts}
+        hashes = list(texts_by_hash.keys())
+        segments = {}
+        for start in range(0, len(hashes), self.QUERY_CHUNK_SIZE):
+            chunk = hashes[start:start + self.QUERY_CHUNK_SIZE]
+            rows = self.connection.execute(
+                f"SELECT sha, sentences FROM segments WHERE model = ? AND sha IN ({','.join('?' * len(chunk))})",
+                [model] + chunk)
+            for sha, sentences in rows:
+                segments[texts_by_hash[sha]] = json.loads(sentences)
+        return segments
+
+    def put_segments_many(self, model: str, segments: dict) -> None:
+        """Stores sentence segmentations
+
+        Parameters
+        ----------
+        model : str, required
+                segmentation model name
+        segments : dict, required
+                lists of sentences by text
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO segments (model, sha, sentences) VALUES (?, ?, ?)",
+            [(model, self.text_hash(text), json.dumps(sentences)) for text, sentences in segments.items()])
+        self.connection.commit()
+
+    def size(self) -> int:
+        return sum(self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in
+                   ("embeddings", "segments"))
+
+    def collect_garbage(self, referenced_texts: Iterable[str]) -> int:
+        """Removes the entries whose text is no longer referenced, whatever the model
+
+        Parameters
+        ----------
+        referenced_texts : Iterable[str], required
+                texts that are still part of the publications, abstracts included
+
+        Returns
+        -------
+        removed: int number of removed entries
+        """
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS referenced (sha TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.connection.execute("DELETE FROM referenced")
+        self.connection.executemany("INSERT OR IGNORE INTO referenced (sha) VALUES (?)",
+                                    ((self.text_hash(text),) for text in referenced_texts))
+        removed = self.connection.execute(
+            "DELETE FROM embeddings WHERE sha NOT IN (SELECT sha FROM referenced)").rowcount
+        removed += self.connection.execute(
+            "DELETE FROM segments WHERE sha NOT IN (SELECT sha FROM referenced)").rowcount
+        self.connection.commit()
+        self.connection.execute("VACUUM")
+        return removed
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,197 @@
+import glob
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+JSON_FORMAT = 'json'
+SHARDS_FORMAT = 'shards'
+MEMORY_FORMAT = 'memory'
+
+VECTORS_KEY = '_vectors'
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return list(map(str, value.tolist()))
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonWriter:
+    """Writes one pretty-printed JSON file per object, vectors as lists of decimal strings"""
+
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+
+    def write(self, prefix: str, records, suffix: str = None) -> None:
+        for record in records:
+            json_dump = json.dumps(record, indent=4, default=_json_default)
+            with open(
+                    f"{self.output_dir}/{prefix}-{str(record['uuid'])}{('-' + record[suffix]) if suffix else ''}.json",
+                    "w") as outfile:
+                outfile.write(json_dump)
+
+    def flush(self) -> list:
+        return []
+
+
+class MemoryWriter:
+    """Keeps objects in memory until flushed, objects written several times with the same uuid are only kept once"""
+
+    def __init__(self) -> None:
+        self.buffers = {}
+
+    def write(self, prefix: str, records, suffix: str = None) -> None:
+        buffer = self.buffers.setdefault(prefix, {})
+        for record in records:
+            buffer[(str(record['uuid']), record[suffix] if suffix else None)] = record
+
+    def flush(self) -> dict:
+        """Hands over the buffered objects
+
+        Returns
+        -------
+        records: dict of lists of objects by prefix
+        """
+        records = {prefix: list(buffer.values()) for prefix, buffer in self.buffers.items()}
+        self.buffers = {}
+        return records
+
+
+class ShardWriter(MemoryWriter):
+    """Writes objects as sharded JSONL metadata files and float32 .npy vector matrices
+
+    For each prefix, a shard is made of a `{prefix}-{shard}.jsonl` file with one compact record per line
+    and one `{prefix}-{shard}-{field}-{dimension}.npy` matrix per vector field and dimension. The vector
+    fields of a record are replaced by the name of the matrix and the row that hold them. Shard names start
+    with their write time, so that sorted shards are in write order.
+    """
+
+    def __init__(self, output_dir: str) -> None:
+        super().__init__()
+        self.output_dir = output_dir
+        self.last_time = 0
+
+    def flush(self) -> list:
+        """Writes the buffered objects to new shards
+
+        The matrices are written before the JSONL file, which is renamed to its final name last,
+        so that a visible shard is always complete.
+
+        Returns
+        -------
+        files: list of the JSONL files written
+        """
+        # strictly increasing within a writer, the random suffix tells apart concurrent writers
+        self.last_time = max(time.time_ns(), self.last_time + 1)
+        shard = f"{self.last_time:020d}-{uuid.uuid4().hex[:6]}"
+        written = []
+        for prefix, records in super().flush().items():
+            if len(records) == 0:
+                continue
+            arrays = {}
+            lines = []
+            for record in records:
+                record = dict(record)
+                vectors = {}
+                for field in [field for field, value in record.items() if isinstance(value, np.ndarray)]:
+                    vector = record.pop(field).astype(np.float32)
+                    array_name = f"{prefix}-{shard}-{field}-{vector.shape[0]}.npy"
+                    rows = arrays.setdefault(array_name, [])
+                    vectors[field] = [array_name, len(rows)]
+                    rows.append(vector)
+                record[VECTORS_KEY] = vectors
+                lines.append(json.dumps(record, default=_json_default))
+            for array_name, rows in arrays.items():
+                np.save(f"{self.output_dir}/{array_name}", np.stack(rows))
+            file_path = f"{self.output_dir}/{prefix}-{shard}.jsonl"
+            with open(f"{file_path}.tmp", "w") as outfile:
+                outfile.write("\n".join(lines) + "\n")
+            os.replace(f"{file_path}.tmp", file_path)
+            written.append(file_path)
+        return written
+
+
+def create_writer(output_format: str, output_dir: str):
+    if output_format == MEMORY_FORMAT:
+        return MemoryWriter()
+    return ShardWriter(output_dir) if output_format == SHARDS_FORMAT else JsonWriter(output_dir)
+
+
+def shard_files(shard_path: str) -> list:
+    """Lists the JSONL file of a shard and its vector matrices"""
+    return [shard_path] + glob.glob(f"{shard_path[:-len('.jsonl')]}-*.npy")
+
+
+def read_shard(shard_path: str) -> Iterator[dict]:
+    """Reads the records of a shard, with their vectors as float32 arrays"""
+    directory = Path(shard_path).parent
+    arrays = {}
+    with open(shard_path) as infile:
+        for line in infile:
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            for field, (array_name, row) in record.pop(VECTORS_KEY, {}).items():
+                if array_name not in arrays:
+                    arrays[array_name] = np.load(f"{directory}/{array_name}", mmap_mode='r')
+                record[field] = np.asarray(arrays[array_name][row])
+            yield record
+
+
+def record_files(input_dir: str, file_prefix: str) -> list:
+    """Lists the JSON files and the shards of a prefix
+
+    Parameters
+    ----------
+    input_dir : str, required
+            input directory
+    file_prefix : str, required
+            'inst', 'lab', 'auth', 'pub' or 'sent'
+
+    Returns
+    -------
+    files: list of JSON file and JSONL shard paths, shards in write order
+    """
+    return glob.glob(f"{input_dir}/{file_prefix}*.json") + sorted(glob.glob(f"{input_dir}/{file_prefix}-*.jsonl"))
+
+
+def read_file(file_path: str) -> tuple:
+    """Reads the records of a JSON file or a shard
+
+    Returns
+    -------
+    records, files: list of objects and list of the paths of the files read
+    """
+    if file_path.endswith(".jsonl"):
+        return list(read_shard(file_path)), shard_files(file_path)
+    with open(file_path, ) as infile:
+        return [json.load(infile)], [file_path]
+
+
+def read_records(input_dir: str, file_prefix: str, processed_files: set) -> Iterator[dict]:
+    """Reads the objects of a prefix from both JSON files and shards
+
+    Parameters
+    ----------
+    input_dir : str, required
+            input directory
+    file_prefix : str, required
+            'inst', 'lab', 'auth', 'pub' or 'sent'
+    processed_files : set, required
+            set completed with the paths of the files read
+
+    Returns
+    -------
+    records: iterator over the objects
+    """
+    for f in record_files(input_dir, file_prefix):
+        records, files = read_file(f)
+        yield from records
+        processed_files.update(files)
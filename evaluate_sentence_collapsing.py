@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from sentence_transformers import SentenceTransformer
+
+from batch_encoder import BatchEncoder
+from embedding_cache import EmbeddingCache
+from log_handler import LogHandler
+from sentence_collapsing import collapse_translations, merged_vector
+from sentence_splitter import SentenceSplitter
+from vectorize_sentences import SBERT_MODEL, prepare_texts, document_texts
+
+DEFAULT_INPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_dump"
+DEFAULT_INPUT_FILE_NAME = "dump.csv"
+DEFAULT_NUMBER_OF_DOCUMENTS = 2000
+DEFAULT_THRESHOLDS = "0.85,0.9,0.95"
+DEFAULT_K = 100
+
+KEYWORDS_SEPARATOR = '§§§'
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Measures the sentence index reduction and the recall impact of collapsing translations.')
+    parser.add_argument('--csv_dir', dest='csv_dir',
+                        help='CSV input file directory', required=False, default=DEFAULT_INPUT_DIR_NAME)
+    parser.add_argument('--csv_file', dest='csv_file',
+                        help='CSV input file name', required=False, default=DEFAULT_INPUT_FILE_NAME)
+    parser.add_argument('--documents', dest='documents',
+                        help='Number of documents sampled from the CSV file', required=False,
+                        default=DEFAULT_NUMBER_OF_DOCUMENTS, type=int)
+    parser.add_argument('--queries', dest='queries',
+                        help='CSV evaluation set with query and docid columns, defaults to the keywords of the '
+                             'sampled documents as queries for their own document', required=False, default=None)
+    parser.add_argument('--thresholds', dest='thresholds',
+                        help='Comma separated collapse thresholds to evaluate', required=False,
+                        default=DEFAULT_THRESHOLDS)
+    parser.add_argument('--k', dest='k',
+                        help='Number of sentences returned per query, as the limit of the expert search',
+                        required=False, default=DEFAULT_K, type=int)
+    parser.add_argument('--cache_file', dest='cache_file',
+                        help='Embedding cache file', required=False, default=EmbeddingCache.DEFAULT_CACHE_FILE)
+    parser.add_argument('--output', dest='output',
+                        help='CSV report file', required=False, default=None)
+    return parser.parse_args()
+
+
+def keyword_queries(metadata):
+    """Keywords of each document, as a query for which the document is relevant"""
+    queries = []
+    for docid, fr_keyword, en_keyword in zip(metadata['docid'], metadata['fr_keyword'], metadata['en_keyword']):
+        keywords = [keyword for keywords in [en_keyword, fr_keyword] if type(keywords) == str
+                    for keyword in keywords.split(KEYWORDS_SEPARATOR) if len(keyword.strip()) > 0]
+        if len(keywords) > 0:
+            queries.append({'query': ', '.join(keywords), 'docid': docid})
+    return pd.DataFrame(queries, columns=['query', 'docid'])
+
+
+def build_index(documents, embeddings, threshold):
+    """Indexed vectors of the sentences of the documents, translations collapsed above the threshold if any
+
+    Returns
+    -------
+    vectors, docids: normalized vectors, docid of each vector
+    """
+    vectors, docids = [], []
+    for docid, texts, langs in documents:
+        if threshold is None:
+            groups = [[index] for index in range(len(texts))]
+        else:
+            groups = collapse_translations(langs, [embeddings[text] for text in texts], threshold)
+        for group in groups:
+            vectors.append(merged_vector([embeddings[texts[index]] for index in group]))
+            docids.append(docid)
+    vectors = np.stack(vectors)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12), np.array(docids)
+
+
+def evaluate(queries, vectors, docids, relevant, k):
+    """Exact top-k sentence search, standing for the vector index
+
+    Returns
+    -------
+    recall, publications: share of queries whose relevant document is among the hits, mean number of distinct
+    documents among the hits
+    """
+    hits = np.argpartition(-(queries @ vectors.T), min(k, len(vectors)) - 1, axis=1)[:, :k]
+    hit_docids = docids[hits]
+    recall = float(np.mean([docid in row for docid, row in zip(relevant, hit_docids)]))
+    publications = float(np.mean([len(set(row)) for row in hit_docids]))
+    return recall, publications
+
+
+def main(args):
+    global logger
+    logger = LogHandler("evaluate_sentence_collapsing", 'log', 'evaluate_sentence_collapsing.log',
+                        logging.INFO).create_rotating_log()
+    csv = pd.read_csv(f"{args.csv_dir}/{args.csv_file}")
+    csv = csv.sample(min(args.documents, len(csv)), random_state=0)
+    cache = EmbeddingCache(args.cache_file)
+    metadata = prepare_texts(csv[['docid', 'fr_title', 'en_title', 'fr_abstract', 'en_abstract', 'fr_keyword',
+                                  'en_keyword']], SentenceSplitter(cache=cache))
+    documents = [(row['docid'],) + document_texts(row) for _, row in metadata.iterrows()]
+    documents = [document for document in documents if len(document[1]) > 0]
+    queries = pd.read_csv(args.queries) if args.queries is not None else keyword_queries(metadata)
+    # a query whose relevant document has no sentence in the sample would be a miss at every threshold
+    indexed = queries['docid'].isin({docid for docid, _, _ in documents})
+    excluded = int((~indexed).sum())
+    queries = queries[indexed].reset_index(drop=True)
+    encoder = BatchEncoder(SentenceTransformer(SBERT_MODEL), cache=cache, model_name=SBERT_MODEL)
+    embeddings = encoder.encode([text for _, texts, _ in documents for text in texts])
+    query_vectors = np.stack([np.asarray(vector, dtype=np.float32) for vector in
+                              encoder.model.encode(list(queries['query']))])
+    query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+    logger.info(f"{len(documents)} documents, {len(queries)} queries, {excluded} queries excluded as their "
+                f"document has no sentence in the sample")
+    report = []
+    baseline_size = None
+    for threshold in [None] + [float(threshold) for threshold in args.thresholds.split(',')]:
+        vectors, docids = build_index(documents, embeddings, threshold)
+        baseline_size = baseline_size or len(vectors)
+        recall, publications = evaluate(query_vectors, vectors, docids, queries['docid'].to_numpy(), args.k)
+        report.append({'threshold': threshold if threshold is not None else 'none', 'sentences': len(vectors),
+                       'reduction_percent': round(100 * (1 - len(vectors) / baseline_size), 1),
+                       'queries': len(queries), 'excluded_queries': excluded,
+                       f'recall@{args.k}': round(recall, 4), f'publications@{args.k}': round(publications, 1)})
+        logger.info(report[-1])
+    cache.close()
+    report = pd.DataFrame(report)
+    print(report.to_string(index=False))
+    if args.output is not None:
+        report.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -1,6 +1,9 @@
 import logging
+from typing import Iterator
 
+import ijson
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class HalApiClient:
@@ -30,6 +33,10 @@ class HalApiClient:
     DATE_INTERVAL_TEMPLATE = "AND (submittedDate_tdate:[NOW-%%DAYS%%DAYS/DAY TO NOW/HOUR] " \
                              "OR modifiedDate_tdate:[NOW-%%DAYS%%DAYS/DAY TO NOW/HOUR])"
 
+    DOC_PREFIX = 'response.docs.item'
+    REQUEST_TIMEOUT = 360
+    READ_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, rows: int, logger: logging.Logger, days: int = None, filtered: bool = False) -> None:
         self.rows = rows
         self.logger = logger
@@ -38,20 +45,64 @@ class HalApiClient:
                                                                          str(days)) if days is not None else ''
         self.cursor = "*"
         self.total = None
+        self.session = self._create_session()
+
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """Creates a keep-alive HTTP session reused for every page of the cursor
+
+        Returns
+        -------
+        session: requests.Session with gzip negotiation and a single pooled connection to HAL
+        """
+        session = requests.Session()
+        session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=3)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _fetch_publications(self, json_request_string: str) -> Iterator[dict]:
+        """Streams the documents of one page of HAL results
 
-    def _fetch_publications(self, json_request_string: str) -> list:
+        The response body is decompressed and parsed incrementally, documents are yielded one at a time
+        so that memory usage does not depend on the number of requested rows.
+        The cursor is moved forward once the whole page has been consumed.
+
+        Parameters
+        ----------
+        json_request_string : str, required
+                HAL API request URL
+
+        Returns
+        -------
+        docs: iterator over the HAL documents of the page
+        """
         self.logger.debug(f"Request to HAL : {json_request_string}")
-        response = requests.get(json_request_string, timeout=360)
-        json_response = response.json()
-        if 'error' in response.json().keys():
-            raise Exception(f"Error response from HAL API for request : {json_request_string}")
-        if not self.total:
-            self.total = int(json_response['response']['numFound'])
-            self.logger.info(f"{self.total} entries")
-        self.cursor = json_response['nextCursorMark']
-        return json_response['response']['docs']
-
-    def fetch_last_publications(self) -> list:
+        with self.session.get(json_request_string, timeout=self.REQUEST_TIMEOUT, stream=True) as response:
+            response.raw.decode_content = True
+            builder = None
+            next_cursor = None
+            for prefix, event, value in ijson.parse(response.raw, buf_size=self.READ_CHUNK_SIZE):
+                if prefix == self.DOC_PREFIX and event == 'start_map':
+                    builder = ijson.ObjectBuilder()
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == self.DOC_PREFIX and event == 'end_map':
+                        yield builder.value
+                        builder = None
+                elif prefix == 'error' and event in ('start_map', 'string'):
+                    raise Exception(f"Error response from HAL API for request : {json_request_string}")
+                elif prefix == 'response.numFound' and not self.total:
+                    self.total = int(value)
+                    self.logger.info(f"{self.total} entries")
+                elif prefix == 'nextCursorMark':
+                    next_cursor = value
+            if response.status_code != requests.codes.ok or next_cursor is None:
+                raise Exception(f"Error response from HAL API for request : {json_request_string}")
+        self.cursor = next_cursor
+
+    def fetch_last_publications(self) -> Iterator[dict]:
         json_request_string = HalApiClient.HAL_API_URL + HalApiClient.LIST_QUERY_TEMPLATE \
             .replace('%%CURSOR%%',
                      str(self.cursor)) \
@@ -60,7 +111,7 @@ class HalApiClient:
             .replace('%%DATE_INTERVAL%%', self.date_interval)
         return self._fetch_publications(json_request_string)
 
-    def fetch_all_publication_ids(self) -> list:
+    def fetch_all_publication_ids(self) -> Iterator[dict]:
         json_request_string = HalApiClient.HAL_API_URL + HalApiClient.ALL_IDS_QUERY_TEMPLATE \
             .replace('%%CURSOR%%',
                      str(self.cursor)) \
@@ -1,3 +1,7 @@
+import datetime
+import re
+
+
 def choose_author_identifier(auth):
     idhal_s = auth.get('idhal_s', None)
     if idhal_s and len(str(idhal_s).strip()) > 0:
@@ -7,3 +11,18 @@ def choose_author_identifier(auth):
         return f"i-{str(idhal_i)}"
     assert len(str(auth.get('form_id')).strip()) > 0
     return f"f-{auth.get('form_id')}"
+
+
+def normalize_date(value):
+    """Converts a HAL date, possibly partial (YYYY or YYYY-MM), to RFC 3339, None if it cannot be parsed"""
+    if not isinstance(value, str):
+        return None
+    match = re.fullmatch(r"(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?(?:T.*)?", value.strip())
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    try:
+        date = datetime.date(int(year), int(month or 1), int(day or 1))
+    except ValueError:
+        return None
+    return f"{date.isoformat()}T00:00:00Z"
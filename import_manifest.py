@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+
+def is_vector_field(key: str) -> bool:
+    return key == 'vector' or key.endswith('_embed')
+
+
+class ImportManifest:
+    """Local record of the content and vector hashes of the objects imported into Weaviate
+
+    Objects are keyed by class and uuid, sentences of different models sharing their uuids. An object is sent
+    again only if its properties and relations (content hash) or its vectors (vector hash) changed since its
+    last successful import.
+    """
+    DEFAULT_MANIFEST_FILE = f"{os.path.expanduser('~')}/hal_cache/import_manifest.sqlite"
+
+    QUERY_CHUNK_SIZE = 500
+
+    def __init__(self, file_path: str = DEFAULT_MANIFEST_FILE) -> None:
+        self.file_path = file_path
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS objects "
+                                "(class TEXT NOT NULL, uuid TEXT NOT NULL, content_hash TEXT NOT NULL, "
+                                "vector_hash TEXT, PRIMARY KEY (class, uuid)) WITHOUT ROWID")
+        self.connection.commit()
+
+    @staticmethod
+    def hashes(record: dict) -> tuple:
+        """Computes the hashes of an object as read from the vectorization output
+
+        Returns
+        -------
+        content_hash, vector_hash: SHA256 of the properties and relations, SHA256 of the float32 vectors
+        or None if the object has no vector
+        """
+        content = {key: value for key, value in record.items() if not is_vector_field(key) and key != 'metadata_only'}
+        content_hash = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        vector_fields = sorted(key for key, value in record.items() if is_vector_field(key) and value is not None)
+        if len(vector_fields) == 0:
+            return content_hash, None
+        digest = hashlib.sha256()
+        for key in vector_fields:
+            digest.update(key.encode("utf-8"))
+            digest.update(np.asarray(record[key], dtype=np.float32).tobytes())
+        return content_hash, digest.hexdigest()
+
+    def get_many(self, class_name: str, uuids: list) -> dict:
+        """Looks up the hashes of objects
+
+        Returns
+        -------
+        hashes: dict of (content hash, vector hash) by uuid, for the objects found
+        """
+        hashes = {}
+        for start in range(0, len(uuids), self.QUERY_CHUNK_SIZE):
+            chunk = uuids[start:start + self.QUERY_CHUNK_SIZE]
+            rows = self.connection.execute(
+                f"SELECT uuid, content_hash, vector_hash FROM objects WHERE class = ? "
+                f"AND uuid IN ({','.join('?' * len(chunk))})", [class_name] + chunk)
+            for uuid, content_hash, vector_hash in rows:
+                hashes[uuid] = (content_hash, vector_hash)
+        return hashes
+
+    def changed(self, objects: list) -> list:
+        """Selects the objects that differ from their last import
+
+        Parameters
+        ----------
+        objects : list, required
+                (class name, uuid, content hash, vector hash) tuples
+
+        Returns
+        -------
+        changed: list of the tuples of the new or modified objects, the vector hash of objects imported without
+        vector being replaced by the stored one
+        """
+        by_class = {}
+        for entry in objects:
+            by_class.setdefault(entry[0], []).append(entry)
+        changed = []
+        for class_name, entries in by_class.items():
+            stored = self.get_many(class_name, [uuid for _, uuid, _, _ in entries])
+            for _, uuid, content_hash, vector_hash in entries:
+                stored_content_hash, stored_vector_hash = stored.get(uuid, (None, None))
+                if content_hash != stored_content_hash or (vector_hash is not None
+                                                           and vector_hash != stored_vector_hash):
+                    changed.append((class_name, uuid, content_hash, vector_hash or stored_vector_hash))
+        return changed
+
+    def put_many(self, objects: list) -> None:
+        """Records successfully imported objects
+
+        Parameters
+        ----------
+        objects : list, required
+                (class name, uuid, content hash, vector hash) tuples
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO objects (class, uuid, content_hash, vector_hash) VALUES (?, ?, ?, ?)", objects)
+        self.connection.commit()
+
+    def uuids(self, class_name: str) -> set:
+        return {uuid for (uuid,) in self.connection.execute("SELECT uuid FROM objects WHERE class = ?", [class_name])}
+
+    def classes(self) -> list:
+        return [class_name for (class_name,) in self.connection.execute("SELECT DISTINCT class FROM objects")]
+
+    def remove_many(self, class_name: str, uuids) -> None:
+        self.connection.executemany("DELETE FROM objects WHERE class = ? AND uuid = ?",
+                                    [(class_name, uuid) for uuid in uuids])
+        self.connection.commit()
+
+    def clear(self) -> None:
+        self.connection.execute("DELETE FROM objects")
+        self.connection.commit()
+
+    def size(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from hal_utils import choose_author_identifier
+
+
+class LabIndex:
+    """In-memory lab mapping, used to roll sentence scores up to labs without traversing Weaviate references
+
+    Attributes
+    ----------
+    labs : dict of (identifier, name) by lab uuid
+    publication_labs : dict of lists of lab uuids by publication docid (str)
+    author_labs : dict of sets of lab uuids by author identifier
+    """
+
+    def __init__(self, labs: dict, publication_labs: dict, author_labs: dict) -> None:
+        self.labs = labs
+        self.publication_labs = publication_labs
+        self.author_labs = author_labs
+
+
+class LabMapping:
+    """Persisted lab affiliations of the publications and authors, maintained by weaviate_import.py
+
+    Publications keep the labs of their last import, authors accumulate the labs of all their imported
+    publications. weaviate_import.py --rebuild_lab_mapping rebuilds the mapping from the database.
+    """
+    DEFAULT_MAPPING_FILE = f"{os.path.expanduser('~')}/hal_cache/lab_mapping.sqlite"
+
+    def __init__(self, file_path: str = DEFAULT_MAPPING_FILE) -> None:
+        self.file_path = file_path
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS labs "
+                                "(uuid TEXT PRIMARY KEY, identifier TEXT, name TEXT) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS publication_labs "
+                                "(docid TEXT NOT NULL, lab_uuid TEXT NOT NULL, "
+                                "PRIMARY KEY (docid, lab_uuid)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS author_labs "
+                                "(identifier TEXT NOT NULL, lab_uuid TEXT NOT NULL, "
+                                "PRIMARY KEY (identifier, lab_uuid)) WITHOUT ROWID")
+        self.connection.commit()
+
+    def record(self, file_prefix: str, records: list) -> None:
+        """Records the labs of imported objects
+
+        Parameters
+        ----------
+        file_prefix : str, required
+                import step of the objects
+        records : list, required
+                objects as read from the vectorization output
+        """
+        if file_prefix == 'lab':
+            self.connection.executemany("INSERT OR REPLACE INTO labs (uuid, identifier, name) VALUES (?, ?, ?)",
+                                        [(str(org['uuid']), str(org['id']), org['name']) for org in records])
+        elif file_prefix == 'auth':
+            self.connection.executemany("INSERT OR IGNORE INTO author_labs (identifier, lab_uuid) VALUES (?, ?)",
+                                        [(str(choose_author_identifier(author)), str(lab_uuid))
+                                         for author in records for lab_uuid in author.get('has_lab', [])])
+        elif file_prefix == 'pub':
+            docids = [(str(publication['docid']),) for publication in records]
+            self.connection.executemany("DELETE FROM publication_labs WHERE docid = ?", docids)
+            self.connection.executemany("INSERT OR IGNORE INTO publication_labs (docid, lab_uuid) VALUES (?, ?)",
+                                        [(str(publication['docid']), str(lab_uuid)) for publication in records
+                                         for lab_uuid in publication.get('has_lab', [])])
+        else:
+            return
+        self.connection.commit()
+
+    def rebuild(self, labs: list, publication_labs: list, author_labs: list) -> None:
+        """Replaces the whole mapping, in a single transaction
+
+        Parameters
+        ----------
+        labs : list, required
+                (uuid, identifier, name) tuples
+        publication_labs : list, required
+                (docid, lab uuid) tuples
+        author_labs : list, required
+                (author identifier, lab uuid) tuples
+        """
+        with self.connection:
+            for table in ['labs', 'publication_labs', 'author_labs']:
+                self.connection.execute(f"DELETE FROM {table}")
+            self.connection.executemany("INSERT OR REPLACE INTO labs (uuid, identifier, name) VALUES (?, ?, ?)", labs)
+            self.connection.executemany("INSERT OR IGNORE INTO publication_labs (docid, lab_uuid) VALUES (?, ?)",
+                                        publication_labs)
+            self.connection.executemany("INSERT OR IGNORE INTO author_labs (identifier, lab_uuid) VALUES (?, ?)",
+                                        author_labs)
+
+    def clear(self) -> None:
+        for table in ['labs', 'publication_labs', 'author_labs']:
+            self.connection.execute(f"DELETE FROM {table}")
+        self.connection.commit()
+
+    def load(self) -> LabIndex:
+        labs = {uuid: (identifier, name) for uuid, identifier, name in
+                self.connection.execute("SELECT uuid, identifier, name FROM labs")}
+        publication_labs = {}
+        for docid, lab_uuid in self.connection.execute("SELECT docid, lab_uuid FROM publication_labs"):
+            publication_labs.setdefault(docid, []).append(lab_uuid)
+        author_labs = {}
+        for identifier, lab_uuid in self.connection.execute("SELECT identifier, lab_uuid FROM author_labs"):
+            author_labs.setdefault(identifier, set()).add(lab_uuid)
+        return LabIndex(labs, publication_labs, author_labs)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class CachedLabIndex:
+    """Lab index held in memory by the query workers, reloaded from the mapping file at most every interval"""
+    RELOAD_INTERVAL_SECS = 3600
+
+    def __init__(self, file_path: str = LabMapping.DEFAULT_MAPPING_FILE) -> None:
+        self.file_path = file_path
+        self.index = None
+        self.loaded_at = None
+
+    def get(self) -> LabIndex:
+        if self.index is None or time.monotonic() - self.loaded_at > self.RELOAD_INTERVAL_SECS:
+            mapping = LabMapping(self.file_path)
+            try:
+                self.index = mapping.load()
+            finally:
+                mapping.close()
+            self.loaded_at = time.monotonic()
+        return self.index
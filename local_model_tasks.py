@@ -3,7 +3,10 @@ from celery.signals import worker_process_init
 from dotenv import dotenv_values
 from sentence_transformers import SentenceTransformer
 
+from coauthor_graph import CachedCoauthorGraph
+from lab_mapping import CachedLabIndex
 from scoring_strategy import ScoringStrategy
+from similar_authors import SimilarAuthors, similar_authors_file, DEFAULT_NEIGHBOURS
 from vector_database import VectorDatabase
 
 celery_params = dict(dotenv_values(".env.celery"))
@@ -13,6 +16,9 @@ EMBEDDING_MODEL = 'text-embedding-ada-002'
 EMBEDDING_CTX_LENGTH = 8191
 EMBEDDING_ENCODING = 'cl100k_base'
 
+lab_index = CachedLabIndex()
+coauthor_graph = CachedCoauthorGraph()
+
 app = Celery('local_model_tasks', **celery_params)
 
 
@@ -21,6 +27,10 @@ def initialization():
                                                device='cpu')
 
 
+# neighbour lists by model, loaded on first use
+similar_authors = {}
+
+
 @worker_process_init.connect()
 def setup(**kwargs):
     print('initializing SBert sentence embedding model')
@@ -29,8 +39,36 @@ def setup(**kwargs):
 
 
 @app.task(name='local_model_tasks.find_expert_with_sbert')
-def find_experts(sentence, precision):
+def find_experts(sentence, precision, own_inst_only=False, doc_types=None, date_from=None, date_to=None,
+                 mode=VectorDatabase.SENTENCE_MODE, collaboration_boost=0.0):
     sentence_class = "SbertSentence"
     embedding = initialization.model.encode([sentence])[0]
-    results = VectorDatabase().results(embedding, sentence_class)
-    return ScoringStrategy().compute_scores_by_author(results['data']['Get'][sentence_class], precision)
+    filters = {'own_inst_only': own_inst_only, 'doc_types': doc_types, 'date_from': date_from, 'date_to': date_to}
+    if mode == VectorDatabase.AUTHOR_MODE:
+        profiles, results = VectorDatabase().author_results(embedding, "SbertAuthorProfile", sentence_class, filters)
+        return ScoringStrategy().compute_scores_by_profile(profiles, results['data']['Get'][sentence_class],
+                                                           precision, own_inst_only)
+    results = VectorDatabase().results(embedding, sentence_class, filters)
+    if mode == VectorDatabase.LAB_MODE:
+        return ScoringStrategy().compute_scores_by_lab(results['data']['Get'][sentence_class], precision,
+                                                       lab_index.get(), own_inst_only)
+    scores = ScoringStrategy().compute_scores_by_author(results['data']['Get'][sentence_class], precision,
+                                                        own_inst_only)
+    if collaboration_boost:
+        scores = ScoringStrategy().apply_collaboration_boost(scores, coauthor_graph.get(), collaboration_boost)
+    return scores
+
+
+@app.task(name='local_model_tasks.find_similar_experts')
+def find_similar_experts(identifier, model='sbert', limit=DEFAULT_NEIGHBOURS):
+    if model not in ['sbert', 'ada']:
+        raise ValueError(f"Unknown model : {model}")
+    if model not in similar_authors:
+        similar_authors[model] = SimilarAuthors(similar_authors_file(model))
+    return similar_authors[model].similar(identifier, int(limit))
+
+
+@app.task(name='local_model_tasks.find_collaborators')
+def find_collaborators(identifier, limit=None):
+    graph = coauthor_graph.get()
+    return graph.collaborators(identifier, limit) if graph is not None else []
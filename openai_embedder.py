@@ -0,0 +1,177 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+import tiktoken
+
+# transient failures, other errors (authentication, invalid request...) would fail again and are raised at once
+RETRYABLE_ERRORS = (openai.error.RateLimitError, openai.error.APIError, openai.error.APIConnectionError,
+                    openai.error.Timeout, openai.error.ServiceUnavailableError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a rate expressed per minute"""
+
+    def __init__(self, rate_per_minute: int, capacity: int = None) -> None:
+        if rate_per_minute <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate_per_minute}")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: int = 1) -> None:
+        """Blocks until the requested amount of tokens is available
+
+        Parameters
+        ----------
+        amount : int, optional
+                number of tokens, capped to the bucket capacity
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class OpenAIEmbedder:
+    """Batched, rate-limited and token-aware client for the OpenAI embedding API
+
+    Inputs are tokenized with tiktoken, inputs longer than the model context are either truncated
+    or split into chunks whose embeddings are averaged, then many inputs are packed into each request
+    within a token budget. Requests run concurrently under token and request rate limits and transient
+    failures are retried with exponential backoff.
+    """
+    EMBEDDING_MODEL = 'text-embedding-ada-002'
+    EMBEDDING_CTX_LENGTH = 8191
+    EMBEDDING_ENCODING = 'cl100k_base'
+
+    MAX_INPUTS_PER_REQUEST = 2048
+    MAX_TOKENS_PER_REQUEST = 50000
+    DEFAULT_CONCURRENCY = 4
+    DEFAULT_TOKENS_PER_MINUTE = 1000000
+    DEFAULT_REQUESTS_PER_MINUTE = 3000
+    MAX_ATTEMPTS = 8
+    MAX_BACKOFF_SECS = 60
+
+    CHUNK = 'chunk'
+    TRUNCATE = 'truncate'
+
+    def __init__(self, logger: logging.Logger, model: str = EMBEDDING_MODEL, concurrency: int = DEFAULT_CONCURRENCY,
+                 tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+                 requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+                 max_tokens_per_request: int = MAX_TOKENS_PER_REQUEST, long_inputs: str = CHUNK,
+                 api_base: str = None) -> None:
+        assert long_inputs in (self.CHUNK, self.TRUNCATE)
+        self.logger = logger
+        self.model = model
+        self.concurrency = concurrency
+        self.max_tokens_per_request = max(max_tokens_per_request, self.EMBEDDING_CTX_LENGTH)
+        self.long_inputs = long_inputs
+        self.api_base = api_base
+        self.encoding = tiktoken.get_encoding(self.EMBEDDING_ENCODING)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.requests = 0
+        self.tokens = 0
+
+    def _chunks(self, text: str) -> list:
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= self.EMBEDDING_CTX_LENGTH:
+            return [tokens]
+        if self.long_inputs == self.TRUNCATE:
+            self.logger.debug(f"Input of {len(tokens)} tokens truncated to {self.EMBEDDING_CTX_LENGTH}")
+            return [tokens[:self.EMBEDDING_CTX_LENGTH]]
+        self.logger.debug(f"Input of {len(tokens)} tokens split into chunks of {self.EMBEDDING_CTX_LENGTH}")
+        return [tokens[start:start + self.EMBEDDING_CTX_LENGTH] for start in
+                range(0, len(tokens), self.EMBEDDING_CTX_LENGTH)]
+
+    def _pack(self, chunks: list) -> list:
+        """Groups chunks into requests within the input number and token budgets
+
+        Parameters
+        ----------
+        chunks : list, required
+                token lists
+
+        Returns
+        -------
+        requests: list of lists of chunk indexes
+        """
+        requests, current, current_tokens = [], [], 0
+        for index, chunk in enumerate(chunks):
+            if current and (len(current) >= self.MAX_INPUTS_PER_REQUEST
+                            or current_tokens + len(chunk) > self.max_tokens_per_request):
+                requests.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += len(chunk)
+        if current:
+            requests.append(current)
+        return requests
+
+    def _request(self, inputs: list) -> list:
+        num_tokens = sum(map(len, inputs))
+        for attempt in range(self.MAX_ATTEMPTS):
+            self.request_bucket.acquire()
+            self.token_bucket.acquire(num_tokens)
+            try:
+                kwargs = {'api_base': self.api_base} if self.api_base else {}
+                response = openai.Embedding.create(input=inputs, model=self.model, **kwargs)
+                self.requests += 1
+                self.tokens += num_tokens
+                return [np.asarray(item["embedding"], dtype=np.float32) for item in
+                        sorted(response["data"], key=lambda item: item["index"])]
+            except RETRYABLE_ERRORS as e:
+                sleep_dur = min(self.MAX_BACKOFF_SECS, 2 ** attempt) * (1 + random.random())
+                self.logger.error(f"Error during OpenAI API call : {str(e)}, "
+                                  f"attempt {attempt + 1}/{self.MAX_ATTEMPTS}, retrying in {round(sleep_dur, 2)} seconds.")
+                time.sleep(sleep_dur)
+        raise RuntimeError(f"OpenAI API call failed {self.MAX_ATTEMPTS} times, abort")
+
+    def embed(self, texts: list) -> list:
+        """Computes the embeddings of texts
+
+        Parameters
+        ----------
+        texts : list, required
+                texts to vectorize
+
+        Returns
+        -------
+        embeddings: list of np.ndarray vectors in the order of the texts
+        """
+        chunks, owners = [], []
+        for text_index, text in enumerate(texts):
+            for chunk in self._chunks(text):
+                chunks.append(chunk)
+                owners.append(text_index)
+        requests = self._pack(chunks)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            responses = list(executor.map(lambda request: self._request([chunks[i] for i in request]), requests))
+        vectors = [[] for _ in texts]
+        weights = [[] for _ in texts]
+        for request, embeddings in zip(requests, responses):
+            for chunk_index, embedding in zip(request, embeddings):
+                vectors[owners[chunk_index]].append(embedding)
+                weights[owners[chunk_index]].append(len(chunks[chunk_index]))
+        return [self._combine(text_vectors, text_weights) for text_vectors, text_weights in zip(vectors, weights)]
+
+    @staticmethod
+    def _combine(vectors: list, weights: list) -> np.ndarray:
+        if len(vectors) == 1:
+            return vectors[0]
+        average = np.average(np.stack(vectors), axis=0, weights=weights)
+        return (average / np.linalg.norm(average)).astype(np.float32)
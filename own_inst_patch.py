@@ -3,6 +3,7 @@ import ast
 import logging
 import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import weaviate
@@ -11,6 +12,7 @@ from dotenv import dotenv_values
 from hal_utils import choose_author_identifier
 from log_handler import LogHandler
 from mail_sender import MailSender
+from own_inst_state import OwnInstState
 from uuid_provider import UUIDProvider
 
 OWN_INST_ORG_ID = 7550
@@ -18,6 +20,8 @@ OWN_INST_ORG_ID = 7550
 DEFAULT_INPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_dump"
 DEFAULT_INPUT_FILE_NAME = "dump.csv"
 
+DEFAULT_CONCURRENCY = 8
+
 weaviate_params = dict(dotenv_values(".env.weaviate"))
 
 
@@ -32,80 +36,101 @@ def parse_arguments():
                         help='CSV input file directory', required=False, default=DEFAULT_INPUT_DIR_NAME)
     parser.add_argument('--csv_file', dest='csv_file',
                         help='CSV input file name', required=False, default=DEFAULT_INPUT_FILE_NAME)
+    parser.add_argument('--state_file', dest='state_file',
+                        help='Persisted author affiliations and applied flags', required=False,
+                        default=OwnInstState.DEFAULT_STATE_FILE)
+    parser.add_argument('--concurrency', dest='concurrency',
+                        help='Number of concurrent update requests', required=False, default=DEFAULT_CONCURRENCY,
+                        type=int)
     parser.add_argument('--dry', dest='dry',
                         help='Dry run', required=False,
                         default=False, type=bool)
     return parser.parse_args()
 
 
+def author_contributions(authors_data, affiliations):
+    """Computes the affiliation to the institution of the authors of a publication
+
+    Returns
+    -------
+    contributions: dict of booleans by author uuid
+    """
+    uuids = {}
+    contributions = {}
+    for auth in authors_data:
+        identifier = choose_author_identifier(auth)
+        uuids[auth['hal_id']] = str(UUIDProvider(f"hal-auth-{identifier}").value())
+        contributions.setdefault(uuids[auth['hal_id']], False)
+    for affiliation in affiliations:
+        author_uuid = uuids.get(affiliation['hal_id'], None)
+        if author_uuid is not None:
+            contributions[author_uuid] |= (affiliation['org_id'] == OWN_INST_ORG_ID)
+    return contributions
+
+
+def push_changes(client, changes, concurrency):
+    """Patches the own_inst flag of authors with concurrent requests
+
+    Returns
+    -------
+    applied, missing: dict of the flags applied by author uuid, number of authors not found
+    """
+
+    def patch(item):
+        author_uuid, own_inst = item
+        try:
+            client.data_object.update(data_object={"own_inst": own_inst}, class_name='Author', uuid=author_uuid)
+            return True
+        except weaviate.exceptions.UnexpectedStatusCodeException as e:
+            if e.status_code != 404:
+                raise
+            logger.error(f"Author with UUID {author_uuid} does not exist.")
+            return False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(patch, changes.items()))
+    applied = {author_uuid: own_inst for (author_uuid, own_inst), found in zip(changes.items(), results) if found}
+    return applied, len(changes) - len(applied)
+
+
 def main(args):
     global logger
     dry = args.dry
-    if not dry:
-        client = get_client()
     logger = LogHandler("own_inst_patch", 'log', 'own_inst_patch.log',
                         logging.INFO).create_rotating_log()
     directory = args.csv_dir
     file = args.csv_file
     file_path = f"{directory}/{file}"
-    csv = pd.read_csv(file_path)
+    csv = pd.read_csv(file_path, usecols=['docid', 'hash', 'authors', 'affiliations'])
     logger.info(f"Total number of documents : {len(csv)}")
-
-    metadata = csv[
-        ['authors', 'affiliations']]
-
-    total = len(metadata)
-    docs_counter = 0
-    authors_data_struct = {}
-    for index, row in metadata.iterrows():
-        docs_counter += 1
+    state = OwnInstState(args.state_file)
+    changed, removed = state.changed_docids(dict(zip(csv['docid'].astype(int), csv['hash'].astype(str))))
+    logger.info(f"Documents to process : {len(changed)} new or modified, {len(removed)} removed")
+    touched_authors = state.remove_docs(removed)
+    rows = csv[csv['docid'].isin(changed)]
+    for docid, row_hash, authors, affiliations in zip(rows['docid'], rows['hash'], rows['authors'],
+                                                      rows['affiliations']):
         try:
-            affiliations = ast.literal_eval(row['affiliations'])
-            authors_data = ast.literal_eval(row['authors'])
-        except SyntaxError as e:
+            contributions = author_contributions(ast.literal_eval(authors), ast.literal_eval(affiliations))
+        except (SyntaxError, ValueError) as e:
             logger.debug(e)
-            print(e)
             continue
-
-        for auth in authors_data:
-            if auth['hal_id'] not in authors_data_struct:
-                identifier = choose_author_identifier(auth)
-                authors_data_struct[auth['hal_id']] = auth | {'own_inst': False,
-                                                              'identifier': identifier,
-                                                              'uuid': str(
-                                                                  UUIDProvider(f"hal-auth-{identifier}").value())}
-        for affiliation in affiliations:
-            org_id = affiliation['org_id']
-            hal_id = affiliation['hal_id']
-            authors_data_struct[hal_id]['own_inst'] |= (org_id == OWN_INST_ORG_ID)
-
-        logger.info(f"Index : {index} Count : {docs_counter}/{total}")
-    own_inst_counter = 0
+        touched_authors |= state.replace_doc(int(docid), str(row_hash), contributions)
+    state.forget_authors(touched_authors)
+    changes = state.pending_changes(touched_authors)
+    own_inst_counter = sum(changes.values())
+    logger.info(f"Flags to push : {own_inst_counter} set, {len(changes) - own_inst_counter} cleared")
     missing_counter = 0
-    for auth in authors_data_struct.values():
-        author_uuid = auth['uuid']
-        author_name = auth['name']
-        author_own_inst = auth['own_inst']
-        logger.info(f"{author_name} ({author_uuid}) : {author_own_inst}")
-        if author_own_inst is True:
-            logger.info(f"Updating own_inst for {author_name}")
-            own_inst_counter += 1
-        else:
-            continue
-        if not dry:
-            if client.data_object.exists(class_name='Author',
-                                         uuid=author_uuid
-                                         ):
-                client.data_object.update(
-                    data_object={"own_inst": True},
-                    class_name='Author',
-                    uuid=author_uuid
-                )
-            else:
-                logger.error(f"Author with UUID {author_uuid} does not exist.")
-                missing_counter += 1
+    if not dry:
+        client = get_client()
+        applied, missing_counter = push_changes(client, changes, args.concurrency)
+        state.set_applied(applied)
+        state.commit()
+    state.close()
     MailSender().send_email(type=MailSender.INFO,
-                            text=f"Successfully tagged {own_inst_counter} authors as belonging to the university ({missing_counter} not found)")
+                            text=f"Successfully tagged {own_inst_counter} authors as belonging to the university "
+                                 f"and untagged {len(changes) - own_inst_counter} ({missing_counter} not found)"
+                                 f"{' (Simulation)' if dry else ''}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+from pathlib import Path
+
+
+class OwnInstState:
+    """Persisted author affiliations to the institution, by publication, and last own_inst flags applied
+
+    An author belongs to the institution if any of its publications affiliates it to the institution.
+    Contributions are stored per docid along with the hash of the row they were computed from, so that only
+    new or modified rows have to be parsed. Changes are kept in a transaction until commit.
+    """
+    DEFAULT_STATE_FILE = f"{os.path.expanduser('~')}/hal_cache/own_inst.sqlite"
+
+    def __init__(self, file_path: str = DEFAULT_STATE_FILE) -> None:
+        self.file_path = file_path
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file_path, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS docs (docid INTEGER PRIMARY KEY, hash TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS contributions "
+                                "(docid INTEGER NOT NULL, author_uuid TEXT NOT NULL, own INTEGER NOT NULL, "
+                                "PRIMARY KEY (docid, author_uuid)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS contributions_author ON contributions (author_uuid)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS applied "
+                                "(author_uuid TEXT PRIMARY KEY, own_inst INTEGER NOT NULL) WITHOUT ROWID")
+        self.connection.commit()
+
+    def changed_docids(self, hashes: dict) -> tuple:
+        """Compares the rows of the dump with the rows already taken into account
+
+        Parameters
+        ----------
+        hashes : dict, required
+                row hash by docid
+
+        Returns
+        -------
+        changed, removed: list of docids of new or modified rows, list of docids no longer in the dump
+        """
+        known = dict(self.connection.execute("SELECT docid, hash FROM docs"))
+        changed = [docid for docid, row_hash in hashes.items() if known.get(docid, None) != row_hash]
+        removed = [docid for docid in known if docid not in hashes]
+        return changed, removed
+
+    def remove_docs(self, docids: list) -> set:
+        """Removes the contributions of publications
+
+        Returns
+        -------
+        authors: set of uuids of the authors of the removed publications
+        """
+        authors = set()
+        for docid in docids:
+            authors.update(uuid for (uuid,) in self.connection.execute(
+                "SELECT author_uuid FROM contributions WHERE docid = ?", [docid]))
+            self.connection.execute("DELETE FROM contributions WHERE docid = ?", [docid])
+            self.connection.execute("DELETE FROM docs WHERE docid = ?", [docid])
+        return authors
+
+    def replace_doc(self, docid: int, row_hash: str, contributions: dict) -> set:
+        """Replaces the contributions of a publication
+
+        Parameters
+        ----------
+        docid : int, required
+                publication docid
+        row_hash : str, required
+                hash of the row the contributions were computed from
+        contributions : dict, required
+                affiliation to the institution by author uuid
+
+        Returns
+        -------
+        authors: set of uuids of the previous and new authors of the publication
+        """
+        authors = self.remove_docs([docid]) | set(contributions.keys())
+        self.connection.executemany("INSERT INTO contributions (docid, author_uuid, own) VALUES (?, ?, ?)",
+                                    [(docid, uuid, int(own)) for uuid, own in contributions.items()])
+        self.connection.execute("INSERT INTO docs (docid, hash) VALUES (?, ?)", [docid, row_hash])
+        return authors
+
+    def pending_changes(self, touched_authors: set) -> dict:
+        """Lists the flags to push : differing from the last applied ones, or of authors of modified rows,
+        which may have been rewritten by the import
+
+        Returns
+        -------
+        changes: dict of own_inst flags by author uuid
+        """
+        computed = dict(self.connection.execute(
+            "SELECT author_uuid, MAX(own) FROM contributions GROUP BY author_uuid"))
+        applied = dict(self.connection.execute("SELECT author_uuid, own_inst FROM applied"))
+        return {uuid: bool(own) for uuid, own in computed.items() if
+                applied.get(uuid, None) != own or uuid in touched_authors}
+
+    def set_applied(self, flags: dict) -> None:
+        self.connection.executemany("INSERT OR REPLACE INTO applied (author_uuid, own_inst) VALUES (?, ?)",
+                                    [(uuid, int(own)) for uuid, own in flags.items()])
+
+    def forget_authors(self, uuids) -> None:
+        """Forgets the applied flags of authors that no longer have any publication"""
+        self.connection.executemany("DELETE FROM applied WHERE author_uuid = ? AND NOT EXISTS "
+                                    "(SELECT 1 FROM contributions WHERE author_uuid = ?)",
+                                    [(uuid, uuid) for uuid in uuids])
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        """Closes the state, uncommitted changes are discarded"""
+        self.connection.close()
@@ -0,0 +1,61 @@
+import os
+
+
+class ProgressJournal:
+    """Append-only journal of the documents whose vectorization is complete
+
+    Each line holds a docid and the hash of the row that was vectorized, so that a document updated again
+    after a crash is not mistaken for a completed one. Lines are flushed after each document and the file
+    is synced to disk every `sync_rate` documents.
+    """
+
+    def __init__(self, file_path: str, sync_rate: int = 100) -> None:
+        self.file_path = file_path
+        self.sync_rate = sync_rate
+        self.entries = self._load()
+        self.pending = 0
+        self.outfile = open(file_path, "a")
+
+    def _load(self) -> dict:
+        entries = {}
+        if not os.path.exists(self.file_path):
+            return entries
+        with open(self.file_path) as infile:
+            for line in infile:
+                fields = line.split()
+                # an incomplete last line is the trace of a crash during the write
+                if len(fields) != 2 or not line.endswith("\n"):
+                    continue
+                entries[int(fields[0])] = fields[1]
+        return entries
+
+    def is_done(self, docid: int, row_hash: str) -> bool:
+        return self.entries.get(int(docid), None) == str(row_hash)
+
+    def append(self, docid: int, row_hash: str) -> None:
+        self.entries[int(docid)] = str(row_hash)
+        self.outfile.write(f"{int(docid)} {row_hash}\n")
+        self.outfile.flush()
+        self.pending += 1
+        if self.pending >= self.sync_rate:
+            self.sync()
+
+    def sync(self) -> None:
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+        self.pending = 0
+
+    def docids(self) -> list:
+        return list(self.entries.keys())
+
+    def clear(self) -> None:
+        """Empties the journal once its content has been reconciled with the source table"""
+        self.outfile.close()
+        self.entries = {}
+        self.pending = 0
+        self.outfile = open(self.file_path, "w")
+        self.sync()
+
+    def close(self) -> None:
+        self.sync()
+        self.outfile.close()
@@ -0,0 +1,107 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RelationSync:
+    """Brings the cross-references of many objects to their target sets with as few requests as possible
+
+    The current references of the objects are read in bulk through GraphQL, then for each object and property
+    nothing is sent if the set is unchanged, missing references are added through the batch when the change is
+    a pure addition, and the property is replaced by a single request otherwise. Reads and replacements run
+    concurrently with bounded concurrency.
+    """
+    DEFAULT_CONCURRENCY = 8
+    QUERY_CHUNK_SIZE = 100
+
+    def __init__(self, client, logger: logging.Logger, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+        self.client = client
+        self.logger = logger
+        self.concurrency = concurrency
+        self.unchanged = 0
+        self.added = 0
+        self.replaced = 0
+
+    def current_references(self, class_name: str, properties: dict, uuids: list) -> dict:
+        """Reads the current references of objects of a class
+
+        Parameters
+        ----------
+        class_name : str, required
+                class of the objects
+        properties : dict, required
+                target class by reference property
+        uuids : list, required
+                uuids of the objects
+
+        Returns
+        -------
+        references: dict of sets of target uuids by property, by object uuid, for the objects found
+        """
+        fields = [f"{prop} {{ ... on {target_class} {{ _additional {{ id }} }} }}" for prop, target_class in
+                  properties.items()]
+        where = {"operator": "Or",
+                 "operands": [{"path": ["id"], "operator": "Equal", "valueString": str(uuid)} for uuid in uuids]}
+        response = self.client.query.get(class_name, fields).with_additional(["id"]).with_where(where).with_limit(
+            len(uuids)).do()
+        if response.get('errors', None):
+            raise RuntimeError(f"Unable to read the references of {class_name} objects : {response['errors']}")
+        references = {}
+        for item in response['data']['Get'][class_name] or []:
+            references[item['_additional']['id']] = {
+                prop: {target['_additional']['id'] for target in item.get(prop, None) or []} for prop in properties}
+        return references
+
+    def sync(self, records, relations_function) -> None:
+        """Synchronizes the references of records
+
+        Parameters
+        ----------
+        records : list, required
+                objects to synchronize
+        relations_function : function, required
+                returns for a record its class name and a dict of (target class, target uuids) by property
+        """
+        targets = {}
+        for record in records:
+            class_name, relations = relations_function(record)
+            targets.setdefault(class_name, {})[str(record['uuid'])] = relations
+        replacements = []
+        for class_name, objects in targets.items():
+            properties = {prop: target_class for relations in objects.values() for prop, (target_class, _) in
+                          relations.items()}
+            uuids = list(objects.keys())
+            chunks = [uuids[start:start + self.QUERY_CHUNK_SIZE] for start in
+                      range(0, len(uuids), self.QUERY_CHUNK_SIZE)]
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                current = {}
+                for references in executor.map(lambda chunk: self.current_references(class_name, properties, chunk),
+                                               chunks):
+                    current |= references
+            for uuid, relations in objects.items():
+                for prop, (target_class, target_uuids) in relations.items():
+                    target = set(map(str, target_uuids))
+                    existing = current.get(uuid, {}).get(prop, set())
+                    if target == existing:
+                        self.unchanged += 1
+                    elif existing <= target:
+                        for target_uuid in target - existing:
+                            self.client.batch.add_reference(uuid, class_name, prop, target_uuid, target_class)
+                        self.added += 1
+                    else:
+                        replacements.append((uuid, class_name, prop, sorted(target), target_class))
+        self.client.batch.flush()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(lambda replacement: self._replace(*replacement), replacements))
+        self.replaced += len(replacements)
+
+    def _replace(self, uuid, class_name, prop, target_uuids, target_class):
+        self.client.data_object.reference.update(
+            from_uuid=uuid,
+            from_property_name=prop,
+            to_uuids=target_uuids,
+            from_class_name=class_name,
+            to_class_names=target_class,
+        )
+
+    def report(self) -> str:
+        return f"References : {self.unchanged} unchanged, {self.added} completed by batch, {self.replaced} replaced"
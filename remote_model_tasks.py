@@ -2,6 +2,8 @@ import openai
 from celery import Celery
 from dotenv import dotenv_values
 
+from coauthor_graph import CachedCoauthorGraph
+from lab_mapping import CachedLabIndex
 from scoring_strategy import ScoringStrategy
 from vector_database import VectorDatabase
 
@@ -13,6 +15,9 @@ openai_params = dict(dotenv_values(".env.openai"))
 openai.organization = openai_params['organization']
 openai.api_key = openai_params['api_key']
 
+lab_index = CachedLabIndex()
+coauthor_graph = CachedCoauthorGraph()
+
 app = Celery('remote_model_tasks', **celery_params)
 
 
@@ -21,8 +26,26 @@ def get_openai_embedding(text_or_tokens, model=EMBEDDING_MODEL):
 
 
 @app.task(name='remote_model_tasks.find_expert_with_ada')
-def find_experts(sentence, precision):
+def find_experts(sentence, precision, own_inst_only=False, doc_types=None, date_from=None, date_to=None,
+                 shortlist_size=None, mode=VectorDatabase.SENTENCE_MODE, collaboration_boost=0.0):
     sentence_class = "AdaSentence"
     embedding = f"[{' '.join(map(str, get_openai_embedding(sentence)))}]"
-    results = VectorDatabase().results(embedding, sentence_class)
-    return ScoringStrategy().compute_scores_by_author(results['data']['Get'][sentence_class], precision)
+    filters = {'own_inst_only': own_inst_only, 'doc_types': doc_types, 'date_from': date_from, 'date_to': date_to}
+    if mode == VectorDatabase.AUTHOR_MODE:
+        profiles, results = VectorDatabase().author_results(embedding, "AdaAuthorProfile", sentence_class, filters)
+        return ScoringStrategy().compute_scores_by_profile(profiles, results['data']['Get'][sentence_class],
+                                                           precision, own_inst_only)
+    if shortlist_size:
+        # publications are vectorized with ada : the same query vector searches both classes
+        results = VectorDatabase().two_stage_results(embedding, embedding, sentence_class, filters,
+                                                     int(shortlist_size))
+    else:
+        results = VectorDatabase().results(embedding, sentence_class, filters)
+    if mode == VectorDatabase.LAB_MODE:
+        return ScoringStrategy().compute_scores_by_lab(results['data']['Get'][sentence_class], precision,
+                                                       lab_index.get(), own_inst_only)
+    scores = ScoringStrategy().compute_scores_by_author(results['data']['Get'][sentence_class], precision,
+                                                        own_inst_only)
+    if collaboration_boost:
+        scores = ScoringStrategy().apply_collaboration_boost(scores, coauthor_graph.get(), collaboration_boost)
+    return scores
@@ -1,6 +1,12 @@
+import numpy as np
+
+
 class ScoringStrategy:
     MIN_PRECISION = 0.05
     MAX_PRECISION = 0.7
+    MAX_COLLABORATION_BOOST = 1.0
+    # joint publications for a co-author to count as a strong collaborator
+    MIN_COLLABORATION_WEIGHT = 2
 
     @staticmethod
     def apply_limits(precision: float) -> float:
@@ -14,7 +20,7 @@ class ScoringStrategy:
     def avg(scores_list):
         return sum(scores_list) / len(scores_list)
 
-    def compute_scores_by_author(self, results, precision):
+    def compute_scores_by_author(self, results, precision, own_inst_only=False):
         precision = self.apply_limits(precision)
         inverted_results = {}
         for sent in results:
@@ -24,7 +30,8 @@ class ScoringStrategy:
             sent_score = self.compute_score(distance, precision)
             docid = sent['docid']
             sentid = sent['sentid']
-            sent_data = {'text': sent['text'], 'score': sent_score, 'id': sentid}
+            sent_data = {'text': sent['text'], 'alt_texts': sent.get('alt_texts', None) or [], 'score': sent_score,
+                         'id': sentid}
             print(f"{distance} ({docid}) -> {sent['text']} (score : {sent_score}")
             if sent['hasPublication'] is None:
                 continue
@@ -35,6 +42,9 @@ class ScoringStrategy:
             if pub['hasAuthors'] is None:
                 continue
             for auth in pub['hasAuthors']:
+                # the publication matched the filter, its external co-authors do not
+                if own_inst_only and auth['own_inst'] is not True:
+                    continue
                 author_identifier = auth['identifier']
                 auth_data = {key: str(auth[key]) if auth[key] is not None else '' for key in
                              ['identifier', 'name', 'own_inst']}
@@ -61,3 +71,76 @@ class ScoringStrategy:
                     inverted_results[author_identifier]['pubs'][docid]['sents'][sentid] = sent_data | {
                         'score': sent_score}
         return inverted_results
+
+    def compute_scores_by_profile(self, profiles, results, precision, own_inst_only=False):
+        """Ranks the authors by the similarity of their expertise profile to the query
+
+        Sentences of their publications close enough to the query are attached as evidence, scored as in
+        compute_scores_by_author.
+        """
+        evidence = self.compute_scores_by_author(results, precision, own_inst_only)
+        ranked_results = {}
+        for profile in profiles:
+            author_identifier = profile['identifier']
+            auth_data = {key: str(profile[key]) if profile[key] is not None else '' for key in
+                         ['identifier', 'name', 'own_inst']}
+            ranked_results[author_identifier] = evidence.get(author_identifier, auth_data | {'pubs': {}}) | {
+                'profile_score': 1 - profile['_additional']['distance'],
+                'sentence_count': profile['sentence_count']}
+        return ranked_results
+
+    def compute_scores_by_lab(self, results, precision, lab_index, own_inst_only=False):
+        """Aggregates the sentence scores by lab of the publications, from the in-memory lab mapping
+
+        Each lab lists its matching publications and those of their authors affiliated to the lab.
+        """
+        precision = self.apply_limits(precision)
+        labs_results = {}
+        for sent in results:
+            distance = sent['_additional']['distance']
+            if distance > precision or sent['hasPublication'] is None:
+                continue
+            sent_score = self.compute_score(distance, precision)
+            docid = sent['docid']
+            pub = sent['hasPublication'][0]
+            for lab_uuid in lab_index.publication_labs.get(str(docid), []):
+                identifier, name = lab_index.labs.get(lab_uuid, ('', ''))
+                if lab_uuid not in labs_results:
+                    labs_results[lab_uuid] = {'identifier': identifier, 'name': name, 'score': 0, 'max_score': 0,
+                                              'pubs': {}, 'authors': {}}
+                lab_data = labs_results[lab_uuid]
+                lab_data['score'] += sent_score
+                lab_data['max_score'] = max(sent_score, lab_data['max_score'])
+                if docid not in lab_data['pubs']:
+                    lab_data['pubs'][docid] = {key: str(pub[key]) if pub[key] is not None else '' for key in
+                                               ['citation_ref', 'doc_type', 'docid', 'en_title', 'fr_title']} | {
+                                                  'score': 0}
+                lab_data['pubs'][docid]['score'] += sent_score
+                for auth in pub['hasAuthors'] or []:
+                    if own_inst_only and auth['own_inst'] is not True:
+                        continue
+                    if lab_uuid not in lab_index.author_labs.get(auth['identifier'], ()):
+                        continue
+                    if auth['identifier'] not in lab_data['authors']:
+                        lab_data['authors'][auth['identifier']] = {'name': str(auth['name'] or ''), 'score': 0}
+                    lab_data['authors'][auth['identifier']]['score'] += sent_score
+        return labs_results
+
+    def apply_collaboration_boost(self, inverted_results, coauthor_graph, boost):
+        """Adds to the score of each author a damped share of the scores of its strong collaborators
+
+        The share is the mean of the scores of its co-authors among the results, weighted by their joint
+        publications, times boost. The score before the boost is kept as 'own_score'. Without co-authorship graph,
+        the results are returned unchanged.
+        """
+        boost = min(self.MAX_COLLABORATION_BOOST, max(0.0, float(boost)))
+        identifiers = list(inverted_results.keys())
+        if coauthor_graph is None or boost == 0 or len(identifiers) == 0:
+            return inverted_results
+        scores = np.array([inverted_results[identifier]['score'] for identifier in identifiers], dtype=np.float64)
+        propagated = coauthor_graph.propagate(identifiers, scores, self.MIN_COLLABORATION_WEIGHT)
+        for identifier, score, collaboration_score in zip(identifiers, scores, propagated):
+            inverted_results[identifier]['own_score'] = float(score)
+            inverted_results[identifier]['collaboration_score'] = float(boost * collaboration_score)
+            inverted_results[identifier]['score'] = float(score + boost * collaboration_score)
+        return inverted_results
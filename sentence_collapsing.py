@@ -0,0 +1,45 @@
+import numpy as np
+
+DEFAULT_COLLAPSE_THRESHOLD = 0.9
+
+
+def collapse_translations(langs: list, vectors: list, threshold: float = DEFAULT_COLLAPSE_THRESHOLD) -> list:
+    """Groups the sentences of a document with their translation
+
+    The multilingual model maps a sentence and its translation to nearly the same vector. Sentences of different
+    languages whose cosine similarity reaches the threshold are paired, most similar pairs first, each sentence
+    joining at most one pair.
+
+    Parameters
+    ----------
+    langs : list, required
+            language of each sentence
+    vectors : list, required
+            vector of each sentence
+    threshold : float, optional
+            minimal cosine similarity of a sentence and its translation
+
+    Returns
+    -------
+    groups: list of lists of sentence indices, ordered by their first sentence
+    """
+    count = len(vectors)
+    if count < 2:
+        return [[index] for index in range(count)]
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    similarities = matrix @ matrix.T
+    langs = np.asarray(langs)
+    candidates = np.triu((similarities >= threshold) & (langs[:, None] != langs[None, :]), k=1)
+    partner = {}
+    for first, second in sorted(zip(*np.nonzero(candidates)), key=lambda pair: -similarities[pair]):
+        if first not in partner and second not in partner:
+            partner[int(first)] = int(second)
+            partner[int(second)] = int(first)
+    return [[index, partner[index]] if index in partner else [index] for index in range(count)
+            if partner.get(index, count) > index]
+
+
+def merged_vector(vectors: list) -> np.ndarray:
+    """Single vector indexed for a group of sentences : the mean of their vectors"""
+    return np.mean(np.asarray(vectors, dtype=np.float32), axis=0)
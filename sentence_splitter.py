@@ -0,0 +1,94 @@
+import multiprocessing
+from typing import Iterable
+
+import nltk
+
+FRENCH = 'french'
+ENGLISH = 'english'
+
+
+def load_tokenizer(language: str):
+    """Loads an installed punkt model, without any network access
+
+    Parameters
+    ----------
+    language : str, required
+            punkt model name, 'french' or 'english'
+
+    Returns
+    -------
+    tokenizer: nltk PunktSentenceTokenizer
+    """
+    try:
+        return nltk.data.load(f"tokenizers/punkt/{language}.pickle")
+    except LookupError as e:
+        raise LookupError(f"Punkt model for {language} is not installed, "
+                          f"install it with : python -m nltk.downloader punkt") from e
+
+
+tokenizers = {}
+
+
+def _init_worker(languages):
+    for language in languages:
+        tokenizers[language] = load_tokenizer(language)
+
+
+def _split(item):
+    language, text = item
+    return tokenizers[language].tokenize(text)
+
+
+class SentenceSplitter:
+    """Splits abstracts into sentences with the punkt model of their language
+
+    Punkt models are loaded once per process. Segmentations are stored in the embedding cache by
+    SHA256 of the text, so that unchanged abstracts are never segmented twice, and large runs are
+    spread over a pool of processes.
+    """
+    MODEL_PREFIX = 'punkt'
+    DEFAULT_POOL_THRESHOLD = 5000
+    POOL_CHUNK_SIZE = 200
+
+    def __init__(self, languages: Iterable[str] = (FRENCH, ENGLISH), cache=None, workers: int = 1,
+                 pool_threshold: int = DEFAULT_POOL_THRESHOLD) -> None:
+        self.languages = list(languages)
+        self.cache = cache
+        self.workers = workers
+        self.pool_threshold = pool_threshold
+        _init_worker([language for language in self.languages if language not in tokenizers])
+        self.segmented = 0
+
+    def split_many(self, language: str, texts: Iterable) -> list:
+        """Splits texts into sentences
+
+        Parameters
+        ----------
+        language : str, required
+                language of the texts
+        texts : Iterable, required
+                texts to split, values that are not strings give no sentence
+
+        Returns
+        -------
+        sentences: list of lists of sentences in the order of the texts
+        """
+        texts = list(texts)
+        distinct = list(dict.fromkeys(text for text in texts if type(text) == str))
+        model_name = f"{self.MODEL_PREFIX}-{language}"
+        segments = self.cache.get_segments_many(model_name, distinct) if self.cache is not None else {}
+        missing = [text for text in distinct if text not in segments]
+        if len(missing) > 0:
+            computed = dict(zip(missing, self._split(language, missing)))
+            if self.cache is not None:
+                self.cache.put_segments_many(model_name, computed)
+            segments |= computed
+            self.segmented += len(missing)
+        return [list(segments[text]) if type(text) == str else [] for text in texts]
+
+    def _split(self, language: str, texts: list) -> list:
+        if self.workers <= 1 or len(texts) < self.pool_threshold:
+            return [tokenizers[language].tokenize(text) for text in texts]
+        with multiprocessing.get_context('spawn').Pool(self.workers, initializer=_init_worker,
+                                                       initargs=([language],)) as pool:
+            return pool.map(_split, [(language, text) for text in texts], chunksize=self.POOL_CHUNK_SIZE)
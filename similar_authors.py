@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 1024
+DEFAULT_NEIGHBOURS = 20
+
+
+def similar_authors_file(model: str) -> str:
+    return f"{os.path.expanduser('~')}/hal_cache/similar_authors_{model}.npz"
+
+
+def top_k_neighbours(vectors: np.ndarray, k: int = DEFAULT_NEIGHBOURS, block_size: int = DEFAULT_BLOCK_SIZE) -> tuple:
+    """Exact k nearest neighbours of each row among the other rows, by cosine similarity
+
+    Similarities are computed by blocks of rows against the whole matrix, so that memory stays bounded by
+    block_size times the number of rows.
+
+    Parameters
+    ----------
+    vectors : np.ndarray, required
+            one normalized vector per row
+    k : int, optional
+            number of neighbours
+    block_size : int, optional
+            number of rows per matrix product
+
+    Returns
+    -------
+    neighbours, scores: int32 array of neighbour rows, float32 array of similarities, best first, one row each
+    """
+    count = len(vectors)
+    k = min(k, count - 1)
+    neighbours = np.empty((count, max(k, 0)), dtype=np.int32)
+    scores = np.empty((count, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return neighbours, scores
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        similarities = vectors[start:stop] @ vectors.T
+        similarities[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        neighbours[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbours, scores
+
+
+class SimilarAuthors:
+    """Nearest authors of each author, as computed by author_profiles.py
+
+    The neighbour lists are held in arrays (row indices and similarities) loaded once; the file is reloaded
+    when it has been rewritten since.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.loaded_mtime = None
+        self.rows = {}
+
+    @staticmethod
+    def save(file_path: str, identifiers: list, names: list, neighbours: np.ndarray, scores: np.ndarray) -> None:
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = f"{file_path}.tmp"
+        with open(temporary_path, 'wb') as outfile:
+            np.savez(outfile, identifiers=np.array(identifiers, dtype=str), names=np.array(names, dtype=str),
+                     neighbours=neighbours, scores=scores.astype(np.float16))
+        # readers never see a partially written file
+        os.replace(temporary_path, file_path)
+
+    def load(self) -> None:
+        mtime = os.stat(self.file_path).st_mtime
+        if mtime == self.loaded_mtime:
+            return
+        with np.load(self.file_path) as data:
+            self.identifiers = data['identifiers']
+            self.names = data['names']
+            self.neighbours = data['neighbours']
+            self.scores = data['scores']
+        self.rows = {str(identifier): row for row, identifier in enumerate(self.identifiers)}
+        self.loaded_mtime = mtime
+
+    def similar(self, identifier: str, limit: int = DEFAULT_NEIGHBOURS) -> list:
+        """Nearest authors of an author
+
+        Returns
+        -------
+        authors: list of dicts with identifier, name and score, nearest first, empty for an unknown author
+        """
+        self.load()
+        row = self.rows.get(identifier, None)
+        if row is None:
+            return []
+        return [{'identifier': str(self.identifiers[neighbour]), 'name': str(self.names[neighbour]),
+                 'score': float(score)}
+                for neighbour, score in zip(self.neighbours[row][:limit], self.scores[row][:limit])]
@@ -0,0 +1,21 @@
+from hal_utils import normalize_date
+
+
+def test_normalize_partial_dates():
+    assert normalize_date("1999") == "1999-01-01T00:00:00Z"
+    assert normalize_date("1999-07") == "1999-07-01T00:00:00Z"
+
+
+def test_normalize_full_dates():
+    assert normalize_date("1999-07-14") == "1999-07-14T00:00:00Z"
+    assert normalize_date(" 2020-02-29T10:00:00Z ") == "2020-02-29T00:00:00Z"
+
+
+def test_normalize_invalid_dates():
+    assert normalize_date("1999-13") is None
+    assert normalize_date("1999-01-32") is None
+    assert normalize_date("2019-02-29") is None
+    assert normalize_date("0000") is None
+    assert normalize_date("not a date") is None
+    assert normalize_date(None) is None
+    assert normalize_date(float('nan')) is None
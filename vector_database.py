@@ -1,25 +1,23 @@
+import json
+
 import weaviate
 from dotenv import dotenv_values
 
+from hal_utils import normalize_date
+
 
 class VectorDatabase:
+    SENTENCE_MODE = 'sentences'
+    AUTHOR_MODE = 'authors'
+    LAB_MODE = 'labs'
+    DEFAULT_LIMIT = 100
+    DEFAULT_AUTHORS_LIMIT = 20
+    DEFAULT_SHORTLIST_SIZE = 300
+    # sentences requested from the restricted search, and kept at most per shortlisted publication
+    RERANK_LIMIT = 2000
+    MAX_SENTENCES_PER_PUBLICATION = 20
 
-    @staticmethod
-    def build_query(embedding, sentence_class):
-        return f"""
-        {{
-            Get {{
-            {sentence_class} (
-              limit: 100
-              nearVector: {{
-                vector: {str(embedding)}
-              }}
-            ) {{
-              docid
-              text 
-              sentid
-              hasPublication {{ 
-                ...on Publication {{
+    PUBLICATION_FIELDS = """
                   doc_type
                   docid
                   fr_title
@@ -30,15 +28,151 @@ class VectorDatabase:
                   en_keyword
                   citation_ref
                   citation_full
-                  hasAuthors {{
-                    ...on Author {{
+                  hasAuthors {
+                    ...on Author {
                       identifier
                       name
                       own_inst
-                    }}
-                  }}
+                    }
+                  }"""
+
+    @staticmethod
+    def build_where(filters, date_property='publication_date'):
+        """Builds the GraphQL where argument restricting the vector search to the matching sentences
+
+        Filters rely on the publication properties denormalized onto the sentences, so that they are applied
+        by Weaviate during the search rather than on the returned results.
+
+        Parameters
+        ----------
+        filters : dict, optional
+                own_inst_only (bool), doc_types (list of Hal document type codes),
+                date_from and date_to (ISO dates, inclusive, a partial date standing for its first day),
+                docids (list of publication docids), identifiers (list of author identifiers)
+        date_property : str, optional
+                date property of the searched class
+
+        Returns
+        -------
+        where: str GraphQL where argument, empty string without filters
+        """
+        filters = filters or {}
+        operands = []
+        if filters.get('own_inst_only', False):
+            operands.append('{ path: ["own_inst"], operator: Equal, valueBoolean: true }')
+        doc_types = filters.get('doc_types', None) or []
+        if len(doc_types) > 0:
+            operands.append('{ operator: Or, operands: [' + ', '.join(
+                f'{{ path: ["doc_type"], operator: Equal, valueString: {json.dumps(doc_type)} }}'
+                for doc_type in doc_types) + '] }')
+        for key, operator in [('date_from', 'GreaterThanEqual'), ('date_to', 'LessThanEqual')]:
+            date = normalize_date(filters.get(key, None))
+            if date is not None:
+                operands.append(
+                    f'{{ path: [{json.dumps(date_property)}], operator: {operator}, valueDate: {json.dumps(date)} }}')
+        docids = filters.get('docids', None) or []
+        if len(docids) > 0:
+            operands.append('{ operator: Or, operands: [' + ', '.join(
+                f'{{ path: ["docid"], operator: Equal, valueString: {json.dumps(str(docid))} }}'
+                for docid in docids) + '] }')
+        identifiers = filters.get('identifiers', None) or []
+        if len(identifiers) > 0:
+            operands.append('{ operator: Or, operands: [' + ', '.join(
+                f'{{ path: ["hasPublication", "Publication", "hasAuthors", "Author", "identifier"], '
+                f'operator: Equal, valueString: {json.dumps(identifier)} }}' for identifier in identifiers) + '] }')
+        if len(operands) == 0:
+            return ""
+        return f"where: {{ operator: And, operands: [{', '.join(operands)}] }}"
+
+    @staticmethod
+    def build_publication_query(embedding, limit, filters=None):
+        # own_inst and the normalized date are denormalized onto the publications by weaviate_import.py --denormalize
+        publication_filters = {key: value for key, value in (filters or {}).items()
+                               if key in ['own_inst_only', 'doc_types', 'date_from', 'date_to']}
+        return f"""
+        {{
+            Get {{
+            Publication (
+              limit: {limit}
+              nearVector: {{
+                vector: {str(embedding)}
+              }}
+              {VectorDatabase.build_where(publication_filters, 'normalized_publication_date')}
+            ) {{
+              docid
+              _additional {{
+                distance
+              }}
+            }}
+          }}
+        }}
+        """
+
+    @staticmethod
+    def build_publications_query(docids):
+        docid_operands = ', '.join(f'{{ path: ["docid"], operator: Equal, valueInt: {int(docid)} }}'
+                                   for docid in docids)
+        return f"""
+        {{
+            Get {{
+            Publication (
+              limit: {len(docids)}
+              where: {{ operator: Or, operands: [{docid_operands}] }}
+            ) {{
+              {VectorDatabase.PUBLICATION_FIELDS}
+            }}
+          }}
+        }}
+        """
+
+    @staticmethod
+    def build_profile_query(embedding, profile_class, limit, filters=None):
+        # profiles carry own_inst, the other filters only restrict the sentences given as evidence
+        profile_filters = {'own_inst_only': (filters or {}).get('own_inst_only', False)}
+        return f"""
+        {{
+            Get {{
+            {profile_class} (
+              limit: {limit}
+              nearVector: {{
+                vector: {str(embedding)}
+              }}
+              {VectorDatabase.build_where(profile_filters)}
+            ) {{
+              identifier
+              name
+              own_inst
+              sentence_count
+              _additional {{
+                distance
+              }}
+            }}
+          }}
+        }}
+        """
+
+    @staticmethod
+    def build_query(embedding, sentence_class, filters=None, limit=DEFAULT_LIMIT, with_publication=True):
+        publication_field = f"""hasPublication {{ 
+                ...on Publication {{
+                  {VectorDatabase.PUBLICATION_FIELDS}
                 }}
+              }}""" if with_publication else ""
+        return f"""
+        {{
+            Get {{
+            {sentence_class} (
+              limit: {limit}
+              nearVector: {{
+                vector: {str(embedding)}
               }}
+              {VectorDatabase.build_where(filters)}
+            ) {{
+              docid
+              text 
+              alt_texts
+              sentid
+              {publication_field}
               _additional {{
                 distance
                 certainty
@@ -52,5 +186,99 @@ class VectorDatabase:
         weaviate_params = dict(dotenv_values(".env.weaviate"))
         self.client = weaviate.Client(weaviate_params['host'])
 
-    def results(self, embedding, sentence_class):
-        return self.client.query.raw(self.build_query(embedding, sentence_class))
+    def results(self, embedding, sentence_class, filters=None):
+        return self.client.query.raw(self.build_query(embedding, sentence_class, filters))
+
+    def shortlist(self, embedding, size=DEFAULT_SHORTLIST_SIZE, filters=None):
+        """Nearest publications to the query, searched on the vectors of the Publication class
+
+        Returns
+        -------
+        docids: list of docids of the nearest publications, nearest first
+        """
+        response = self.client.query.raw(self.build_publication_query(embedding, size, filters))
+        if response.get('errors', None):
+            raise RuntimeError(f"Publication shortlist failure : {response['errors']}")
+        return [pub['docid'] for pub in response['data']['Get']['Publication'] or []]
+
+    def two_stage_results(self, publication_embedding, embedding, sentence_class, filters=None,
+                          shortlist_size=DEFAULT_SHORTLIST_SIZE):
+        """Sentence search restricted to a shortlist of publications
+
+        The publications matching the filters are first shortlisted by their own vector, then only their sentences
+        are searched and ranked, at most MAX_SENTENCES_PER_PUBLICATION each, so that recall is bounded per
+        publication rather than by the global limit of the plain sentence search. The publication details are
+        fetched afterwards, once per publication of the kept sentences.
+
+        Parameters
+        ----------
+        publication_embedding : list, required
+                query vector in the vector space of the Publication class
+        embedding : list, required
+                query vector in the vector space of the sentence class
+        sentence_class : str, required
+                sentence class to search
+        filters : dict, optional
+                search filters, as for build_where
+        shortlist_size : int, optional
+                number of shortlisted publications
+
+        Returns
+        -------
+        results: GraphQL response shaped as the one of the plain sentence search
+        """
+        docids = self.shortlist(publication_embedding, shortlist_size, filters)
+        if len(docids) == 0:
+            return {'data': {'Get': {sentence_class: []}}}
+        # the publications are resolved once each, for the kept sentences only
+        response = self.client.query.raw(self.build_query(embedding, sentence_class,
+                                                          (filters or {}) | {'docids': docids}, self.RERANK_LIMIT,
+                                                          with_publication=False))
+        if response.get('errors', None):
+            raise RuntimeError(f"Restricted sentence search failure : {response['errors']}")
+        sentences = []
+        counts = {}
+        for sentence in response['data']['Get'][sentence_class] or []:
+            counts[sentence['docid']] = counts.get(sentence['docid'], 0) + 1
+            if counts[sentence['docid']] <= self.MAX_SENTENCES_PER_PUBLICATION:
+                sentences.append(sentence)
+        if len(sentences) > 0:
+            publications = self.client.query.raw(self.build_publications_query(list(counts)))
+            if publications.get('errors', None):
+                raise RuntimeError(f"Publication resolution failure : {publications['errors']}")
+            publications = {str(pub['docid']): pub for pub in publications['data']['Get']['Publication'] or []}
+            for sentence in sentences:
+                sentence['hasPublication'] = [publications[sentence['docid']]] \
+                    if sentence['docid'] in publications else []
+        response['data']['Get'][sentence_class] = sentences
+        return response
+
+    def author_results(self, embedding, profile_class, sentence_class, filters=None, limit=DEFAULT_AUTHORS_LIMIT):
+        """Author search on the precomputed expertise profiles, with sentence evidence for the top authors only
+
+        Parameters
+        ----------
+        embedding : list, required
+                query vector, in the vector space of both classes
+        profile_class : str, required
+                author profile class to search, as computed by author_profiles.py
+        sentence_class : str, required
+                sentence class the evidence is searched in
+        filters : dict, optional
+                search filters, as for build_where
+        limit : int, optional
+                number of authors
+
+        Returns
+        -------
+        profiles, results: nearest profiles, nearest first, and GraphQL response of the sentence search
+        restricted to the publications of their authors
+        """
+        response = self.client.query.raw(self.build_profile_query(embedding, profile_class, limit, filters))
+        if response.get('errors', None):
+            raise RuntimeError(f"Author profile search failure : {response['errors']}")
+        profiles = response['data']['Get'][profile_class] or []
+        if len(profiles) == 0:
+            return profiles, {'data': {'Get': {sentence_class: []}}}
+        identifiers = [profile['identifier'] for profile in profiles]
+        return profiles, self.results(embedding, sentence_class, (filters or {}) | {'identifiers': identifiers})
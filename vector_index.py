@@ -0,0 +1,67 @@
+import json
+
+HNSW = 'hnsw'
+FLAT = 'flat'
+SKIP = 'skip'
+
+# Weaviate defaults for the classes that hold vectors, no vector index for the others.
+# Product quantization requires Weaviate 1.18 or later, the flat index Weaviate 1.23 or later.
+DEFAULT_VECTOR_INDEX_CONFIG = {
+    "AdaSentence": {"type": HNSW, "distance": "cosine", "ef": -1, "efConstruction": 128, "maxConnections": 64},
+    "SbertSentence": {"type": HNSW, "distance": "cosine", "ef": -1, "efConstruction": 128, "maxConnections": 64},
+    "Publication": {"type": HNSW, "distance": "cosine", "ef": -1, "efConstruction": 128, "maxConnections": 64},
+    "SbertAuthorProfile": {"type": HNSW, "distance": "cosine", "ef": -1, "efConstruction": 128, "maxConnections": 64},
+    "AdaAuthorProfile": {"type": HNSW, "distance": "cosine", "ef": -1, "efConstruction": 128, "maxConnections": 64},
+    "Author": {"type": SKIP},
+    "Organisation": {"type": SKIP},
+}
+
+PQ_DEFAULTS = {"enabled": True, "segments": 0, "centroids": 256, "trainingLimit": 100000}
+
+# parameters that can be changed on an existing class
+MUTABLE_PARAMETERS = ["ef", "pq"]
+
+
+def load_index_config(file_path: str = None) -> dict:
+    """Loads the vector index configuration, per class overrides read from a JSON file
+
+    Parameters
+    ----------
+    file_path : str, optional
+            JSON file of parameters by class name, e.g.
+            {"AdaSentence": {"ef": 256, "pq": {"segments": 192}}, "Publication": {"type": "flat"}}
+
+    Returns
+    -------
+    config: dict of vector index parameters by class name
+    """
+    config = {class_name: dict(params) for class_name, params in DEFAULT_VECTOR_INDEX_CONFIG.items()}
+    if file_path is not None:
+        with open(file_path) as infile:
+            for class_name, params in json.load(infile).items():
+                config[class_name] = config.get(class_name, {"type": HNSW}) | params
+    return config
+
+
+def class_index_settings(params: dict) -> dict:
+    """Translates the parameters of a class into Weaviate class settings
+
+    Returns
+    -------
+    settings: dict of vectorIndexType and vectorIndexConfig to merge into a class definition
+    """
+    index_type = params.get("type", HNSW)
+    if index_type == SKIP:
+        return {"vectorIndexConfig": {"skip": True}}
+    index_config = {"distance": params.get("distance", "cosine")}
+    if index_type == HNSW:
+        index_config |= {key: params[key] for key in ["ef", "efConstruction", "maxConnections"] if key in params}
+        if params.get("pq", None):
+            index_config["pq"] = PQ_DEFAULTS | params["pq"]
+    return {"vectorIndexType": index_type, "vectorIndexConfig": index_config}
+
+
+def mutable_index_settings(params: dict) -> dict:
+    """Selects the parameters of a class that can be applied without recreating it"""
+    index_config = class_index_settings(params).get("vectorIndexConfig", {})
+    return {key: index_config[key] for key in MUTABLE_PARAMETERS if key in index_config}
@@ -1,25 +1,33 @@
 import argparse
 import ast
-import json
+import collections
+import itertools
 import logging
+import multiprocessing
 import os
-import random
-import time
 import traceback
 from pathlib import Path
 
-import nltk
+import numpy as np
 import openai
 import pandas as pd
+import torch
 from dotenv import dotenv_values
 from sentence_transformers import SentenceTransformer
 
-from hal_utils import choose_author_identifier
+from batch_encoder import BatchEncoder
+from embedding_cache import EmbeddingCache
+from embedding_store import create_writer, SHARDS_FORMAT, JSON_FORMAT, MEMORY_FORMAT
+from hal_utils import choose_author_identifier, normalize_date
+from import_manifest import ImportManifest
 from log_handler import LogHandler
 from mail_sender import MailSender
+from openai_embedder import OpenAIEmbedder
+from progress_journal import ProgressJournal
+from sentence_collapsing import collapse_translations, merged_vector
+from sentence_splitter import SentenceSplitter, FRENCH, ENGLISH
 from uuid_provider import UUIDProvider
-
-MAX_OPENAI_API_ATTEMPTS = 30
+from weaviate_import import StreamingImporter, get_client
 
 PERSIST_RATE = 100
 
@@ -29,52 +37,38 @@ DEFAULT_OUTPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_embeddings"
 DEFAULT_INPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_dump"
 DEFAULT_INPUT_FILE_NAME = "dump.csv"
 
-EMBEDDING_MODEL = 'text-embedding-ada-002'
-EMBEDDING_CTX_LENGTH = 8191
-EMBEDDING_ENCODING = 'cl100k_base'
+SBERT_MODEL = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+EMBEDDING_MODEL = OpenAIEmbedder.EMBEDDING_MODEL
 
 NUMBER_OF_DOCUMENTS_ALERT_LEVEL = 1000
 NUMBER_OF_SENTENCES_ALERT_LEVEL = 70
 
 MIN_SENTENCE_LENGTH = 20
 
-sbert_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_BATCH_DOCS = 500
+DEFAULT_QUEUE_SIZE = 4
 
-nltk.download('punkt')
+METADATA_ONLY = 'metadata_only'
+VECTORIZED = 'vectorized'
+EMPTY = 'empty'
 
 
-def sent_json_object(row, pub_uuid, sentid, text, vector, model_name):
+def sent_json_object(row, pub_uuid, sentid, text, vector, model_name, alt_texts=()):
     docid = str(row["docid"])
-    return {
+    # translations collapsed into the sentence, absent otherwise so that the content hashes are unchanged
+    return ({'alt_texts': list(alt_texts)} if len(alt_texts) > 0 else {}) | {
         'pub_uuid': pub_uuid,
         'docid': docid,
         'sentid': sentid,
         'text': text,
         'uuid': str(UUIDProvider(f"hal-sent-{docid}-{sentid}").value()),
         'model': model_name,
-        'vector': list(map(str, list(vector)))}
-
-
-def split_into_sentences(text):
-    if type(text) == str:
-        return nltk.sent_tokenize(text)
-    return []
-
-
-def get_openai_embedding(text_or_tokens, model=EMBEDDING_MODEL, attempt=0):
-    if attempt > MAX_OPENAI_API_ATTEMPTS:
-        logger.error(f"Max number of failures reached, abort")
-        exit()
-    try:
-        embedding = openai.Embedding.create(input=text_or_tokens, model=model)["data"][0]["embedding"]
-        return embedding
-    except openai.OpenAIError as e:
-        randomness_collision_avoidance = random.randint(0, 1000) / 1000.0
-        delay_secs = random.randint(2, 8)
-        sleep_dur = delay_secs + randomness_collision_avoidance
-        logger.error(f"Error during OpenAI API call : {str(e)}, Retrying in {round(sleep_dur, 2)} seconds.")
-        time.sleep(sleep_dur)
-        return get_openai_embedding(text_or_tokens, model, attempt + 1)
+        # denormalized publication properties, for filtering during the vector search ; own_inst depends on the
+        # flags of the authors and is set by weaviate_import.py
+        'doc_type': row['doc_type'],
+        'publication_date': normalize_date(row['publication_date']),
+        'vector': np.asarray(vector, dtype=np.float32)}
 
 
 def parse_arguments():
@@ -91,13 +85,173 @@ def parse_arguments():
     parser.add_argument('--force', dest='force',
                         help='Force vectorization, overcome limit of number of documents', required=False,
                         default=False, type=bool)
-    return parser.parse_args()
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Number of sentences per SBERT encoding batch', required=False,
+                        default=DEFAULT_BATCH_SIZE, type=int)
+    parser.add_argument('--batch_docs', dest='batch_docs',
+                        help='Number of documents whose sentences are gathered before encoding', required=False,
+                        default=DEFAULT_BATCH_DOCS, type=int)
+    parser.add_argument('--openai_concurrency', dest='openai_concurrency',
+                        help='Number of concurrent requests to the OpenAI API', required=False,
+                        default=OpenAIEmbedder.DEFAULT_CONCURRENCY, type=int)
+    parser.add_argument('--openai_tpm', dest='openai_tpm',
+                        help='Maximal number of tokens per minute sent to the OpenAI API', required=False,
+                        default=OpenAIEmbedder.DEFAULT_TOKENS_PER_MINUTE, type=int)
+    parser.add_argument('--openai_rpm', dest='openai_rpm',
+                        help='Maximal number of requests per minute sent to the OpenAI API', required=False,
+                        default=OpenAIEmbedder.DEFAULT_REQUESTS_PER_MINUTE, type=int)
+    parser.add_argument('--openai_long_inputs', dest='openai_long_inputs',
+                        help='Handling of inputs exceeding the model context : chunk (average of chunks) or truncate',
+                        required=False, default=OpenAIEmbedder.CHUNK,
+                        choices=[OpenAIEmbedder.CHUNK, OpenAIEmbedder.TRUNCATE])
+    parser.add_argument('--output_format', dest='output_format',
+                        help='Output format : shards (JSONL metadata and float32 .npy vectors) '
+                             'or json (one file per object)',
+                        required=False, default=SHARDS_FORMAT, choices=[SHARDS_FORMAT, JSON_FORMAT])
+    parser.add_argument('--workers', dest='workers',
+                        help='Number of vectorization processes, documents are sharded by docid', required=False,
+                        default=1, type=int)
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Import the vectorized documents into Weaviate as they are produced, without files')
+    parser.add_argument('--queue_size', dest='queue_size',
+                        help='Maximal number of vectorized batches waiting for their import into Weaviate',
+                        required=False, default=DEFAULT_QUEUE_SIZE, type=int)
+    parser.add_argument('--manifest_file', dest='manifest_file',
+                        help='Manifest of the content hashes of the objects imported by the pipeline', required=False,
+                        default=ImportManifest.DEFAULT_MANIFEST_FILE)
+    parser.add_argument('--no_manifest', action='store_true',
+                        help='In pipeline mode, send all the objects, whether they changed or not')
+    parser.add_argument('--journal_file', dest='journal_file',
+                        help='Progress journal file, defaults to the CSV file path followed by .journal',
+                        required=False, default=None)
+    parser.add_argument('--collapse_threshold', dest='collapse_threshold',
+                        help='Merge the sentences of a document with their translation when the cosine similarity '
+                             'of their SBERT vectors reaches this threshold (e.g. 0.9), disabled by default',
+                        required=False, default=None, type=float)
+    parser.add_argument('--cache_file', dest='cache_file',
+                        help='Embedding cache file', required=False, default=EmbeddingCache.DEFAULT_CACHE_FILE)
+    parser.add_argument('--no_cache', action='store_true', help='Disable the embedding cache')
+    parser.add_argument('--cache_gc', action='store_true',
+                        help='Remove the cached embeddings of sentences no longer present in the CSV file and exit')
+    args = parser.parse_args()
+    if min(args.openai_tpm, args.openai_rpm) < max(1, args.workers):
+        parser.error("--openai_tpm and --openai_rpm are shared between the worker processes and must be at least "
+                     "--workers")
+    return args
 
 
-def enable_openai():
+def enable_openai(args):
     openai_params = dict(dotenv_values(".env.openai"))
     openai.organization = openai_params['organization']
     openai.api_key = openai_params['api_key']
+    # the rate limits are shared between the worker processes
+    workers = max(1, args.workers)
+    return OpenAIEmbedder(logger, concurrency=args.openai_concurrency,
+                          tokens_per_minute=max(1, args.openai_tpm // workers),
+                          requests_per_minute=max(1, args.openai_rpm // workers), long_inputs=args.openai_long_inputs,
+                          api_base=openai_params.get('api_base', None))
+
+
+class VectorizationWorker:
+    """Vectorizes batches of documents and exports them, with its own model instance, cache connection
+    and OpenAI client, so that it can run in a dedicated process"""
+
+    def __init__(self, args) -> None:
+        self.force = args.force
+        self.collapse_threshold = args.collapse_threshold
+        self.writer = create_writer(MEMORY_FORMAT if args.pipeline else args.output_format, args.output_dir)
+        self.cache = None if args.no_cache else EmbeddingCache(args.cache_file)
+        self.embedder = enable_openai(args) if args.openai else None
+        self.encoder = BatchEncoder(SentenceTransformer(SBERT_MODEL), batch_size=args.batch_size, cache=self.cache,
+                                    model_name=SBERT_MODEL)
+
+    def stats(self):
+        return {
+            'cache_hits': self.cache.hits if self.cache is not None else 0,
+            'cache_misses': self.cache.misses if self.cache is not None else 0,
+            'openai_requests': self.embedder.requests if self.embedder is not None else 0,
+            'openai_tokens': self.embedder.tokens if self.embedder is not None else 0,
+        }
+
+    def process(self, rows):
+        """Vectorizes and exports a batch of documents
+
+        Parameters
+        ----------
+        rows : pd.DataFrame, required
+                rows of the publications table, with the texts split into sentences
+
+        Returns
+        -------
+        result: dict with the (docid, status, number of sentences) of each document, in the order of the rows,
+                and the cache and OpenAI statistics of the batch
+        """
+        stats_before = self.stats()
+        documents = []
+        for index, row in rows.iterrows():
+            document = build_document(row)
+            num_sents = len(document['texts'])
+            if num_sents > NUMBER_OF_SENTENCES_ALERT_LEVEL and not self.force:
+                raise RuntimeError(
+                    f"abnormal number of sentences : {num_sents} for docid {row['docid']}, stopping the vectorisation, check and launch manually")
+            documents.append(document)
+        sbert_embeddings = self.encoder.encode(itertools.chain.from_iterable(
+            document['texts'] + document['titles'] for document in documents if not document['metadata_only']))
+        logger.info(f"{len(sbert_embeddings)} distinct sentences vectorized with SBERT "
+                    f"({self.encoder.last_batches} encoding batches)")
+        ada_embeddings = None
+        if self.embedder is not None:
+            ada_embeddings = cached_openai_embeddings(itertools.chain.from_iterable(
+                document['texts'] + document['concats'] for document in documents), self.embedder, self.cache)
+        statuses = []
+        sentences_counter = 0
+        collapsed_counter = 0
+        for document in documents:
+            docid = document['docid']
+            if document['metadata_only']:
+                # vectorized texts are unchanged : only metadata and relations are exported
+                write_metadata(document, self.writer)
+                statuses.append((docid, METADATA_ONLY, 0))
+                continue
+            texts = document['texts']
+            if len(texts) == 0:
+                statuses.append((docid, EMPTY, 0))
+                continue
+            vectorize_document(document, sbert_embeddings, ada_embeddings, self.collapse_threshold)
+            sentences_counter += len(texts)
+            collapsed_counter += len(texts) - document['pub']['sentence_count']
+            logger.debug(f"Word count : {sum([len(i.split(' ')) for i in texts])}")
+            self.writer.write('sent', document['sentences'], suffix='model')
+            write_metadata(document, self.writer)
+            statuses.append((docid, VECTORIZED, len(texts)))
+        output = self.writer.flush()
+        stats_after = self.stats()
+        return {'docs': statuses, 'output': output, 'sentences': sentences_counter,
+                'collapsed_sentences': collapsed_counter} | {key: stats_after[key] - stats_before[key] for key in
+                                                             stats_after}
+
+
+def init_worker(args, num_threads):
+    global logger, worker
+    logger = LogHandler("vectorize_sentences", 'log', 'vectorize_sentences.log',
+                        logging.INFO).create_rotating_log()
+    torch.set_num_threads(num_threads)
+    worker = VectorizationWorker(args)
+
+
+def process_in_worker(rows):
+    return worker.process(rows)
+
+
+def bounded_imap(pool, function, items, max_in_flight):
+    """Ordered imap that submits no more than max_in_flight items ahead of the consumer"""
+    in_flight = collections.deque()
+    for item in items:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().get()
+        in_flight.append(pool.apply_async(function, (item,)))
+    while in_flight:
+        yield in_flight.popleft().get()
 
 
 def main(args):
@@ -105,19 +259,32 @@ def main(args):
     logger = LogHandler("vectorize_sentences", 'log', 'vectorize_sentences.log',
                         logging.INFO).create_rotating_log()
     force = args.force
-    openai = args.openai
-    if openai:
-        enable_openai()
-    logger.info("OpenAI embdeddings " + ("enabled" if openai else "disabled"))
+    use_openai = args.openai
+    logger.info("OpenAI embdeddings " + ("enabled" if use_openai else "disabled"))
     directory = args.csv_dir
     file = args.csv_file
     file_path = f"{directory}/{file}"
     csv = pd.read_csv(file_path)
     copy = csv.copy()
     logger.info(f"Total number of documents : {len(csv)}")
+    cache = None if args.no_cache else EmbeddingCache(args.cache_file)
+    splitter = SentenceSplitter(cache=cache, workers=args.workers)
+    if args.cache_gc:
+        collect_cache_garbage(cache, splitter, csv)
+        return
     copy = copy.query('updated!=0 | created!=0')
+    if 'text_updated' not in copy.columns:
+        copy.loc[:, 'text_updated'] = True
+    journal = ProgressJournal(args.journal_file or f"{file_path}.journal", sync_rate=PERSIST_RATE)
+    already_done = pd.Series([journal.is_done(docid, row_hash) for docid, row_hash in zip(copy['docid'], copy['hash'])],
+                             index=copy.index, dtype=bool)
+    if already_done.any():
+        logger.info(f"Skipping {already_done.sum()} documents already vectorized according to the journal")
+        copy = copy[~already_done]
     num_docs = len(copy)
     logger.info(f"Number of documents to process : {num_docs}")
+    logger.info(f"Number of documents with unchanged texts (metadata only) : "
+                f"{len(copy.query('created==0 & text_updated==0'))}")
     if num_docs > NUMBER_OF_DOCUMENTS_ALERT_LEVEL and not force:
         raise RuntimeError(
             f"abnormal number of documents : {num_docs}, stopping vectorization, check and launch manually")
@@ -125,142 +292,345 @@ def main(args):
         ['docid', 'fr_title', 'en_title', 'fr_subtitle', 'en_subtitle', 'fr_abstract', 'en_abstract',
          'fr_keyword',
          'en_keyword', 'authors', 'affiliations', 'doc_type', 'publication_date', 'citation_ref',
-         'citation_full']]
+         'citation_full', 'hash', 'created', 'text_updated']]
     output_dir = args.output_dir
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    metadata.loc[:, "texts_en"] = copy.loc[:, "en_title"].map(
+    metadata = prepare_texts(metadata, splitter).sort_values('docid')
+    logger.info(f"{splitter.segmented} abstracts segmented, the others were found in cache")
+    if cache is not None:
+        cache.close()
+    total = len(metadata)
+    batches = [metadata.iloc[batch_start:batch_start + args.batch_docs] for batch_start in
+               range(0, total, args.batch_docs)]
+    workers = max(1, min(args.workers, len(batches)))
+    logger.info(f"{len(batches)} batches of {args.batch_docs} documents, {workers} worker processes")
+    hashes = dict(zip(metadata['docid'], metadata['hash']))
+    docs_counter = 0
+    sent_counter = 0
+    metadata_only_counter = 0
+    stats = {}
+    pool = None
+    if workers > 1:
+        # each worker loads its own model and gets a share of the torch threads
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker,
+                                                         initargs=(args, num_threads))
+        results = bounded_imap(pool, process_in_worker, batches, 2 * workers)
+    else:
+        worker = VectorizationWorker(args)
+        results = map(worker.process, batches)
+    importer = None
+    if args.pipeline:
+        # the importer logs to the same file as weaviate_import.py
+        LogHandler("weaviate_import", 'log', 'weaviate_import.log', logging.INFO).create_rotating_log()
+        # documents are journaled once persisted in Weaviate
+        importer = StreamingImporter(get_client(), args.queue_size,
+                                     lambda result: journal_batch(journal, result, hashes),
+                                     None if args.no_manifest else args.manifest_file)
+        importer.start()
+    try:
+        for result in results:
+            if importer is not None:
+                importer.submit(result)
+            else:
+                # the batch output is on disk when its result is received
+                journal_batch(journal, result, hashes)
+            for docid, status, num_sents in result['docs']:
+                docs_counter += 1
+                sent_counter += num_sents
+                if status == EMPTY:
+                    continue
+                if status == METADATA_ONLY:
+                    metadata_only_counter += 1
+                logger.info(f"Docid : {docid} Count : {docs_counter}/{total}"
+                            f"{' (metadata only)' if status == METADATA_ONLY else ''}")
+            stats = {key: stats.get(key, 0) + result[key] for key in result if key not in ('docs', 'output')}
+        if importer is not None:
+            importer.close()
+            logger.info(f"{importer.counter} objects handed to Weaviate : {importer.metrics.report()}")
+    finally:
+        if pool is not None:
+            pool.terminate()
+        # the importer thread appends to the journal
+        if importer is not None and importer.is_alive():
+            importer.stop()
+        journal.sync()
+    reconcile(csv, journal, file_path)
+    report = stats_report(stats, use_openai, args.no_cache)
+    logger.info(report)
+    MailSender().send_email(type=MailSender.INFO,
+                            text=f"Successful vectorization of {num_docs} documents ({sent_counter} sentences, "
+                                 f"{metadata_only_counter} documents with metadata only), CSV updated at {file_path}\n"
+                                 f"{report}")
+
+
+def stats_report(stats, use_openai, no_cache):
+    hits, misses = stats.get('cache_hits', 0), stats.get('cache_misses', 0)
+    report = "Embedding cache disabled" if no_cache else \
+        f"Embedding cache : {hits} hits, {misses} misses " \
+        f"(hit rate {round(100 * hits / (hits + misses), 1) if hits + misses > 0 else 0.0}%)"
+    sentences, collapsed = stats.get('sentences', 0), stats.get('collapsed_sentences', 0)
+    if collapsed > 0:
+        report += f"\nTranslations collapsed : {sentences - collapsed} sentences indexed instead of {sentences} " \
+                  f"({round(100 * collapsed / sentences, 1)}% smaller sentence index)"
+    if use_openai:
+        report += f"\nOpenAI embeddings : {stats.get('openai_requests', 0)} requests, " \
+                  f"{stats.get('openai_tokens', 0)} tokens"
+    return report
+
+
+def prepare_texts(metadata, splitter):
+    """Splits titles and abstracts into the texts to vectorize
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame, required
+            publications table
+    splitter : SentenceSplitter, required
+            sentence splitter
+
+    Returns
+    -------
+    metadata: pd.DataFrame with texts_fr, texts_en, texts, text_fr_concat and text_en_concat columns
+    """
+    metadata = metadata.copy()
+    metadata.loc[:, "texts_en"] = metadata.loc[:, "en_title"].map(
         lambda title: [title] if type(title) == str else []) + \
-                                  copy.loc[:, "en_abstract"].map(split_into_sentences)
-    metadata.loc[:, "texts_fr"] = copy.loc[:, "fr_title"].map(
+                                  pd.Series(splitter.split_many(ENGLISH, metadata.loc[:, "en_abstract"]),
+                                            index=metadata.index, dtype=object)
+    metadata.loc[:, "texts_fr"] = metadata.loc[:, "fr_title"].map(
         lambda title: [title] if type(title) == str else []) + \
-                                  copy.loc[:, "fr_abstract"].map(split_into_sentences)
+                                  pd.Series(splitter.split_many(FRENCH, metadata.loc[:, "fr_abstract"]),
+                                            index=metadata.index, dtype=object)
     metadata.loc[:, "texts"] = metadata.loc[:, "texts_fr"] + metadata.loc[:, "texts_en"]
 
     metadata.loc[:, "text_fr_concat"] = metadata.loc[:, "texts_fr"].map(lambda strs: ' '.join(strs))
     metadata.loc[:, "text_en_concat"] = metadata.loc[:, "texts_en"].map(lambda strs: ' '.join(strs))
-    total = len(metadata)
-    docs_counter = 0
-    sent_counter = 0
-    for index, row in metadata.iterrows():
-        docs_counter += 1
-        affiliations = ast.literal_eval(row['affiliations'])
-        lab_data_struct = {}
-        inst_data_struct = {}
-        pub_data_struct = {}
-        authors_data_struct = {auth['hal_id']: auth | {'has_lab': [], 'has_inst': [], 'own_inst': False} for
-                               auth in
-                               ast.literal_eval(row['authors'])}
-        for key in authors_data_struct:
-            identifier = choose_author_identifier(authors_data_struct[key])
-            authors_data_struct[key]['uuid'] = str(UUIDProvider(f"hal-auth-{identifier}").value())
-            authors_data_struct[key]['identifier'] = identifier
-        pub_uuid = str(UUIDProvider(f"hal-pub-{row['docid']}").value())
-        pub_data_struct[row['docid']] = {
-                                            'uuid': pub_uuid,
-                                            'docid': row['docid'],
-                                            'fr_title': row['fr_title'],
-                                            'en_title': row['en_title'],
-                                            'fr_subtitle': row['fr_subtitle'],
-                                            'en_subtitle': row['en_subtitle'],
-                                            'fr_abstract': row['fr_abstract'],
-                                            'en_abstract': row['en_abstract'],
-                                            'fr_keyword': row['fr_keyword'],
-                                            'en_keyword': row['en_keyword'],
-                                            'doc_type': row['doc_type'],
-                                            'publication_date': row['publication_date'],
-                                            'citation_ref': row['citation_ref'],
-                                            'citation_full': row['citation_full'],
-                                            'text_fr_concat': row['text_fr_concat'],
-                                            'text_en_concat': row['text_en_concat'],
-                                            'has_authors': list(
-                                                map(lambda auth: auth['uuid'], authors_data_struct.values()))
-                                        } | {'has_lab': [], 'has_inst': []}
-        buffer = {}
-        for affiliation in affiliations:
-            is_lab = int(affiliation['lab']) == 1
-            prop_name = 'has_lab' if is_lab else 'has_inst'
-            org_id = affiliation['org_id']
-            hal_id = affiliation['hal_id']
-            if hal_id not in buffer:
-                buffer[hal_id] = []
-            org_uuid = str(UUIDProvider(f"hal-org-{org_id}").value())
-            org = {'id': org_id, 'name': affiliation['org_name'], 'uuid': org_uuid,
-                   'lab': str(1 if is_lab else 0)}
-            if is_lab:
-                lab_data_struct[org_id] = org
-            else:
-                inst_data_struct[org_id] = org
-            if org_id in buffer[hal_id]:
-                continue
-            buffer[hal_id].append(org_id)
-            pub_data_struct[row['docid']][prop_name].append(org_uuid)
-            authors_data_struct[hal_id][prop_name].append(org_uuid)
-            authors_data_struct[hal_id]['own_inst'] |= (org_id == OWN_INST_ORG_ID)
-        texts = row["texts"]
-        text_fr_concat = row["text_fr_concat"].strip()
-        text_en_concat = row["text_en_concat"].strip()
-        texts = list(filter(lambda text: len(text) > MIN_SENTENCE_LENGTH, texts))
-        num_sents = len(texts)
-        if num_sents == 0:
+    return metadata
+
+
+def collect_cache_garbage(cache, splitter, csv):
+    if cache is None:
+        logger.info("Embedding cache disabled, nothing to collect")
+        return
+    metadata = prepare_texts(csv[['fr_title', 'en_title', 'fr_abstract', 'en_abstract']], splitter)
+    referenced_texts = itertools.chain(itertools.chain.from_iterable(metadata.loc[:, "texts"]),
+                                       metadata.loc[:, "fr_abstract"].dropna(),
+                                       metadata.loc[:, "en_abstract"].dropna(),
+                                       metadata.loc[:, "text_fr_concat"].map(str.strip),
+                                       metadata.loc[:, "text_en_concat"].map(str.strip))
+    size = cache.size()
+    removed = cache.collect_garbage(referenced_texts)
+    message = f"Embedding cache garbage collection : {removed} entries removed out of {size}"
+    logger.info(message)
+    MailSender().send_email(type=MailSender.INFO, text=message)
+
+
+def cached_openai_embeddings(texts, embedder, cache):
+    """Computes the ada embeddings of texts, using the embedding cache when enabled
+
+    Parameters
+    ----------
+    texts : Iterable[str], required
+            texts to vectorize
+    embedder : OpenAIEmbedder, required
+            OpenAI embedding client
+    cache : EmbeddingCache, optional
+            embedding cache
+
+    Returns
+    -------
+    embeddings: dict of vectors by text
+    """
+    texts = list(dict.fromkeys(texts))
+    vectors = cache.get_many(EMBEDDING_MODEL, texts) if cache is not None else {}
+    missing = [text for text in texts if text not in vectors]
+    if len(missing) > 0:
+        computed = dict(zip(missing, embedder.embed(missing)))
+        if cache is not None:
+            cache.put_many(EMBEDDING_MODEL, computed)
+        vectors |= computed
+    return vectors
+
+
+def document_texts(row):
+    """Selects the sentences of a row to vectorize
+
+    Returns
+    -------
+    texts, langs: list of sentences, list of their languages
+    """
+    langs = ['fr'] * len(row["texts_fr"]) + ['en'] * len(row["texts_en"])
+    selected = [(text, lang) for text, lang in zip(row["texts"], langs) if len(text) > MIN_SENTENCE_LENGTH]
+    return [text for text, _ in selected], [lang for _, lang in selected]
+
+
+def build_document(row):
+    """Builds the publication, authors and organisations structures of a row and selects the texts to vectorize
+
+    Parameters
+    ----------
+    row : pd.Series, required
+            row of the publications table, with the texts split into sentences
+
+    Returns
+    -------
+    document: dict with docid, data structures, texts and titles to vectorize
+    """
+    affiliations = ast.literal_eval(row['affiliations'])
+    lab_data_struct = {}
+    inst_data_struct = {}
+    authors_data_struct = {auth['hal_id']: auth | {'has_lab': [], 'has_inst': [], 'own_inst': False} for
+                           auth in
+                           ast.literal_eval(row['authors'])}
+    for key in authors_data_struct:
+        identifier = choose_author_identifier(authors_data_struct[key])
+        authors_data_struct[key]['uuid'] = str(UUIDProvider(f"hal-auth-{identifier}").value())
+        authors_data_struct[key]['identifier'] = identifier
+    pub_uuid = str(UUIDProvider(f"hal-pub-{row['docid']}").value())
+    pub_data_struct = {
+        'uuid': pub_uuid,
+        'docid': row['docid'],
+        'fr_title': row['fr_title'],
+        'en_title': row['en_title'],
+        'fr_subtitle': row['fr_subtitle'],
+        'en_subtitle': row['en_subtitle'],
+        'fr_abstract': row['fr_abstract'],
+        'en_abstract': row['en_abstract'],
+        'fr_keyword': row['fr_keyword'],
+        'en_keyword': row['en_keyword'],
+        'doc_type': row['doc_type'],
+        'publication_date': row['publication_date'],
+        'citation_ref': row['citation_ref'],
+        'citation_full': row['citation_full'],
+        'text_fr_concat': row['text_fr_concat'],
+        'text_en_concat': row['text_en_concat'],
+        'has_authors': list(
+            map(lambda auth: auth['uuid'], authors_data_struct.values()))
+    } | {'has_lab': [], 'has_inst': []}
+    buffer = {}
+    for affiliation in affiliations:
+        is_lab = int(affiliation['lab']) == 1
+        prop_name = 'has_lab' if is_lab else 'has_inst'
+        org_id = affiliation['org_id']
+        hal_id = affiliation['hal_id']
+        if hal_id not in buffer:
+            buffer[hal_id] = []
+        org_uuid = str(UUIDProvider(f"hal-org-{org_id}").value())
+        org = {'id': org_id, 'name': affiliation['org_name'], 'uuid': org_uuid,
+               'lab': str(1 if is_lab else 0)}
+        if is_lab:
+            lab_data_struct[org_id] = org
+        else:
+            inst_data_struct[org_id] = org
+        if org_id in buffer[hal_id]:
             continue
-        sent_counter += num_sents
-        if num_sents > NUMBER_OF_SENTENCES_ALERT_LEVEL and not force:
-            raise RuntimeError(
-                f"abnormal number of sentences : {num_sents} for docid {row['docid']}, stopping the vectorisation, check and launch manually")
-        sbert_embeddings = sbert_model.encode(texts)
-        ada_embeddings = [get_openai_embedding(text) for text in texts] if openai else []
-        fr_text_embedding = None
-        if openai and len(text_fr_concat) > 0:
-            fr_text_embedding = get_openai_embedding(text_fr_concat)
-        en_text_embedding = None
-        if openai and len(text_en_concat) > 0:
-            en_text_embedding = get_openai_embedding(text_en_concat)
-        fr_title_embeddings = None
-        if not pd.isna(row['fr_title']):
-            fr_title_embeddings = sbert_model.encode(row['fr_title'])
-        en_title_embeddings = None
-        if not pd.isna(row['en_title']):
-            en_title_embeddings = sbert_model.encode(row['en_title'])
-        sent_data_structs = list(
-            map(lambda arr: sent_json_object(row, pub_uuid, arr[0], arr[1], arr[2], 'sbert'),
-                zip(range(0, len(texts)), texts, sbert_embeddings))) + list(
-            map(lambda arr: sent_json_object(row, pub_uuid, arr[0], arr[1], arr[2], 'ada'),
-                zip(range(0, len(texts)), texts, ada_embeddings)))
-        if en_text_embedding is not None:
-            pub_data_struct[row['docid']]['text_ada_en_embed'] = list(map(str, list(en_text_embedding)))
-        if fr_text_embedding is not None:
-            pub_data_struct[row['docid']]['text_ada_fr_embed'] = list(map(str, list(fr_text_embedding)))
-        if en_title_embeddings is not None:
-            pub_data_struct[row['docid']]['title_sbert_en_embed'] = list(map(str, list(en_title_embeddings)))
-        if fr_title_embeddings is not None:
-            pub_data_struct[row['docid']]['title_sbert_fr_embed'] = list(map(str, list(fr_title_embeddings)))
-        logger.info(f"Index : {index} Count : {docs_counter}/{total}")
-        logger.debug(f"Word count : {sum([len(i.split(' ')) for i in texts])}")
-        dump_to_json('sent', sent_data_structs, output_dir, suffix='model')
-        dump_to_json('lab', lab_data_struct.values(), output_dir)
-        dump_to_json('inst', inst_data_struct.values(), output_dir)
-        dump_to_json('auth', authors_data_struct.values(), output_dir)
-        dump_to_json('pub', pub_data_struct.values(), output_dir)
-        csv.loc[csv['docid'] == row['docid'], 'created'] = False
-        csv.loc[csv['docid'] == row['docid'], 'updated'] = False
-        if docs_counter % PERSIST_RATE == 0:
-            logger.info(f"Saving csv at index {index} - counter {docs_counter}/{total}")
-            csv.to_csv(file_path, index=False)
-    csv.loc[:, 'created'] = False
-    csv.loc[:, 'updated'] = False
+        buffer[hal_id].append(org_id)
+        pub_data_struct[prop_name].append(org_uuid)
+        authors_data_struct[hal_id][prop_name].append(org_uuid)
+        authors_data_struct[hal_id]['own_inst'] |= (org_id == OWN_INST_ORG_ID)
+    metadata_only = not (row['created'] or row['text_updated'])
+    if metadata_only:
+        pub_data_struct['metadata_only'] = True
+    titles = {lang: row[f"{lang}_title"] for lang in ['fr', 'en'] if not pd.isna(row[f"{lang}_title"])}
+    texts, langs = document_texts(row)
+    return {
+        'docid': row['docid'],
+        'metadata_only': metadata_only,
+        'pub': pub_data_struct,
+        'authors': list(authors_data_struct.values()),
+        'labs': list(lab_data_struct.values()),
+        'insts': list(inst_data_struct.values()),
+        'texts': [] if metadata_only else texts,
+        'text_langs': [] if metadata_only else langs,
+        'titles': [] if metadata_only else list(titles.values()),
+        'title_langs': [] if metadata_only else list(titles.keys()),
+        'concats': [] if metadata_only else [concat for concat in
+                                             [row["text_fr_concat"].strip(), row["text_en_concat"].strip()] if
+                                             len(concat) > 0],
+    }
+
+
+def vectorize_document(document, sbert_embeddings, ada_embeddings=None, collapse_threshold=None):
+    """Attaches sentence and publication vectors to a document
+
+    Vectors are looked up in the embeddings computed for the whole batch of documents,
+    titles and concatenated texts included. With a collapse threshold, a sentence and its translation
+    are indexed as a single sentence, with the mean of their vectors, keeping the translation as alternative text.
+
+    Parameters
+    ----------
+    document : dict, required
+            document as returned by build_document
+    sbert_embeddings : dict, required
+            SBERT vectors by text
+    ada_embeddings : dict, optional
+            ada vectors by text, None if OpenAI embeddings are disabled
+    collapse_threshold : float, optional
+            minimal cosine similarity of the SBERT vectors of a sentence and its translation, None to disable
+    """
+    row = document['pub']
+    pub_uuid = row['uuid']
+    texts = document['texts']
+    text_fr_concat = row["text_fr_concat"].strip()
+    text_en_concat = row["text_en_concat"].strip()
+    if collapse_threshold is None:
+        groups = [[index] for index in range(len(texts))]
+    else:
+        groups = collapse_translations(document['text_langs'], [sbert_embeddings[text] for text in texts],
+                                       collapse_threshold)
+    document['sentences'] = [
+        sent_json_object(row, pub_uuid, sentid, texts[group[0]],
+                         merged_vector([sbert_embeddings[texts[index]] for index in group]), 'sbert',
+                         [texts[index] for index in group[1:]]) for sentid, group in enumerate(groups)]
+    # sentences of a previous vectorization with higher sentids are collected as orphans
+    row['sentence_count'] = len(groups)
+    if ada_embeddings is not None:
+        document['sentences'] += [
+            sent_json_object(row, pub_uuid, sentid, texts[group[0]],
+                             merged_vector([ada_embeddings[texts[index]] for index in group]), 'ada',
+                             [texts[index] for index in group[1:]]) for sentid, group in enumerate(groups)]
+        if len(text_en_concat) > 0:
+            row['text_ada_en_embed'] = np.asarray(ada_embeddings[text_en_concat], dtype=np.float32)
+        if len(text_fr_concat) > 0:
+            row['text_ada_fr_embed'] = np.asarray(ada_embeddings[text_fr_concat], dtype=np.float32)
+    for lang, title in zip(document['title_langs'], document['titles']):
+        row[f"title_sbert_{lang}_embed"] = np.asarray(sbert_embeddings[title], dtype=np.float32)
+
+
+def journal_batch(journal, result, hashes):
+    for docid, status, num_sents in result['docs']:
+        journal.append(docid, hashes[docid])
+
+
+def reconcile(csv, journal, file_path):
+    """Resets the flags of the journaled documents in the CSV file, then empties the journal
+
+    Parameters
+    ----------
+    csv : pd.DataFrame, required
+            publications table
+    journal : ProgressJournal, required
+            progress journal
+    file_path : str, required
+            CSV file path
+    """
+    selection = csv['docid'].isin(journal.docids())
+    logger.info(f"Reconciling {selection.sum()} journaled documents with {file_path}")
+    csv.loc[selection, 'created'] = False
+    csv.loc[selection, 'updated'] = False
+    csv.loc[selection, 'text_updated'] = False
     csv.to_csv(file_path, index=False)
-    MailSender().send_email(type=MailSender.INFO,
-                            text=f"Successful vectorization of {num_docs} documents ({sent_counter} sentences), CSV updated at {file_path} ")
+    journal.clear()
+    journal.close()
 
 
-def dump_to_json(prefix, data, output_dir, suffix=None):
-    for data_struct in data:
-        json_dump = json.dumps(data_struct, indent=4)
-        with open(
-                f"{output_dir}/{prefix}-{str(data_struct['uuid'])}{('-' + data_struct[suffix]) if suffix else ''}.json",
-                "w") as outfile:
-            outfile.write(json_dump)
+def write_metadata(document, writer):
+    writer.write('lab', document['labs'])
+    writer.write('inst', document['insts'])
+    writer.write('auth', document['authors'])
+    writer.write('pub', [document['pub']])
 
 
 if __name__ == '__main__':
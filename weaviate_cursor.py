@@ -0,0 +1,53 @@
+DEFAULT_PAGE_SIZE = 10000
+CURSOR_MIN_VERSION = (1, 18)
+
+
+def supports_cursor(client) -> bool:
+    """Whether the Weaviate server provides the cursor API"""
+    version = client.get_meta()['version']
+    return tuple(int(part) for part in version.split('.')[:2]) >= CURSOR_MIN_VERSION
+
+
+def scan(client, class_name, properties=None, page_size=DEFAULT_PAGE_SIZE, additional=None):
+    """Iterates over all the objects of a class with the cursor API
+
+    Unlike offset pagination, each page costs the same whatever its position. The cursor API requires Weaviate 1.18
+    or later : older servers are paginated by offset, which only reaches the first QUERY_MAXIMUM_RESULTS objects
+    of the class.
+
+    Parameters
+    ----------
+    client : weaviate.Client, required
+            Weaviate client
+    class_name : str, required
+            class to scan
+    properties : list, optional
+            properties to fetch, the uuid is always fetched as _additional.id
+    page_size : int, optional
+            number of objects per request
+    additional : list, optional
+            additional properties to fetch besides the id, such as 'vector'
+
+    Returns
+    -------
+    objects: iterator over the objects as returned by GraphQL
+    """
+    cursor = supports_cursor(client)
+    after = None
+    offset = 0
+    while True:
+        query = client.query.get(class_name, properties or []).with_additional(
+            ["id"] + (additional or [])).with_limit(page_size)
+        if not cursor:
+            query = query.with_offset(offset)
+        elif after is not None:
+            query = query.with_after(after)
+        response = query.do()
+        if response.get('errors', None):
+            raise RuntimeError(f"Unable to scan {class_name} objects : {response['errors']}")
+        items = response['data']['Get'][class_name] or []
+        if len(items) == 0:
+            return
+        yield from items
+        after = items[-1]['_additional']['id']
+        offset += len(items)
@@ -1,26 +1,51 @@
 import argparse
-import glob
-import json
 import logging
 import os
+import queue
+import threading
+import time
 import traceback
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
 from dotenv import dotenv_values
 
 import numpy as np
 import weaviate
 
-from hal_utils import choose_author_identifier
+from embedding_store import read_file, record_files
+from import_manifest import ImportManifest
+from lab_mapping import LabMapping
+from hal_utils import choose_author_identifier, normalize_date
 from log_handler import LogHandler
 from mail_sender import MailSender
+from relation_sync import RelationSync
+from vector_index import load_index_config, class_index_settings, mutable_index_settings
+from weaviate_cursor import scan
 
 weaviate_params = dict(dotenv_values(".env.weaviate"))
 
+logger = logging.getLogger("weaviate_import")
+
 KEYWORDS_SEPARATOR = '§§§'
 
 DEFAULT_INPUT_DIR_NAME = f"{os.path.expanduser('~')}/hal_embeddings"
 
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_WORKERS = 2
+DEFAULT_PARSER_THREADS = 4
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_UPDATE_CONCURRENCY = 8
+
+update_concurrency = DEFAULT_UPDATE_CONCURRENCY
+LOADING_CHUNK_SIZE = 10000
+LOG_SAMPLE_RATE = 1000
+MAX_LOGGED_ERRORS = 20
+
+DENORMALIZED_SENTENCE_PROPERTIES = ['doc_type', 'publication_date', 'own_inst']
+
 SENTENCE_CLASS_NAMES = {
     "ada": "AdaSentence",
     "sbert": "SbertSentence",
@@ -56,6 +81,34 @@ sentence_class = {
             ],
             "description": "Sentence id",
             "name": "sentid"
+        },
+        {
+            "dataType": [
+                "text[]"
+            ],
+            "description": "Translations of the sentence, indexed with the same vector",
+            "name": "alt_texts"
+        },
+        {
+            "dataType": [
+                "string"
+            ],
+            "description": "Hal document type code of the publication, for filtering",
+            "name": "doc_type"
+        },
+        {
+            "dataType": [
+                "date"
+            ],
+            "description": "Publication date of the publication, for filtering",
+            "name": "publication_date"
+        },
+        {
+            "dataType": [
+                "boolean"
+            ],
+            "description": "If one of the authors of the publication belongs to our institution, for filtering",
+            "name": "own_inst"
         }
     ]
 }
@@ -147,6 +200,27 @@ publication_class = {
             ],
             "description": "Hal docid",
             "name": "docid"
+        },
+        {
+            "dataType": [
+                "int"
+            ],
+            "description": "Number of sentences of the last vectorization",
+            "name": "sentence_count"
+        },
+        {
+            "dataType": [
+                "date"
+            ],
+            "description": "Publication date as RFC 3339, for filtering",
+            "name": "normalized_publication_date"
+        },
+        {
+            "dataType": [
+                "boolean"
+            ],
+            "description": "If one of the authors belongs to our institution, for filtering",
+            "name": "own_inst"
         }
     ]
 }
@@ -230,22 +304,71 @@ def get_client():
     return weaviate.Client(weaviate_params['host'], timeout_config=(1000, 1000))
 
 
-def configure(client):
+def configure(client, batch_size=DEFAULT_BATCH_SIZE, num_workers=DEFAULT_BATCH_WORKERS, callback=None):
     client.batch.configure(
-        batch_size=1000,
+        batch_size=batch_size,
         dynamic=True,
         timeout_retries=10,
-        callback=None,
+        num_workers=num_workers,
+        callback=callback,
     )
 
 
-def reset(client):
+class ImportMetrics:
+    """Import throughput, batch latency and failed objects, fed by the batch callback"""
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.objects = 0
+        self.batches = 0
+        self.latency = 0.0
+        self.errors = []
+        self.failed_ids = set()
+
+    def callback(self, results):
+        errors = batch_errors(results)
+        # duration of the last batch request as measured by the client for its dynamic batch sizing
+        creation_time = getattr(self.client.batch, 'creation_time', None)
+        with self.lock:
+            self.batches += 1
+            self.objects += len(results or []) - len(errors)
+            self.latency += creation_time if isinstance(creation_time, (int, float)) else 0.0
+            for error in errors:
+                if len(self.errors) < MAX_LOGGED_ERRORS:
+                    logger.error(f"Object rejected by Weaviate : {error}")
+            self.errors.extend(errors)
+            if len(errors) > 0:
+                self.failed_ids.update(str(result['id']) for result in results if result.get('id', None) is not None
+                                       and (result.get('result', None) or {}).get('errors', None))
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        with self.lock:
+            return f"{self.objects} objects imported in {round(elapsed, 1)}s " \
+                   f"({round(self.objects / elapsed if elapsed > 0 else 0.0, 1)} objects/s), " \
+                   f"{self.batches} batch requests " \
+                   f"(mean latency {round(1000 * self.latency / self.batches if self.batches > 0 else 0.0)} ms), " \
+                   f"{len(self.errors)} failed objects"
+
+
+def sampled(index):
+    return index % LOG_SAMPLE_RATE == 0
+
+
+def with_index(class_definition, index_config):
+    return class_definition | class_index_settings(index_config[class_definition['class']])
+
+
+def reset(client, index_config=None):
+    index_config = index_config or load_index_config()
     client.schema.delete_all()
-    client.schema.create_class(ada_sentence_class)
-    client.schema.create_class(sbert_sentence_class)
-    client.schema.create_class(author_class)
-    client.schema.create_class(organisation_class)
-    client.schema.create_class(publication_class)
+    client.schema.create_class(with_index(ada_sentence_class, index_config))
+    client.schema.create_class(with_index(sbert_sentence_class, index_config))
+    client.schema.create_class(with_index(author_class, index_config))
+    client.schema.create_class(with_index(organisation_class, index_config))
+    client.schema.create_class(with_index(publication_class, index_config))
     client.schema.property.create("AdaSentence", publication_prop)
     client.schema.property.create("SbertSentence", publication_prop)
     client.schema.property.create("Publication", author_prop)
@@ -253,19 +376,82 @@ def reset(client):
     client.schema.property.create("Author", organisation_prop)
 
 
+def apply_index_config(client, index_config):
+    """Applies to the existing classes the vector index parameters that can change without recreating them"""
+    existing = {class_definition['class'] for class_definition in client.schema.get().get('classes', [])}
+    for class_name, params in index_config.items():
+        if class_name not in existing:
+            continue
+        settings = mutable_index_settings(params)
+        if len(settings) > 0:
+            logger.info(f"Updating vector index of class {class_name} : {settings}")
+            client.schema.update_config(class_name, {"vectorIndexConfig": settings})
+
+
+def add_missing_properties(client):
+    """Adds to the existing classes the properties introduced in the schema since their creation"""
+    for class_definition in [publication_class, ada_sentence_class, sbert_sentence_class]:
+        existing = {prop['name'] for prop in client.schema.get(class_definition['class'])['properties']}
+        for prop in class_definition['properties']:
+            if prop['name'] not in existing:
+                logger.info(f"Adding property {prop['name']} to class {class_definition['class']}")
+                client.schema.property.create(class_definition['class'], prop)
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description='Loads HAL bibliographic references, authors and structures to vector database.')
     parser.add_argument('--input_dir', dest='input_dir',
-                        help='Json input files directory', required=False, default=DEFAULT_INPUT_DIR_NAME)
+                        help='Json files or shards input directory', required=False, default=DEFAULT_INPUT_DIR_NAME)
     parser.add_argument('--reset', dest='reset',
                         help='Reset database', required=False, default=False, type=bool)
-    return parser.parse_args()
+    parser.add_argument('--index_config', dest='index_config',
+                        help='JSON file of vector index parameters by class, applied at reset', required=False,
+                        default=None)
+    parser.add_argument('--apply_index_config', action='store_true',
+                        help='Apply the mutable vector index parameters (ef, pq) to the existing classes and exit')
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Initial number of objects per batch request, adjusted dynamically',
+                        required=False, default=DEFAULT_BATCH_SIZE, type=int)
+    parser.add_argument('--batch_workers', dest='batch_workers',
+                        help='Number of concurrent batch requests', required=False, default=DEFAULT_BATCH_WORKERS,
+                        type=int)
+    parser.add_argument('--parser_threads', dest='parser_threads',
+                        help='Number of threads parsing the input files', required=False,
+                        default=DEFAULT_PARSER_THREADS, type=int)
+    parser.add_argument('--queue_size', dest='queue_size',
+                        help='Maximal number of parsed files waiting for their import', required=False,
+                        default=DEFAULT_QUEUE_SIZE, type=int)
+    parser.add_argument('--manifest_file', dest='manifest_file',
+                        help='Manifest of the content hashes of the imported objects', required=False,
+                        default=ImportManifest.DEFAULT_MANIFEST_FILE)
+    parser.add_argument('--no_manifest', action='store_true',
+                        help='Send all the objects, whether they changed or not')
+    parser.add_argument('--verify', action='store_true',
+                        help='Reconcile the manifest with the objects actually present in Weaviate')
+    parser.add_argument('--lab_mapping_file', dest='lab_mapping_file',
+                        help='Lab affiliations of the publications and authors, for lab level expert search',
+                        required=False, default=LabMapping.DEFAULT_MAPPING_FILE)
+    parser.add_argument('--rebuild_lab_mapping', action='store_true',
+                        help='Rebuild the lab mapping from the publications and authors present in Weaviate')
+    parser.add_argument('--denormalize', action='store_true',
+                        help='Update the search filter properties of the existing publications and sentences')
+    parser.add_argument('--relation_concurrency', dest='relation_concurrency',
+                        help='Number of concurrent requests reading and replacing references', required=False,
+                        default=RelationSync.DEFAULT_CONCURRENCY, type=int)
+    parser.add_argument('--update_concurrency', dest='update_concurrency',
+                        help='Number of concurrent requests patching the properties of existing objects',
+                        required=False, default=DEFAULT_UPDATE_CONCURRENCY, type=int)
+    args = parser.parse_args()
+    if args.verify and args.no_manifest:
+        parser.error("--verify reconciles the manifest and cannot be combined with --no_manifest")
+    return args
 
 
 def load_org_data(orgs, client, reset_db=False):
-    for org in orgs:
-        logger.info(f"importing organisation: {org['name']}")
+    for index, org in enumerate(orgs):
+        if sampled(index):
+            logger.info(f"importing organisation: {org['name']} ({index + 1}/{len(orgs)})")
         org_properties = {
             "name": org["name"],
             "identifier": str(org["id"]),
@@ -273,12 +459,12 @@ def load_org_data(orgs, client, reset_db=False):
         }
         clean_properties(org_properties)
         client.batch.add_data_object(org_properties, "Organisation", uuid.UUID(org["uuid"]))
-    client.batch.flush()
 
 
 def load_authors_data(authors, client, reset_db=False):
-    for author in authors:
-        logger.info(f"Importing author: {author['name']}")
+    for index, author in enumerate(authors):
+        if sampled(index):
+            logger.info(f"Importing author: {author['name']} ({index + 1}/{len(authors)})")
         identifier = choose_author_identifier(author)
         author_uuid = uuid.UUID(author["uuid"])
         author_properties = {
@@ -293,46 +479,40 @@ def load_authors_data(authors, client, reset_db=False):
                 client.batch.add_reference(author["uuid"], 'Author', 'hasOrganisations', org, 'Organisation')
             for org in author.get('has_inst', []):
                 client.batch.add_reference(author["uuid"], 'Author', 'hasOrganisations', org, 'Organisation')
-    client.batch.flush()
-
-
-def update_authors_relations(authors, client, reset_db=False):
-    assert reset_db is False
-    for author in authors:
-        logger.info(f"Updating author's relations : {author['name']}")
-        client.data_object.reference.update(
-            from_uuid=author["uuid"],
-            from_property_name='hasOrganisations',
-            to_uuids=author.get('has_lab', []),
-            from_class_name='Author',
-            to_class_names='Organisation',
-        )
-        client.data_object.reference.update(
-            from_uuid=author["uuid"],
-            from_property_name='hasOrganisations',
-            to_uuids=author.get('has_inst', []),
-            from_class_name='Author',
-            to_class_names='Organisation',
-        )
+
+
+def author_relations(author):
+    return 'Author', {
+        'hasOrganisations': ('Organisation', author.get('has_lab', []) + author.get('has_inst', [])),
+    }
 
 
 def load_publication_data(publications, client, reset_db=False):
-    for publication in publications:
-        logger.info(f"Importing publication: {str(publication['docid'])}")
+    metadata_updates = []
+    for index, publication in enumerate(publications):
+        if sampled(index):
+            logger.info(f"Importing publication: {str(publication['docid'])} ({index + 1}/{len(publications)})")
         publication_uuid = uuid.UUID(publication["uuid"])
         publication_properties = {key: publication[key] for key in publication.keys()
                                   & {'docid', 'fr_title', 'en_title', 'fr_subtitle', 'en_subtitle', 'fr_abstract',
                                      'en_abstract', 'fr_keyword', 'en_keyword', 'doc_type',
-                                     'citation_ref', 'citation_full', 'publication_date'}}
+                                     'citation_ref', 'citation_full', 'publication_date', 'sentence_count',
+                                     'own_inst'}}
         split_keywords(publication_properties, 'fr_keyword')
         split_keywords(publication_properties, 'en_keyword')
-        vector = publication.get("text_ada_en_embed", None) or publication.get("text_ada_fr_embed",
-                                                                               None) or publication.get(
-            "title_sbert_en_embed", None) or publication.get("title_sbert_fr_embed", None)
+        publication_properties['normalized_publication_date'] = normalize_date(
+            publication.get('publication_date', None))
+        vector = next((publication[key] for key in
+                       ["text_ada_en_embed", "text_ada_fr_embed", "title_sbert_en_embed", "title_sbert_fr_embed"]
+                       if publication.get(key, None) is not None), None)
         clean_properties(publication_properties)
         if vector is not None:
             vector = list(map(float, vector))
-        client.batch.add_data_object(publication_properties, "Publication", publication_uuid, vector)
+        if publication.get('metadata_only', False) and not reset_db:
+            # texts are unchanged : merge the properties and keep the vector already stored
+            metadata_updates.append((publication_uuid, publication_properties, vector))
+        else:
+            client.batch.add_data_object(publication_properties, "Publication", publication_uuid, vector)
         if reset_db:
             for org in publication.get('has_lab', []):
                 client.batch.add_reference(publication["uuid"], 'Publication', 'hasOrganisations', org,
@@ -343,46 +523,36 @@ def load_publication_data(publications, client, reset_db=False):
             for auth in publication.get('has_authors', []):
                 client.batch.add_reference(publication["uuid"], 'Publication', 'hasAuthors', auth,
                                            'Author')
-    client.batch.flush()
-
-
-def update_publication_relations(publications, client, reset_db=False):
-    assert reset_db is False
-    for publication in publications:
-        logger.info(f"Updating publication's relations : {str(publication['docid'])}")
-        client.data_object.reference.update(
-            from_uuid=publication["uuid"],
-            from_property_name='hasOrganisations',
-            to_uuids=publication.get('has_lab', []),
-            from_class_name='Publication',
-            to_class_names='Organisation',
-        )
-        client.data_object.reference.update(
-            from_uuid=publication["uuid"],
-            from_property_name='hasOrganisations',
-            to_uuids=publication.get('has_inst', []),
-            from_class_name='Publication',
-            to_class_names='Organisation',
-        )
-        client.data_object.reference.update(
-            from_uuid=publication["uuid"],
-            from_property_name='hasAuthors',
-            to_uuids=publication.get('has_authors', []),
-            from_class_name='Publication',
-            to_class_names='Author',
-        )
+    if len(metadata_updates) > 0:
+        with ThreadPoolExecutor(max_workers=update_concurrency, thread_name_prefix="patch-pub") as executor:
+            found = list(executor.map(lambda update: patch_object(client, "Publication", str(update[0]), update[1]),
+                                      metadata_updates))
+        # publications missing from the database are created, with the vector of the export if any
+        for (publication_uuid, publication_properties, vector), exists in zip(metadata_updates, found):
+            if not exists:
+                client.batch.add_data_object(publication_properties, "Publication", publication_uuid, vector)
+
+
+def publication_relations(publication):
+    return 'Publication', {
+        'hasOrganisations': ('Organisation', publication.get('has_lab', []) + publication.get('has_inst', [])),
+        'hasAuthors': ('Author', publication.get('has_authors', [])),
+    }
 
 
 def load_sent_data(sentences, client, reset_db=False):
-    for sentence in sentences:
-        logger.info(f"Importing sentence: {sentence['text']}")
+    for index, sentence in enumerate(sentences):
+        if sampled(index):
+            logger.info(f"Importing sentence: {sentence['text']} ({index + 1}/{len(sentences)})")
         sentence_uuid = uuid.UUID(sentence["uuid"])
         sentence_properties = {
             "model": sentence["model"],
             "docid": sentence["docid"],
             "sentid": int(sentence["sentid"]),
             "text": sentence["text"],
-        }
+        } | {key: sentence[key] for key in DENORMALIZED_SENTENCE_PROPERTIES if sentence.get(key, None) is not None}
+        if len(sentence.get('alt_texts', None) or []) > 0:
+            sentence_properties['alt_texts'] = sentence['alt_texts']
         clean_properties(sentence_properties)
         client.batch.add_data_object(sentence_properties, SENTENCE_CLASS_NAMES[sentence["model"]], sentence_uuid,
                                      list(map(float, sentence["vector"])))
@@ -390,22 +560,112 @@ def load_sent_data(sentences, client, reset_db=False):
             client.batch.add_reference(sentence["uuid"], SENTENCE_CLASS_NAMES[sentence["model"]], 'hasPublication',
                                        sentence['pub_uuid'],
                                        'Publication')
-    client.batch.flush()
 
 
-def update_sentence_relations(sentences, client, reset_db=False):
-    assert reset_db is False
-    for sentence in sentences:
-        logger.info(f"Updating sentences relations: {sentence['text']}")
-        pub_uuid = sentence.get('pub_uuid', None)
-        assert pub_uuid is not None
-        client.data_object.reference.update(
-            from_uuid=sentence["uuid"],
-            from_property_name='hasPublication',
-            to_uuids=[pub_uuid],
-            from_class_name=SENTENCE_CLASS_NAMES[sentence["model"]],
-            to_class_names='Publication',
-        )
+def sentence_relations(sentence):
+    pub_uuid = sentence.get('pub_uuid', None)
+    assert pub_uuid is not None
+    return SENTENCE_CLASS_NAMES[sentence["model"]], {
+        'hasPublication': ('Publication', [pub_uuid]),
+    }
+
+
+def patch_object(client, class_name, object_uuid, properties):
+    """Merges properties into an existing object, its vector and references being kept
+
+    Returns
+    -------
+    found: bool False if the object does not exist
+    """
+    try:
+        client.data_object.update(data_object=properties, class_name=class_name, uuid=object_uuid)
+        return True
+    except weaviate.exceptions.UnexpectedStatusCodeException as e:
+        if e.status_code != 404:
+            raise
+        return False
+
+
+def denormalized_changes(client, publications, page_size):
+    """Properties to patch on the sentences whose denormalized values differ from those of their publication
+
+    Returns
+    -------
+    changes: iterator over (class name, sentence uuid, properties) tuples
+    """
+    for sentence_class in SENTENCE_CLASS_NAMES.values():
+        for item in scan(client, sentence_class, DENORMALIZED_SENTENCE_PROPERTIES +
+                         ["hasPublication { ... on Publication { _additional { id } } }"], page_size):
+            pub_uuid = next((pub['_additional']['id'] for pub in item.get('hasPublication', None) or []), None)
+            expected = {key: value for key, value in publications.get(pub_uuid, {}).items() if value is not None}
+            changes = {key: value for key, value in expected.items() if item.get(key, None) != value}
+            if len(changes) > 0:
+                yield sentence_class, item['_additional']['id'], changes
+
+
+def denormalize_filters(client, page_size, concurrency=DEFAULT_UPDATE_CONCURRENCY):
+    """Sets the own_inst flag of the publications and copies onto the sentences the publication properties used as
+    search filters, where they differ
+
+    Only the differing properties are patched, with concurrent requests. own_inst is the single definition of
+    the affiliation of a publication : at least one of its authors is flagged by own_inst_patch.py.
+
+    Returns
+    -------
+    publications_counter, sentences_counter: int numbers of updated publications and sentences
+    """
+    publications = {}
+    publication_changes = []
+    for item in scan(client, "Publication", ["doc_type", "publication_date", "normalized_publication_date",
+                                             "own_inst", "hasAuthors { ... on Author { own_inst } }"], page_size):
+        publications[item['_additional']['id']] = {
+            'doc_type': item.get('doc_type', None),
+            'publication_date': normalize_date(item.get('publication_date', None)),
+            'own_inst': any(author.get('own_inst', None) is True for author in item.get('hasAuthors', None) or []),
+        }
+        expected = {'normalized_publication_date': publications[item['_additional']['id']]['publication_date'],
+                    'own_inst': publications[item['_additional']['id']]['own_inst']}
+        changes = {key: value for key, value in expected.items()
+                   if value is not None and item.get(key, None) != value}
+        if len(changes) > 0:
+            publication_changes.append(("Publication", item['_additional']['id'], changes))
+    publications_counter, sentences_counter = 0, 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="denormalize") as executor:
+        for class_name, found in bounded_map(
+                executor, lambda change: (change[0], patch_object(client, *change)),
+                chain(publication_changes, denormalized_changes(client, publications, page_size)), concurrency * 4):
+            if not found:
+                continue
+            if class_name == "Publication":
+                publications_counter += 1
+                continue
+            sentences_counter += 1
+            if sampled(sentences_counter):
+                logger.info(f"{sentences_counter} sentences denormalized")
+    return publications_counter, sentences_counter
+
+
+def rebuild_lab_mapping(client, lab_mapping, page_size):
+    """Rebuilds the lab mapping from the organisation references of the publications and authors in Weaviate
+
+    Returns
+    -------
+    labs, publications, authors: int numbers of labs, of publications and of authors affiliated to a lab
+    """
+    organisations_field = "hasOrganisations { ... on Organisation { _additional { id } } }"
+    labs = [(item['_additional']['id'], item.get('identifier', None), item.get('name', None)) for item in
+            scan(client, "Organisation", ["identifier", "name", "type"], page_size) if item.get('type', None) == 'lab']
+    lab_uuids = {lab_uuid for lab_uuid, _, _ in labs}
+
+    def affiliations(class_name, key_property):
+        return [(str(item[key_property]), org['_additional']['id']) for item in
+                scan(client, class_name, [key_property, organisations_field], page_size)
+                for org in item.get('hasOrganisations', None) or [] if org['_additional']['id'] in lab_uuids]
+
+    publication_labs = affiliations("Publication", "docid")
+    author_labs = affiliations("Author", "identifier")
+    lab_mapping.rebuild(labs, publication_labs, author_labs)
+    return len(labs), len({docid for docid, _ in publication_labs}), len({author for author, _ in author_labs})
 
 
 def split_keywords(publication_properties, keywords_key):
@@ -425,60 +685,398 @@ def move_files(processed_files):
         Path(processed_file).rename(f"{Path(processed_file).parent}/processed/{Path(processed_file).name}")
 
 
-def load_data_from_file_system(client, file_prefix, loading_function, input_dir, processed_files, reset_db=False):
+def bounded_map(executor, function, items, max_in_flight):
+    """Ordered executor map that submits no more than max_in_flight items ahead of the consumer"""
+    in_flight = deque()
+    for item in items:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+        in_flight.append(executor.submit(function, item))
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def read_input_records(input_dir, file_prefix, processed_files, parser_threads=DEFAULT_PARSER_THREADS,
+                       queue_size=DEFAULT_QUEUE_SIZE):
+    """Reads the objects of a prefix, each file being parsed once, ahead, by a pool of threads
+
+    Returns
+    -------
+    records: iterator over the objects
+    """
+    with ThreadPoolExecutor(max_workers=parser_threads, thread_name_prefix=f"parse-{file_prefix}") as executor:
+        for records, files in bounded_map(executor, read_file, record_files(input_dir, file_prefix), queue_size):
+            yield from records
+            processed_files.update(files)
+
+
+def merge_organisations(existing, organisation):
+    return existing
+
+
+def merge_authors(existing, author):
+    """Merges two occurrences of an author, coming from different publications"""
+    return existing | {
+        'own_inst': existing.get('own_inst', False) is True or author.get('own_inst', False) is True,
+        'has_lab': list(dict.fromkeys(existing.get('has_lab', []) + author.get('has_lab', []))),
+        'has_inst': list(dict.fromkeys(existing.get('has_inst', []) + author.get('has_inst', []))),
+    }
+
+
+def chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def record_class(file_prefix, record):
+    if file_prefix == 'sent':
+        return SENTENCE_CLASS_NAMES[record["model"]]
+    return {'inst': 'Organisation', 'lab': 'Organisation', 'auth': 'Author', 'pub': 'Publication'}[file_prefix]
+
+
+def fill_own_inst(file_prefix, records, own_inst_flags):
+    """Sets own_inst on the publications and sentences from the flags of the authors imported in the same run
+
+    A publication belongs to the institution if one of its authors does, its sentences inherit its flag, so that
+    objects replaced by the batch keep a flag consistent with their authors until own_inst_patch.py and
+    --denormalize refresh it.
+
+    Parameters
+    ----------
+    file_prefix : str, required
+            import step of the objects
+    records : list, required
+            objects as read from the vectorization output
+    own_inst_flags : dict, required
+            flags of the authors and publications already imported by uuid, completed with those of the records
+    """
+    if file_prefix == 'auth':
+        own_inst_flags.update({str(author['uuid']): author.get('own_inst', False) is True for author in records})
+    elif file_prefix == 'pub':
+        for publication in records:
+            publication['own_inst'] = any(own_inst_flags.get(str(author_uuid), False)
+                                          for author_uuid in publication.get('has_authors', []))
+            own_inst_flags[str(publication['uuid'])] = publication['own_inst']
+    elif file_prefix == 'sent':
+        for sentence in records:
+            own_inst = own_inst_flags.get(str(sentence.get('pub_uuid', None)), None)
+            if own_inst is not None:
+                sentence['own_inst'] = own_inst
+
+
+def import_step(client, records, step, relation_sync, reset_db=False, manifest=None, metrics=None,
+                lab_mapping=None, own_inst_flags=None):
+    """Imports the objects of a step and synchronizes their relations from the same in-memory records
+
+    Objects are deduplicated by class and uuid before being sent : entities shared by many publications
+    (organisations, authors) are merged over the whole step, while publications and sentences are streamed by
+    chunks, the last occurrence of a repeated object within a chunk replacing the previous ones and a later chunk
+    sending it again over the earlier version. With a manifest, objects whose content and vectors did not change
+    since their last import are not sent at all.
+
+    Parameters
+    ----------
+    client : weaviate.Client, required
+            Weaviate client
+    records : Iterable, required
+            objects of the step
+    step : tuple, required
+            prefix, loading function, relations function and merge function of two occurrences of an object,
+            None for the objects that are not merged over the whole step
+    relation_sync : RelationSync, required
+            relation synchronizer
+    reset_db : bool, optional
+            the database has just been reset, relations are created with the objects
+    manifest : ImportManifest, optional
+            manifest of the imported objects
+    metrics : ImportMetrics, optional
+            import metrics, objects rejected by Weaviate are not recorded in the manifest
+    lab_mapping : LabMapping, optional
+            lab affiliations of the publications and authors, recorded whether the objects changed or not
+    own_inst_flags : dict, optional
+            own_inst flags shared by the steps of an import, see fill_own_inst
+
+    Returns
+    -------
+    counter: int number of imported objects
+    """
+    file_prefix, loading_function, relations_function, merge_function = step
+    duplicates = 0
+    unchanged = 0
+    if merge_function is not None:
+        # organisations and authors are few enough to be merged over the whole step
+        entities = {}
+        for record in records:
+            key = (record_class(file_prefix, record), str(record['uuid']))
+            if key in entities:
+                duplicates += 1
+                entities[key] = merge_function(entities[key], record)
+            else:
+                entities[key] = record
+        records = entities.values()
+    counter = 0
+    for chunk in chunks(records, LOADING_CHUNK_SIZE):
+        latest = {(record_class(file_prefix, record), str(record['uuid'])): record for record in chunk}
+        duplicates += len(chunk) - len(latest)
+        data = list(latest.values())
+        if own_inst_flags is not None:
+            fill_own_inst(file_prefix, data, own_inst_flags)
+        if lab_mapping is not None:
+            lab_mapping.record(file_prefix, data)
+        if manifest is not None:
+            entries = [(record_class(file_prefix, record), str(record['uuid'])) + ImportManifest.hashes(record) for
+                       record in data]
+            changed = manifest.changed(entries)
+            changed_keys = {(class_name, uuid) for class_name, uuid, _, _ in changed}
+            unchanged += len(data) - len(changed)
+            data = [record for record, entry in zip(data, entries) if entry[:2] in changed_keys]
+        if len(data) == 0:
+            continue
+        loading_function(data, client, reset_db)
+        # the objects must exist before their references are synchronized
+        client.batch.flush()
+        if not reset_db and relations_function is not None:
+            relation_sync.sync(data, relations_function)
+        if manifest is not None:
+            failed_ids = metrics.failed_ids if metrics is not None else set()
+            manifest.put_many([entry for entry in changed if entry[1] not in failed_ids])
+        counter += len(data)
+    if duplicates > 0:
+        logger.info(f"{duplicates} duplicate {file_prefix} objects merged or replaced")
+    if unchanged > 0:
+        logger.info(f"{unchanged} unchanged {file_prefix} objects skipped according to the manifest")
+    return counter
+
+
+def verify_manifest(client, manifest):
+    """Forgets the manifest entries of the objects missing from Weaviate, so that they are sent again
+
+    Returns
+    -------
+    removed: int number of removed entries
+    """
+    removed = 0
+    for class_name in manifest.classes():
+        existing = {item['_additional']['id'] for item in scan(client, class_name)}
+        missing = manifest.uuids(class_name) - existing
+        logger.info(f"{class_name} : {len(existing)} objects in Weaviate, {len(missing)} missing from the manifest")
+        manifest.remove_many(class_name, missing)
+        removed += len(missing)
+    return removed
+
+
+IMPORT_STEPS = [
+    ('inst', load_org_data, None, merge_organisations),
+    ('lab', load_org_data, None, merge_organisations),
+    ('auth', load_authors_data, author_relations, merge_authors),
+    ('pub', load_publication_data, publication_relations, None),
+    ('sent', load_sent_data, sentence_relations, None),
+]
+
+
+def batch_errors(results):
+    """Extracts the error messages of the objects and references rejected by a batch request
+
+    Parameters
+    ----------
+    results : list, required
+            results of a batch request as passed to the batch callback
+
+    Returns
+    -------
+    errors: list of error messages
+    """
+    errors = []
+    for result in results or []:
+        result_errors = (result.get('result', None) or {}).get('errors', None)
+        if result_errors:
+            errors.extend(error.get('message', str(error)) for error in result_errors.get('error', []))
+    return errors
+
+
+def import_records(client, records, reset_db=False, manifest=None, metrics=None, lab_mapping=None):
+    """Imports vectorized objects held in memory, organisations and authors before publications and sentences
+
+    Parameters
+    ----------
+    client : weaviate.Client, required
+            Weaviate client
+    records : dict, required
+            lists of objects by prefix
+    reset_db : bool, optional
+            the database has just been reset, relations are created with the objects
+    manifest : ImportManifest, optional
+            manifest of the imported objects
+    metrics : ImportMetrics, optional
+            import metrics
+    lab_mapping : LabMapping, optional
+            lab affiliations of the publications and authors
+
+    Returns
+    -------
+    counter: int number of imported objects
+    """
     counter = 0
-    data = []
-    for f in glob.glob(f"{input_dir}/{file_prefix}*.json"):
-        with open(f, ) as infile:
-            logger.debug(f"Loading {str(infile.name)} ({counter})")
-            data.append(json.load(infile))
-            counter = counter + 1
-        if counter % 10000 == 0:
-            loading_function(data, client, reset_db)
-            data = []
-        processed_files.add(f)
-    loading_function(data, client, reset_db)
+    relation_sync = RelationSync(client, logger)
+    own_inst_flags = {}
+    for step in IMPORT_STEPS:
+        counter += import_step(client, records.get(step[0], []), step, relation_sync, reset_db, manifest, metrics,
+                               lab_mapping, own_inst_flags)
+    return counter
+
+
+class StreamingImporter(threading.Thread):
+    """Imports vectorized objects handed over through a bounded queue, concurrently with their production
+
+    Producers block when the queue is full. Each item is acknowledged through the on_imported callback only
+    once all its objects and relations have been flushed to Weaviate without error.
+    """
+    POLL_TIMEOUT_SECS = 1
+
+    def __init__(self, client, queue_size, on_imported, manifest_file=None,
+                 lab_mapping_file=LabMapping.DEFAULT_MAPPING_FILE) -> None:
+        super().__init__(name="weaviate-importer", daemon=True)
+        self.client = client
+        self.manifest_file = manifest_file
+        self.lab_mapping_file = lab_mapping_file
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.on_imported = on_imported
+        self.metrics = ImportMetrics(client)
+        self.failure = None
+        self.counter = 0
+        self.stopping = threading.Event()
+        configure(client, callback=self.metrics.callback)
+        add_missing_properties(client)
+
+    def submit(self, item):
+        """Queues an item, blocks while the queue is full
+
+        Parameters
+        ----------
+        item : dict, required
+                item with the objects to import by prefix under the 'output' key
+        """
+        while True:
+            if self.failure is not None:
+                raise RuntimeError(f"Weaviate import failure : {self.failure}") from self.failure
+            try:
+                self.queue.put(item, timeout=self.POLL_TIMEOUT_SECS)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        # the SQLite connections of the manifest and lab mapping must belong to the importer thread
+        manifest = ImportManifest(self.manifest_file) if self.manifest_file is not None else None
+        lab_mapping = LabMapping(self.lab_mapping_file)
+        try:
+            self.import_queued(manifest, lab_mapping)
+        finally:
+            if manifest is not None:
+                manifest.close()
+            lab_mapping.close()
+
+    def import_queued(self, manifest, lab_mapping):
+        while not self.stopping.is_set():
+            try:
+                item = self.queue.get(timeout=self.POLL_TIMEOUT_SECS)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            try:
+                self.counter += import_records(self.client, item['output'], manifest=manifest, metrics=self.metrics,
+                                               lab_mapping=lab_mapping)
+                errors = self.metrics.errors
+                if len(errors) > 0:
+                    raise RuntimeError(f"{len(errors)} objects rejected by Weaviate, first error : {errors[0]}")
+                self.on_imported(item)
+            except Exception as e:
+                logger.exception(f"Weaviate import failure : {e}")
+                self.failure = e
+                return
+
+    def close(self):
+        """Waits for the queued items to be imported"""
+        self.submit(None)
+        self.join()
+        if self.failure is not None:
+            raise RuntimeError(f"Weaviate import failure : {self.failure}") from self.failure
+
+    def stop(self):
+        """Waits for the item being imported, if any, the items still queued being dropped"""
+        self.stopping.set()
+        self.join()
 
 
 def main(args):
-    global logger
+    global logger, update_concurrency
     logger = LogHandler("weaviate_import", 'log', 'weaviate_import.log', logging.INFO).create_rotating_log()
     client = get_client()
-    files_counter = 0
+    metrics = ImportMetrics(client)
+    configure(client, args.batch_size, args.batch_workers, metrics.callback)
+    relation_sync = RelationSync(client, logger, args.relation_concurrency)
+    update_concurrency = args.update_concurrency
+    manifest = None if args.no_manifest else ImportManifest(args.manifest_file)
+    lab_mapping = LabMapping(args.lab_mapping_file)
+    index_config = load_index_config(args.index_config)
+    if args.apply_index_config:
+        apply_index_config(client, index_config)
+        return
+    if args.rebuild_lab_mapping:
+        labs, publications, authors = rebuild_lab_mapping(client, lab_mapping, DEFAULT_BATCH_SIZE)
+        lab_mapping.close()
+        message = f"Lab mapping rebuilt : {labs} labs, {publications} publications, {authors} authors"
+        logger.info(message)
+        MailSender().send_email(type=MailSender.INFO, text=message)
+        return
+    if args.denormalize:
+        add_missing_properties(client)
+        publications_counter, sentences_counter = denormalize_filters(client, DEFAULT_BATCH_SIZE,
+                                                                      args.update_concurrency)
+        message = f"{publications_counter} publications and {sentences_counter} sentences updated with the " \
+                  f"current values of the search filters"
+        logger.info(message)
+        MailSender().send_email(type=MailSender.INFO, text=message)
+        return
+    if args.verify:
+        removed = verify_manifest(client, manifest)
+        message = f"Manifest verified against Weaviate : {removed} entries of missing objects removed"
+        logger.info(message)
+        MailSender().send_email(type=MailSender.INFO, text=message)
+        return
+    items_counter = 0
     if args.reset == True:
         logger.info("Resetting weaviate database")
-        reset(client)
+        reset(client, index_config)
+        if manifest is not None:
+            manifest.clear()
+        lab_mapping.clear()
+    else:
+        add_missing_properties(client)
     input_dir = args.input_dir
     processed_dir = f"{input_dir}/processed"
     Path(processed_dir).mkdir(parents=True, exist_ok=True)
-    processed_files = set()
-    load_data_from_file_system(client, 'inst', load_org_data, input_dir, processed_files, args.reset)
-    move_files(processed_files)
-    files_counter += len(processed_files)
-    processed_files = set()
-    load_data_from_file_system(client, 'lab', load_org_data, input_dir, processed_files, args.reset)
-    move_files(processed_files)
-    files_counter += len(processed_files)
-    processed_files = set()
-    load_data_from_file_system(client, 'auth', load_authors_data, input_dir, processed_files, args.reset)
-    if not args.reset:
-        load_data_from_file_system(client, 'auth', update_authors_relations, input_dir, processed_files)
-    move_files(processed_files)
-    files_counter += len(processed_files)
-    processed_files = set()
-    load_data_from_file_system(client, 'pub', load_publication_data, input_dir, processed_files, args.reset)
-    if not args.reset:
-        load_data_from_file_system(client, 'pub', update_publication_relations, input_dir, processed_files)
-    move_files(processed_files)
-    files_counter += len(processed_files)
-    processed_files = set()
-    load_data_from_file_system(client, 'sent', load_sent_data, input_dir, processed_files, args.reset)
-    if not args.reset:
-        load_data_from_file_system(client, 'sent', update_sentence_relations, input_dir, processed_files)
-    move_files(processed_files)
-    files_counter += len(processed_files)
-    MailSender().send_email(type=MailSender.INFO,
-                            text=f"Successfully loaded {files_counter} items in Weaviate database")
+    own_inst_flags = {}
+    for step in IMPORT_STEPS:
+        file_prefix = step[0]
+        processed_files = set()
+        records = read_input_records(input_dir, file_prefix, processed_files, args.parser_threads, args.queue_size)
+        items_counter += import_step(client, records, step, relation_sync, args.reset, manifest, metrics,
+                                     lab_mapping, own_inst_flags)
+        move_files(processed_files)
+        logger.info(f"{file_prefix} step done : {metrics.report()}")
+        logger.info(relation_sync.report())
+    report = metrics.report()
+    logger.info(report)
+    MailSender().send_email(type=MailSender.ERROR if len(metrics.errors) > 0 else MailSender.INFO,
+                            text=f"Loaded {items_counter} items in Weaviate database\n{report}")
 
 
 if __name__ == '__main__':